@@ -22,6 +22,9 @@ from tools.misc import ImmutableMapping
 
 class TestAuth(Tester):
 
+    # logging in again must re-authenticate against the current roles
+    cache_cql_sessions = False
+
     ignore_log_patterns = (
         # This one occurs if we do a non-rolling upgrade, the node
         # it's trying to send the migration to hasn't started yet,
@@ -1137,6 +1140,9 @@ class TestAuthRoles(Tester):
     """
     @jira_ticket CASSANDRA-7653
     """
+    # logging in again must re-authenticate against the current roles
+    cache_cql_sessions = False
+
     if CASSANDRA_VERSION_FROM_BUILD >= '3.0':
         cluster_options = ImmutableMapping({'enable_user_defined_functions': 'true',
                                             'enable_scripted_user_defined_functions': 'true'})
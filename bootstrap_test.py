@@ -114,6 +114,7 @@ class BaseBootstrapTest(Tester):
 
 class TestBootstrap(BaseBootstrapTest):
     __test__ = True
+    hardcoded_addresses = True  # watches the log for a node by address
 
     @no_vnodes()
     def simple_bootstrap_test_with_ssl(self):
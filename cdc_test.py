@@ -205,6 +205,7 @@ class TestCDC(Tester):
     Test the correctness of some features of CDC, Change Data Capture, which
     provides a view of the commitlog on tables for which it is enabled.
     """
+    hardcoded_addresses = True  # the added node is given a fixed address
 
     def _create_temp_dir(self, dir_name, verbose=True):
         """
@@ -23,6 +23,7 @@ def wait(delay=2):
 
 @skip('awaiting CASSANDRA-10699')
 class TestConcurrentSchemaChanges(Tester):
+    hardcoded_addresses = True  # added nodes are given fixed addresses
     allow_log_errors = True
 
     def prepare_for_changes(self, session, namespace='ns1'):
@@ -14,6 +14,7 @@ class TestCqlTracing(Tester):
     # TODO write a mock Tracing implementation and assert, at least, it can be
     #      instantiated when specified as a custom tracing implementation.
     """
+    hardcoded_addresses = True  # expected traces name the nodes by address
 
     def prepare(self, create_keyspace=True, nodes=3, rf=3, protocol_version=3, jvm_args=None, **kwargs):
         if jvm_args is None:
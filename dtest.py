@@ -1,9 +1,12 @@
 from __future__ import with_statement
 
+import atexit
 import ConfigParser
 import copy
 import errno
 import glob
+import hashlib
+import json
 import logging
 import os
 import pprint
@@ -42,18 +45,24 @@ from plugins.dtestconfig import _CONFIG as CONFIG
 # We don't want test files to know about the plugins module, so we import
 # constants here and re-export them.
 from plugins.dtestconfig import GlobalConfigObject
+from plugins.dtestphases import time_method_as_phase, timed_phase
 from tools.context import log_filter
 from tools.funcutils import merge_dicts
+from tools.logbus import stop_log_buses
+from tools.logscan import combine_patterns, grep_log_for_new_errors
+from tools.logwatch import LogWatcher
+from tools.nativetransport import wait_for_native_transport
 
-LOG_SAVED_DIR = "logs"
+# run_dtests.py --workers points these elsewhere for each worker process
+LOG_SAVED_DIR = os.environ.get('LOG_SAVED_DIR', "logs")
 try:
-    os.mkdir(LOG_SAVED_DIR)
+    os.makedirs(LOG_SAVED_DIR)
 except OSError:
     pass
 
 LAST_LOG = os.path.join(LOG_SAVED_DIR, "last")
 
-LAST_TEST_DIR = 'last_test_dir'
+LAST_TEST_DIR = os.environ.get('LAST_TEST_DIR', 'last_test_dir')
 
 DEFAULT_DIR = './'
 config = ConfigParser.RawConfigParser()
@@ -75,6 +84,18 @@ IGNORE_REQUIRE = os.environ.get('IGNORE_REQUIRE', '').lower() in ('yes', 'true')
 DATADIR_COUNT = os.environ.get('DATADIR_COUNT', '3')
 ENABLE_ACTIVE_LOG_WATCHING = os.environ.get('ENABLE_ACTIVE_LOG_WATCHING', '').lower() in ('yes', 'true')
 RUN_STATIC_UPGRADE_MATRIX = os.environ.get('RUN_STATIC_UPGRADE_MATRIX', '').lower() in ('yes', 'true')
+UPGRADE_BATCH = os.environ.get('UPGRADE_BATCH', '').lower() in ('yes', 'true')
+ENABLE_CLUSTER_TEMPLATES = os.environ.get('ENABLE_CLUSTER_TEMPLATES', '').lower() in ('yes', 'true')
+CACHE_CQL_SESSIONS = os.environ.get('CACHE_CQL_SESSIONS', '').lower() in ('yes', 'true')
+JOLOKIA_AT_START = os.environ.get('JOLOKIA_AT_START', '').lower() in ('yes', 'true')
+SAMPLE_METRICS = os.environ.get('SAMPLE_METRICS', '').lower() in ('yes', 'true')
+METRICS_SAMPLE_INTERVAL = float(os.environ.get('METRICS_SAMPLE_INTERVAL', '1'))
+RECORD_JFR = os.environ.get('RECORD_JFR', '').lower() in ('yes', 'true')
+CLUSTER_TEMPLATE_DIR = os.environ.get('CLUSTER_TEMPLATE_DIR')
+# Clusters started by processes using different address blocks don't collide:
+# nodes listen on 127.0.<block>.x and their JMX and byteman ports are shifted by <block>.
+ADDRESS_BLOCK = int(os.environ.get('ADDRESS_BLOCK', '0'))
+CLUSTER_IP_PREFIX = '127.0.{}.'.format(ADDRESS_BLOCK)
 
 # devault values for configuration from configuration plugin
 _default_config = GlobalConfigObject(
@@ -276,11 +297,72 @@ def make_execution_profile(retry_policy=FlakyRetryPolicy(), consistency_level=Co
                             **kwargs)
 
 
+class SessionCache(object):
+    """
+    The driver sessions a test opened with Tester.cql_connection and friends,
+    so that asking again for a connection with the same parameters returns
+    the live session instead of paying for a new control connection and
+    schema metadata fetch.
+
+    A session is only handed out again while the node it was opened against
+    keeps running the same process; once the node is stopped the session is
+    forgotten, though not shut down, since the test may still hold it. The
+    test's default_fetch_size changes are undone before a session is reused.
+    Sessions are shut down with the rest of the test's connections.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+
+    @staticmethod
+    def key(node, keyspace, user, password, compression, protocol_version, port, ssl_opts, kwargs):
+        """
+        Returns a hashable key for the connection parameters, or None if the
+        session can't be cached, e.g. because it uses a custom policy object.
+        """
+        def hashable(value):
+            if isinstance(value, WhiteListRoundRobinPolicy):
+                return ('WhiteListRoundRobinPolicy', value._allowed_hosts)
+            if isinstance(value, dict):
+                return tuple(sorted((k, hashable(v)) for k, v in value.items()))
+            if value is None or isinstance(value, (basestring, int, long, float, bool, tuple, types.FunctionType)):
+                return value
+            raise TypeError('Cannot cache sessions using {!r}'.format(value))
+
+        try:
+            return (node.name, get_ip_from_node(node), keyspace, user, password, compression, protocol_version, port,
+                    hashable(ssl_opts), hashable(kwargs))
+        except TypeError:
+            return None
+
+    def get(self, node, key):
+        if key not in self._sessions:
+            return None
+        session, pid, keyspace, fetch_size = self._sessions[key]
+        if (session.is_shutdown or session.cluster.is_shutdown or session.keyspace != keyspace or
+                not node.is_running() or node.pid != pid):
+            del self._sessions[key]
+            return None
+        session.default_fetch_size = fetch_size
+        return session
+
+    def put(self, node, key, session):
+        self._sessions[key] = (session, node.pid, session.keyspace, session.default_fetch_size)
+
+    def clear(self):
+        self._sessions.clear()
+
+
 class Tester(TestCase):
 
     maxDiff = None
     allow_log_errors = False  # scan the log of each node for errors after every test.
     cluster_options = None
+    allow_cluster_templates = True  # set False for tests that depend on a node's first boot, see ClusterTemplateCache
+    cache_cql_sessions = True  # set False for tests that need a new session per connection, see SessionCache
+    sampled_metrics = None  # Metrics sampled with SAMPLE_METRICS=yes, tools.metricsampler.DEFAULT_METRICS if None
+    shard_group = None  # classes with the same shard_group run on the same run_dtests.py worker
+    hardcoded_addresses = False  # set True for tests using 127.0.0.x addresses, which run_dtests.py runs in that block
 
     def set_node_to_current_version(self, node):
         version = os.environ.get('CASSANDRA_VERSION')
@@ -300,17 +382,28 @@ class Tester(TestCase):
         maybe_cleanup_cluster_from_last_test_file()
 
         self.test_path = get_test_path()
-        self.cluster = create_ccm_cluster(self.test_path, name='test')
+        with timed_phase('create_ccm_cluster'):
+            self.cluster = create_ccm_cluster(self.test_path, name='test')
 
         self.maybe_begin_active_log_watch()
+        self.metrics_sampler = None
+        self.maybe_begin_metrics_sampling()
         maybe_setup_jacoco(self.test_path)
 
-        self.init_config()
+        with timed_phase('init_config'):
+            self.init_config()
         write_last_test_file(self.test_path, self.cluster)
 
-        set_log_levels(self.cluster)
+        with timed_phase('set_log_levels'):
+            set_log_levels(self.cluster)
+        self.maybe_use_cluster_templates()
+        time_method_as_phase(self.cluster, 'populate')
+        time_method_as_phase(self.cluster, 'start')
         self.connections = []
+        self.session_cache = SessionCache()
         self.runners = []
+        # read by plugins.dtesttimings and plugins.dtestphases to split a test's wall time into phases
+        self.setup_finished_at = time.time()
 
     # this is intentionally spelled 'tst' instead of 'test' to avoid
     # making unittest think it's a test method
@@ -318,24 +411,52 @@ class Tester(TestCase):
         global CURRENT_TEST
         CURRENT_TEST = self.id() + self._testMethodName
 
-    def maybe_begin_active_log_watch(self):
+    def maybe_use_cluster_templates(self):
+        if ENABLE_CLUSTER_TEMPLATES and self.allow_cluster_templates:
+            use_cluster_templates(self.cluster)
+
+    def maybe_begin_active_log_watch(self, from_end=False):
         if ENABLE_ACTIVE_LOG_WATCHING:
             if not self.allow_log_errors:
-                self.begin_active_log_watch()
+                self.begin_active_log_watch(from_end=from_end)
+
+    def maybe_begin_metrics_sampling(self):
+        if SAMPLE_METRICS:
+            self.begin_metrics_sampling()
 
-    def begin_active_log_watch(self):
+    def begin_metrics_sampling(self, metrics=None, interval=METRICS_SAMPLE_INTERVAL):
         """
-        Calls into ccm to start actively watching logs.
+        Starts a MetricsSampler thread recording metrics of the cluster's nodes,
+        by default self.sampled_metrics, every interval seconds. The samples are
+        saved with the logs by copy_logs.
 
-        In the event that errors are seen in logs, ccm will call back to _log_error_handler.
+        Without JOLOKIA_AT_START=yes, only nodes that had
+        remove_perf_disable_shared_mem applied before starting are sampled.
+        """
+        from tools.metricsampler import DEFAULT_METRICS, MetricsSampler  # tools.jmxutils imports dtest
+        self.stop_metrics_sampling()
+        self.metrics_sampler = MetricsSampler(self.cluster, metrics or self.sampled_metrics or DEFAULT_METRICS, interval)
+        self.metrics_sampler.start()
+
+    def stop_metrics_sampling(self):
+        if getattr(self, 'metrics_sampler', None) is not None:
+            self.metrics_sampler.stop()
+
+    def begin_active_log_watch(self, from_end=False):
+        """
+        Starts a LogWatcher thread to actively watch the logs of the cluster's nodes.
+
+        In the event that errors are seen in logs, the watcher will call back to _log_error_handler.
+        With from_end=True, errors already in the logs are ignored.
 
-        When the cluster is no longer in use, stop_active_log_watch should be called to end log watching.
+        When the test is over, stop_active_log_watch should be called to end log watching.
         (otherwise a 'daemon' thread will (needlessly) run until the process exits).
         """
         # log watching happens in another thread, but we want it to halt the main
         # thread's execution, which we have to do by registering a signal handler
         signal.signal(signal.SIGINT, self._catch_interrupt)
-        self._log_watch_thread = self.cluster.actively_watch_logs_for_error(self._log_error_handler, interval=0.25)
+        self._log_watch_thread = LogWatcher(self.cluster, self._log_error_handler, from_end=from_end)
+        self._log_watch_thread.start()
 
     def _log_error_handler(self, errordata):
         """
@@ -435,6 +556,11 @@ class Tester(TestCase):
                 if os.path.exists(compactionlog):
                     self.assertGreaterEqual(os.path.getsize(compactionlog), 0)
                     shutil.copyfile(compactionlog, os.path.join(logdir, n + "_compaction.log"))
+            if getattr(self, 'metrics_sampler', None) is not None:
+                self.metrics_sampler.dump(os.path.join(logdir, 'metrics.json'))
+            if RECORD_JFR:
+                from tools.jfr import save_recordings  # tools.jfr imports dtest
+                save_recordings(self.cluster, logdir)
             if os.path.exists(name):
                 os.unlink(name)
             if not is_win():
@@ -464,6 +590,13 @@ class Tester(TestCase):
         if protocol_version is None:
             protocol_version = get_eager_protocol_version(node.cluster.version())
 
+        cache_key = None
+        if CACHE_CQL_SESSIONS and self.cache_cql_sessions and not execution_profiles:
+            cache_key = SessionCache.key(node, keyspace, user, password, compression, protocol_version, port, ssl_opts, kwargs)
+            session = self.session_cache.get(node, cache_key) if cache_key else None
+            if session is not None:
+                return session
+
         if user is not None:
             auth_provider = get_auth_provider(user=user, password=password)
         else:
@@ -487,8 +620,24 @@ class Tester(TestCase):
             session.set_keyspace(keyspace)
 
         self.connections.append(session)
+        if cache_key:
+            self.session_cache.put(node, cache_key, session)
         return session
 
+    def _wait_for_native_transport(self, node, timeout, protocol_version=None, port=None, ssl_opts=None):
+        """
+        Wait up to timeout seconds for the node's native transport to answer
+        a handshake, so that patient connections don't build a driver Cluster
+        every attempt while the node starts. Returns how much of the timeout
+        is left for connecting.
+        """
+        started = time.time()
+        if protocol_version is None:
+            protocol_version = get_eager_protocol_version(node.cluster.version())
+        wait_for_native_transport(get_ip_from_node(node), int(port or get_port_from_node(node)), protocol_version,
+                                  ssl_opts=ssl_opts, timeout=timeout)
+        return max(0, timeout - (time.time() - started))
+
     def patient_cql_connection(self, node, keyspace=None,
                                user=None, password=None, timeout=30, compression=True,
                                protocol_version=None, port=None, ssl_opts=None, **kwargs):
@@ -499,6 +648,7 @@ class Tester(TestCase):
         """
         if is_win():
             timeout *= 2
+        timeout = self._wait_for_native_transport(node, timeout, protocol_version, port, ssl_opts)
 
         expected_log_lines = ('Control connection failed to connect, shutting down Cluster:', '[control connection] Error connecting to ')
         with log_filter('cassandra.cluster', expected_log_lines):
@@ -529,6 +679,7 @@ class Tester(TestCase):
         """
         if is_win():
             timeout *= 2
+        timeout = self._wait_for_native_transport(node, timeout, protocol_version, port, ssl_opts)
 
         return retry_till_success(
             self.exclusive_cql_connection,
@@ -570,6 +721,7 @@ class Tester(TestCase):
                 pass
 
     def tearDown(self):
+        self.teardown_started_at = time.time()
         # test_is_ending prevents active log watching from being able to interrupt the test
         # which we don't want to happen once tearDown begins
         self.test_is_ending = True
@@ -578,33 +730,39 @@ class Tester(TestCase):
 
         for con in self.connections:
             con.cluster.shutdown()
+        self.session_cache.clear()
 
         for runner in self.runners:
             try:
                 runner.stop()
             except:
                 pass
+        self.stop_metrics_sampling()
 
         failed = did_fail()
         try:
-            if not self.allow_log_errors and self.check_logs_for_errors():
+            with timed_phase('check_logs_for_errors'):
+                log_errors = not self.allow_log_errors and self.check_logs_for_errors()
+            if log_errors:
                 failed = True
                 raise AssertionError('Unexpected error in log, see stdout')
         finally:
             try:
-                # save the logs for inspection
-                if failed or KEEP_LOGS:
-                    self.copy_logs(self.cluster)
+                # save the logs for inspection, and the flight recordings of every test
+                if failed or KEEP_LOGS or RECORD_JFR:
+                    with timed_phase('copy_logs'):
+                        self.copy_logs(self.cluster)
             except Exception as e:
                 print "Error saving log:", str(e)
             finally:
                 log_watch_thread = getattr(self, '_log_watch_thread', None)
-                cleanup_cluster(self.cluster, self.test_path, log_watch_thread)
+                with timed_phase('cleanup_cluster'):
+                    cleanup_cluster(self.cluster, self.test_path, log_watch_thread)
 
     def check_logs_for_errors(self):
         for node in self.cluster.nodelist():
             errors = list(self.__filter_errors(
-                ['\n'.join(msg) for msg in node.grep_log_for_errors()]))
+                ['\n'.join(msg) for msg in grep_log_for_new_errors(node)]))
             if len(errors) is not 0:
                 for error in errors:
                     print_("Unexpected error in {node_name} log, error: \n{error}".format(node_name=node.name, error=error))
@@ -624,11 +782,9 @@ class Tester(TestCase):
         """Filter errors, removing those that match self.ignore_log_patterns"""
         if not hasattr(self, 'ignore_log_patterns'):
             self.ignore_log_patterns = []
+        ignored = combine_patterns(self.ignore_log_patterns)
         for e in errors:
-            for pattern in self.ignore_log_patterns:
-                if re.search(pattern, e):
-                    break
-            else:
+            if ignored is None or not ignored.search(e):
                 yield e
 
     # Disable docstrings printing in nosetest output
@@ -817,10 +973,375 @@ def create_ccm_cluster(test_path, name):
     cluster.set_datadir_count(DATADIR_COUNT)
     cluster.set_environment_variable('CASSANDRA_LIBJEMALLOC', CASSANDRA_LIBJEMALLOC)
 
+    if ADDRESS_BLOCK:
+        use_address_block(cluster)
+
+    if JOLOKIA_AT_START or RECORD_JFR:
+        use_node_jvm_options(cluster, node_jvm_options)
+
+    return cluster
+
+
+def address_block_port(port):
+    """
+    Shifts a port that Cassandra binds on localhost rather than on the node's
+    address, so that clusters in different address blocks don't collide.
+    """
+    port = int(port)
+    return str(port + ADDRESS_BLOCK) if port else '0'
+
+
+def use_address_block(cluster):
+    """
+    Makes cluster.populate() create nodes in this process's address block
+    unless it is explicitly given an ipprefix or ipformat.
+    """
+    populate, create_node = cluster.populate, cluster.create_node
+
+    def create_node_in_address_block(name, auto_bootstrap, thrift_interface, storage_interface, jmx_port, remote_debug_port,
+                                     initial_token, save=True, binary_interface=None, byteman_port='0', environment_variables=None):
+        return create_node(name, auto_bootstrap, thrift_interface, storage_interface, address_block_port(jmx_port), remote_debug_port,
+                           initial_token, save, binary_interface, address_block_port(byteman_port), environment_variables)
+
+    def populate_in_address_block(*args, **kwargs):
+        if 'ipformat' not in kwargs:
+            kwargs.setdefault('ipprefix', CLUSTER_IP_PREFIX)
+        # only nodes created by populate get shifted ports; nodes loaded from disk already have them
+        cluster.create_node = create_node_in_address_block
+        try:
+            return populate(*args, **kwargs)
+        finally:
+            del cluster.create_node
+
+    cluster.populate = populate_in_address_block
+    return cluster
+
+
+def node_jvm_options(node):
+    """
+    The JVM options every node starts with, for JOLOKIA_AT_START and RECORD_JFR.
+    """
+    # tools.jmxutils and tools.jfr import dtest
+    from tools.jfr import jfr_jvm_options
+    from tools.jmxutils import jolokia_javaagent_option
+
+    options = []
+    if JOLOKIA_AT_START:
+        options.append(jolokia_javaagent_option(node))
+    if RECORD_JFR:
+        options.extend(jfr_jvm_options())
+    return options
+
+
+def use_node_jvm_options(cluster, jvm_options):
+    """
+    Makes nodes added to the cluster, by populate or one at a time, start
+    with the JVM options jvm_options(node) returns. The options are saved
+    with the node's environment, so they survive restarts and upgrades.
+    """
+    add = cluster.add
+
+    def add_with_jvm_options(node, is_seed, data_center=None):
+        jvm_extra_opts = [os.environ.get('JVM_EXTRA_OPTS')] + jvm_options(node)
+        node.set_environment_variable('JVM_EXTRA_OPTS', ' '.join(opt for opt in jvm_extra_opts if opt))
+        return add(node, is_seed, data_center)
+
+    cluster.add = add_with_jvm_options
+    return cluster
+
+
+class ClusterTemplateCache(object):
+    """
+    Keeps pristine, stopped copies of populated and booted clusters on disk,
+    so that a test starting a cluster identical to one an earlier test
+    already booted can clone it instead of paying for token assignment and
+    the first boot of every node.
+
+    A template is built or cloned by the first start() of a populated
+    cluster, once the test configured it, and is keyed by everything its
+    first boot depends on: the Cassandra SHA of every install dir, the
+    cluster and node configuration as ccm persists it (cluster.conf, each
+    node's node.conf and conf and bin directories, with the test's path
+    taken out), the seeds and the arguments given to populate (node count or
+    DC layout, tokens...). Tests that depend on the first boot of their
+    nodes themselves opt out with allow_cluster_templates = False.
+
+    Clones keep the configuration of the test's own nodes and take their
+    data, commitlogs, caches and hints from the template, hardlinking the
+    sstable components that Cassandra never rewrites and copying everything
+    else, so nothing of the clone can leak back into the template.
+
+    Processes in different address blocks, e.g. the workers of
+    run_dtests.py, share templates: keys take the block's addresses and
+    ports as they are in block 0, and a clone in another block than its
+    template forgets the template nodes' peers, which it learns again from
+    its seeds. save() drains the nodes so they don't replay their peers
+    from their commitlogs.
+    """
+
+    # sstable components that are never opened for writing once the sstable is complete
+    IMMUTABLE_COMPONENTS = ('-Data.db', '-Index.db', '-CompressionInfo.db')
+    # per-node directories whose files may contain the absolute path of the cluster
+    CONFIG_DIRS = ('conf', 'bin')
+    METADATA_FILE = 'template.json'
+
+    def __init__(self, root=None):
+        self._root = root
+        self._shas = {}
+
+    @property
+    def root(self):
+        if self._root is None:
+            self._root = tempfile.mkdtemp(prefix='dtest-templates-')
+            # templates created for a single run are removed when it exits
+            atexit.register(shutil.rmtree, self._root, True)
+        elif not os.path.exists(self._root):
+            os.makedirs(self._root)
+        return self._root
+
+    # arguments of start() that don't change what the nodes' first boot does
+    START_ARGUMENTS = ('no_wait', 'verbose', 'wait_for_binary_proto', 'wait_other_notice', 'quiet_start', 'allow_root')
+
+    def _get_sha(self, install_dir):
+        if install_dir not in self._shas:
+            self._shas[install_dir] = get_sha(install_dir)
+        return self._shas[install_dir]
+
+    def _config_files(self, cluster):
+        """
+        The contents of the configuration files of the cluster and its
+        nodes, by path relative to the cluster, with the test's path and
+        address block taken out so identical clusters of different tests get
+        the same key.
+        """
+        in_block_zero = self._address_block_normalizer(cluster)
+        cluster_path = cluster.get_path()
+        test_path = os.path.dirname(cluster_path)
+        paths = [os.path.join(cluster_path, 'cluster.conf')]
+        for node in cluster.nodelist():
+            paths.append(os.path.join(node.get_path(), 'node.conf'))
+            for config_dir in self.CONFIG_DIRS:
+                for dirpath, _, filenames in os.walk(os.path.join(node.get_path(), config_dir)):
+                    paths.extend(os.path.join(dirpath, filename) for filename in filenames)
+        files = []
+        for path in sorted(paths):
+            with open(path) as f:
+                files.append((os.path.relpath(path, cluster_path), in_block_zero(f.read().replace(test_path, '<test_path>'))))
+        return files
+
+    def _address_block_normalizer(self, cluster):
+        """
+        A function turning the addresses and shifted ports of the cluster's
+        nodes, see use_address_block, into those they have in block 0.
+        """
+        if not ADDRESS_BLOCK:
+            return lambda text: text
+        from tools.jmxutils import JOLOKIA_PORT_OFFSET  # tools.jmxutils imports dtest
+        ports = {}
+        for node in cluster.nodelist():
+            jmx_port = int(node.jmx_port)
+            for port in (jmx_port, jmx_port + JOLOKIA_PORT_OFFSET, int(node.byteman_port)):
+                if port:
+                    ports[str(port)] = str(port - ADDRESS_BLOCK)
+        addresses = re.compile(r'(?<![\w.]){}(?=\d)'.format(re.escape(CLUSTER_IP_PREFIX)))
+        shifted_ports = re.compile(r'(?<!\w)({})(?!\w)'.format('|'.join(ports)))
+
+        def in_block_zero(text):
+            text = addresses.sub('127.0.0.', text)
+            return shifted_ports.sub(lambda match: ports[match.group(1)], text) if ports else text
+        return in_block_zero
+
+    def template_key(self, cluster, populate_args, populate_kwargs):
+        install_dirs = {cluster.get_install_dir()} | {node.get_install_dir() for node in cluster.nodelist()}
+        in_block_zero = self._address_block_normalizer(cluster)
+        key = repr((
+            [self._get_sha(install_dir) for install_dir in sorted(install_dirs)],
+            cluster.version().vstring,
+            self._config_files(cluster),
+            sorted(in_block_zero(seed) for seed in cluster.get_seeds()) if cluster.nodes else None,
+            sorted(cluster._debug),
+            sorted(cluster._trace),
+            os.path.exists(os.path.join(cluster.get_path(), 'cassandra.in.sh')),
+            populate_args,
+            sorted(populate_kwargs.items())
+        ))
+        return hashlib.sha1(key).hexdigest()
+
+    def start(self, cluster, start, populate_args, *args, **kwargs):
+        """
+        The first start of `cluster`, populated with `populate_args` and
+        never started, through `start`, the cluster's own start method.
+        Replaces the nodes' directories with those of the matching
+        template, building the template first if there is none.
+
+        Starts with other arguments, e.g. jvm_args, and clusters some nodes
+        of which were already started on their own, don't use templates.
+        """
+        if args or set(kwargs) - set(self.START_ARGUMENTS) or any(self._booted(node) for node in cluster.nodelist()):
+            return start(*args, **kwargs)
+
+        key = self.template_key(cluster, *populate_args)
+        template_path = os.path.join(self.root, key)
+        if os.path.exists(os.path.join(template_path, self.METADATA_FILE)):
+            debug("starting cluster from template {}".format(template_path))
+            self._clone(template_path, cluster)
+        else:
+            debug("building cluster template {}".format(key))
+            start(**dict(kwargs, no_wait=False, wait_for_binary_proto=True))
+            self.stop(cluster)
+            self.save(key, cluster)
+        return start(*args, **kwargs)
+
+    def _booted(self, node):
+        # restore() gives nodes data before their first boot
+        return os.path.exists(node.logfilename()) or any(
+            os.listdir(data_dir) for data_dir in node.data_directories() if os.path.exists(data_dir))
+
+    def restore(self, key, cluster):
+        """
+        Gives the populated, never started `cluster` the state of the
+        template saved under `key`. Returns False if there is no such
+        template.
+        """
+        template_path = os.path.join(self.root, key)
+        if not os.path.exists(os.path.join(template_path, self.METADATA_FILE)):
+            return False
+        debug("restoring cluster from template {}".format(template_path))
+        self._clone(template_path, cluster)
+        return True
+
+    def stop(self, cluster):
+        """
+        Stops the started `cluster` for save(), draining its nodes first.
+        """
+        for node in cluster.nodelist():
+            if node.is_running():
+                node.drain()
+        cluster.stop(gently=True)
+
+    def save(self, key, cluster):
+        """
+        Saves the cluster, stopped by stop(), as the template for `key`,
+        unless its logs have errors. Any key will do, e.g. a template_key
+        with arguments standing for what was done to the cluster since
+        populate, computed after populate.
+        """
+        nodes_with_errors = [node.name for node in cluster.nodelist() if node.grep_log_for_errors()]
+        if nodes_with_errors:
+            # keep the logs around for the test to fail on, and don't share whatever went wrong
+            warning("not caching cluster template, errors found in logs of {}".format(", ".join(nodes_with_errors)))
+            return
+
+        template_path = os.path.join(self.root, key)
+        # other processes sharing the templates may be building the same one
+        build_path = tempfile.mkdtemp(prefix=key + '.', dir=self.root)
+        shutil.copytree(cluster.get_path(), os.path.join(build_path, cluster.name))
+        # only the template's logs: the cluster's, gc logs and recordings included, are the test's
+        for node in cluster.nodelist():
+            self._clear_logs(os.path.join(build_path, cluster.name, node.name))
+        for dirpath, _, filenames in os.walk(build_path):
+            for filename in filenames:
+                if filename.endswith(self.IMMUTABLE_COMPONENTS):
+                    # hardlinked into every clone, so make sure nobody writes to them
+                    os.chmod(os.path.join(dirpath, filename), 0444)
+
+        with open(os.path.join(build_path, self.METADATA_FILE), 'w') as f:
+            json.dump({'name': cluster.name, 'address_block': ADDRESS_BLOCK}, f)
+
+        # the rename makes the template visible to other tests atomically
+        try:
+            os.rename(build_path, template_path)
+        except OSError as e:
+            if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+                raise
+            # another process saved it first
+            shutil.rmtree(build_path)
+
+    def _metadata(self, template_path):
+        with open(os.path.join(template_path, self.METADATA_FILE)) as f:
+            return json.load(f)
+
+    def _clone(self, template_path, cluster):
+        metadata = self._metadata(template_path)
+        # the peers are where the template's nodes were, see the class docstring
+        forgotten = self._is_peers_table if metadata['address_block'] != ADDRESS_BLOCK else None
+        for node in cluster.nodelist():
+            # the configuration of the test's nodes is the template's, see the key
+            source_path = os.path.join(template_path, metadata['name'], node.name)
+            for name in os.listdir(source_path):
+                if name in ('node.conf', 'logs') + self.CONFIG_DIRS:
+                    continue
+                target = os.path.join(node.get_path(), name)
+                if os.path.isdir(target):
+                    shutil.rmtree(target)
+                self._clone_tree(os.path.join(source_path, name), target, forgotten)
+
+    def _is_peers_table(self, keyspace_dir, table_dir):
+        return os.path.basename(keyspace_dir) == 'system' and table_dir.split('-')[0] in ('peers', 'peers_v2')
+
+    def _clone_tree(self, source, destination, skipped=None):
+        """
+        Clones the directory `source` into `destination`, without the
+        subdirectories `d` of directories `p` for which skipped(p, d).
+        """
+        os.makedirs(destination)
+        for dirpath, dirnames, filenames in os.walk(source):
+            if skipped is not None:
+                dirnames[:] = [dirname for dirname in dirnames if not skipped(dirpath, dirname)]
+            target_dir = os.path.join(destination, os.path.relpath(dirpath, source))
+            for dirname in dirnames:
+                os.mkdir(os.path.join(target_dir, dirname))
+            for filename in filenames:
+                source_file = os.path.join(dirpath, filename)
+                target_file = os.path.join(target_dir, filename)
+                if filename.endswith(self.IMMUTABLE_COMPONENTS) and hasattr(os, 'link'):
+                    try:
+                        os.link(source_file, target_file)
+                        continue
+                    except OSError as e:
+                        # the templates may be on another filesystem than the test
+                        if e.errno != errno.EXDEV:
+                            raise
+                shutil.copy2(source_file, target_file)
+
+    def _clear_logs(self, node_path):
+        log_dir = os.path.join(node_path, 'logs')
+        if os.path.exists(log_dir):
+            shutil.rmtree(log_dir)
+            os.mkdir(log_dir)
+
+
+CLUSTER_TEMPLATES = ClusterTemplateCache(CLUSTER_TEMPLATE_DIR)
+
+
+def use_cluster_templates(cluster, templates=CLUSTER_TEMPLATES):
+    """
+    Makes the first cluster.start() after cluster.populate() clone a cached
+    template cluster when one matches, see ClusterTemplateCache.
+    """
+    populate, start = cluster.populate, cluster.start
+    populated_with = []
+
+    def populate_for_template(*args, **kwargs):
+        if not cluster.nodes:
+            populated_with[:] = [(args, kwargs)]
+        return populate(*args, **kwargs)
+
+    def start_from_template(*args, **kwargs):
+        if populated_with:
+            return templates.start(cluster, start, populated_with.pop(), *args, **kwargs)
+        return start(*args, **kwargs)
+
+    cluster.populate = populate_for_template
+    cluster.start = start_from_template
     return cluster
 
 
 def cleanup_cluster(cluster, test_path, log_watch_thread=None):
+    from tools.jmxnodetool import forget_jmx_nodetools  # tools.jmxutils imports dtest
+    # nobody waits for lines in the cluster's logs or talks to its nodes' agents anymore
+    stop_log_buses(cluster.get_path())
+    forget_jmx_nodetools(cluster.get_path())
     with log_filter('cassandra'):  # quiet noise from driver when nodes start going down
         if KEEP_TEST_DIR:
             cluster.stop(gently=RECORD_COVERAGE)
@@ -997,35 +1518,45 @@ class ReusableClusterTester(Tester):
     def setUp(self):
         self.set_current_tst_name()
         self.connections = []
-
-        # TODO enable active log watching
         # This needs to happen in setUp() and not setUpClass() so that individual
         # test methods can set allow_log_errors and so that error handling
         # only fails a single test method instead of the entire class.
-        # The problem with this is that ccm doesn't yet support stopping the
-        # active log watcher -- it runs until the cluster is destroyed.  Since
-        # we reuse the same cluster, this doesn't work for us.
+        # Errors logged during earlier test methods aren't this one's to report.
+        self.maybe_begin_active_log_watch(from_end=True)
+        self.metrics_sampler = None
+        self.maybe_begin_metrics_sampling()
+        self.session_cache = SessionCache()
+        self.setup_finished_at = time.time()
 
     def tearDown(self):
+        self.teardown_started_at = time.time()
         # test_is_ending prevents active log watching from being able to interrupt the test
         self.test_is_ending = True
+        log_watch_thread = getattr(self, '_log_watch_thread', None)
+        if log_watch_thread:
+            stop_active_log_watch(log_watch_thread)
+        self.stop_metrics_sampling()
 
         failed = did_fail()
         try:
-            if not self.allow_log_errors and self.check_logs_for_errors():
+            with timed_phase('check_logs_for_errors'):
+                log_errors = not self.allow_log_errors and self.check_logs_for_errors()
+            if log_errors:
                 failed = True
                 raise AssertionError('Unexpected error in log, see stdout')
         finally:
             try:
-                # save the logs for inspection
-                if failed or KEEP_LOGS:
-                    self.copy_logs(self.cluster)
+                # save the logs for inspection, and the flight recordings of every test
+                if failed or KEEP_LOGS or RECORD_JFR:
+                    with timed_phase('copy_logs'):
+                        self.copy_logs(self.cluster)
             except Exception as e:
                 print "Error saving log:", str(e)
             finally:
                 reset_environment_vars()
                 if failed:
-                    cleanup_cluster(self.cluster, self.test_path)
+                    with timed_phase('cleanup_cluster'):
+                        cleanup_cluster(self.cluster, self.test_path)
                     kill_windows_cassandra_procs()
                     self.initialize_cluster()
 
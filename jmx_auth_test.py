@@ -9,6 +9,7 @@ from tools.jmxutils import apply_jmx_authentication
 
 @since('3.6')
 class TestJMXAuth(Tester):
+    allow_cluster_templates = False  # waits for the default superuser created on first boot
 
     def basic_auth_test(self):
         """
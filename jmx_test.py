@@ -13,6 +13,8 @@ from tools.misc import generate_ssl_stores
 
 
 class TestJMX(Tester):
+    hardcoded_addresses = True  # expected endpoints name the nodes by address
+
     def netstats_test(self):
         """
         Check functioning of nodetool netstats, especially with restarts.
@@ -133,13 +135,16 @@ class TestJMX(Tester):
                                  "but wasn't!"
 
         with JolokiaAgent(node) as jmx:
-            self.assertIsNotNone(jmx.read_attribute(table_memtable_size, "Value"),
+            table_memtable_size_value, table_view_read_time_value, table_view_lock_time_value, mv_memtable_size_value = \
+                jmx.read_attributes([(table_memtable_size, "Value"), (table_view_read_time, "Count"),
+                                     (table_view_lock_time, "Count"), (mv_memtable_size, "Value")])
+            self.assertIsNotNone(table_memtable_size_value,
                                  missing_metric_message.format("AllMemtablesHeapSize", "testtable"))
-            self.assertIsNotNone(jmx.read_attribute(table_view_read_time, "Count"),
+            self.assertIsNotNone(table_view_read_time_value,
                                  missing_metric_message.format("ViewReadTime", "testtable"))
-            self.assertIsNotNone(jmx.read_attribute(table_view_lock_time, "Count"),
+            self.assertIsNotNone(table_view_lock_time_value,
                                  missing_metric_message.format("ViewLockAcquireTime", "testtable"))
-            self.assertIsNotNone(jmx.read_attribute(mv_memtable_size, "Value"),
+            self.assertIsNotNone(mv_memtable_size_value,
                                  missing_metric_message.format("AllMemtablesHeapSize", "testmv"))
             self.assertRaisesRegexp(Exception, ".*InstanceNotFoundException.*", jmx.read_attribute,
                                     mbean=mv_view_read_time, attribute="Count", verbose=False)
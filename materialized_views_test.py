@@ -17,12 +17,13 @@ from nose.plugins.attrib import attr
 from nose.tools import (assert_equal)
 
 from distutils.version import LooseVersion
-from dtest import Tester, debug, get_ip_from_node, create_ks
+from dtest import JOLOKIA_AT_START, Tester, debug, get_ip_from_node, create_ks
 from tools.assertions import (assert_all, assert_crc_check_chance_equal,
                               assert_invalid, assert_none, assert_one,
                               assert_unavailable)
 from tools.decorators import since
 from tools.misc import new_node
+from tools.jmxnodetool import jmx_nodetool
 from tools.jmxutils import (JolokiaAgent, make_mbean, remove_perf_disable_shared_mem)
 
 # CASSANDRA-10978. Migration wait (in seconds) to use in bootstrapping tests. Needed to handle
@@ -69,22 +70,27 @@ class TestMaterializedViews(Tester):
         debug("Settling all nodes")
         stage_match = re.compile("(?P<name>\S+)\s+(?P<active>\d+)\s+(?P<pending>\d+)\s+(?P<completed>\d+)\s+(?P<blocked>\d+)\s+(?P<alltimeblocked>\d+)")
 
-        def _settled_stages(node):
+        def _stages(node):
+            if JOLOKIA_AT_START:
+                return [(name, pool.active, pool.pending) for name, pool in jmx_nodetool(node).tpstats().thread_pools.items()]
             (stdout, stderr, rc) = node.nodetool("tpstats")
-            lines = re.split("\n+", stdout)
-            for line in lines:
-                match = stage_match.match(line)
-                if match is not None:
-                    active = int(match.group('active'))
-                    pending = int(match.group('pending'))
-                    if active != 0 or pending != 0:
-                        debug("%s - pool %s still has %d active and %d pending" % (node.name, match.group("name"), active, pending))
-                        return False
+            matches = [stage_match.match(line) for line in re.split("\n+", stdout)]
+            return [(match.group('name'), int(match.group('active')), int(match.group('pending')))
+                    for match in matches if match is not None]
+
+        def _settled_stages(node):
+            for name, active, pending in _stages(node):
+                if active != 0 or pending != 0:
+                    debug("%s - pool %s still has %d active and %d pending" % (node.name, name, active, pending))
+                    return False
             return True
 
         for node in self.cluster.nodelist():
             if node.is_running():
-                node.nodetool("replaybatchlog")
+                if JOLOKIA_AT_START:
+                    jmx_nodetool(node).replaybatchlog()
+                else:
+                    node.nodetool("replaybatchlog")
                 attempts = 50  # 100 milliseconds per attempt, so 5 seconds total
                 while attempts > 0 and not _settled_stages(node):
                     time.sleep(0.1)
@@ -0,0 +1,178 @@
+import errno
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from dtest import ClusterTemplateCache
+
+
+class FakeNode(object):
+
+    def __init__(self, cluster_path, name, block=0):
+        self.name = name
+        self.path = os.path.join(cluster_path, name)
+        self.address = '127.0.{}.{}'.format(block, name[-1])
+        self.jmx_port = str(7000 + int(name[-1]) * 100 + block)
+        self.byteman_port = '0'
+        for directory in ('conf', 'logs', 'data'):
+            os.makedirs(os.path.join(self.path, directory))
+        self.configure('initial_token: null')
+
+    def configure(self, yaml):
+        with open(os.path.join(self.path, 'node.conf'), 'w') as f:
+            f.write('name: {}\ncommitlogs: {}/commitlogs\njmx_port: {}\n'.format(self.name, self.path, self.jmx_port))
+        with open(os.path.join(self.path, 'conf', 'cassandra.yaml'), 'w') as f:
+            f.write('listen_address: {}\n{}'.format(self.address, yaml))
+
+    def data_directories(self):
+        return [os.path.join(self.path, 'data')]
+
+    def is_running(self):
+        return False
+
+    def get_path(self):
+        return self.path
+
+    def get_install_dir(self):
+        return '/install'
+
+    def logfilename(self):
+        return os.path.join(self.path, 'logs', 'system.log')
+
+
+def fake_cluster(test_path, nodes=2, block=0):
+    cluster_path = os.path.join(test_path, 'test')
+    os.makedirs(cluster_path)
+    with open(os.path.join(cluster_path, 'cluster.conf'), 'w') as f:
+        f.write('name: test\n')
+    cluster = Mock(name='cluster', _debug=[], _trace=[])
+    cluster.name = 'test'
+    cluster.get_path.return_value = cluster_path
+    cluster.get_install_dir.return_value = '/install'
+    cluster.version.return_value.vstring = '3.0.12'
+    cluster.nodes = {'node{}'.format(i): FakeNode(cluster_path, 'node{}'.format(i), block) for i in range(1, nodes + 1)}
+    cluster.nodelist.side_effect = lambda: [cluster.nodes[name] for name in sorted(cluster.nodes)]
+    cluster.get_seeds.return_value = ['127.0.{}.1'.format(block)]
+    return cluster
+
+
+def boot(**kwargs):
+    for node in boot.cluster.nodelist():
+        with open(node.logfilename(), 'w') as f:
+            f.write('booted')
+        with open(os.path.join(node.get_path(), 'data', 'system-Data.db'), 'w') as f:
+            f.write('tokens')
+        peers = os.path.join(node.get_path(), 'data', 'system', 'peers-37f71aca7dc2383ba70672528af04d4f')
+        if not os.path.exists(peers):
+            os.makedirs(peers)
+        with open(os.path.join(peers, 'mc-1-big-Data.db'), 'w') as f:
+            f.write('127.0.{}.2'.format(boot.block))
+
+
+class TestClusterTemplateCache(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.templates = ClusterTemplateCache(os.path.join(self.tmp, 'templates'))
+        patcher = patch('dtest.get_sha', return_value='github:apache/0123abc')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def cluster(self, test, block=0):
+        cluster = fake_cluster(os.path.join(self.tmp, test), block=block)
+        # save only caches clusters without errors in their logs
+        for node in cluster.nodelist():
+            node.grep_log_for_errors = Mock(return_value=[])
+        return cluster
+
+    def key_ignores_test_path_test(self):
+        first, second = self.cluster('first'), self.cluster('second')
+        self.assertEqual(self.templates.template_key(first, (2,), {}), self.templates.template_key(second, (2,), {}))
+
+    def key_ignores_address_block_test(self):
+        first = self.cluster('first')
+        key = self.templates.template_key(first, (2,), {})
+        with patch('dtest.ADDRESS_BLOCK', 3), patch('dtest.CLUSTER_IP_PREFIX', '127.0.3.'):
+            second = self.cluster('second', block=3)
+            self.assertEqual(key, self.templates.template_key(second, (2,), {}))
+
+    def key_includes_configuration_after_populate_test(self):
+        first, second = self.cluster('first'), self.cluster('second')
+        second.nodelist()[0].configure('initial_token: 0')
+        self.assertNotEqual(self.templates.template_key(first, (2,), {}), self.templates.template_key(second, (2,), {}))
+
+    def start_clones_template_keeping_nodes_test(self):
+        first = self.cluster('first')
+        start = Mock(side_effect=boot)
+        boot.cluster, boot.block = first, 0
+        self.templates.start(first, start, ((2,), {}), wait_for_binary_proto=True)
+        # built the template, then started the test's cluster
+        self.assertEqual(2, start.call_count)
+
+        second = self.cluster('second')
+        nodes = second.nodelist()
+        start = Mock()
+        self.templates.start(second, start, ((2,), {}), wait_for_binary_proto=True)
+        start.assert_called_once_with(wait_for_binary_proto=True)
+        self.assertEqual(nodes, second.nodelist())
+        with open(os.path.join(nodes[0].get_path(), 'data', 'system-Data.db')) as f:
+            self.assertEqual('tokens', f.read())
+        with open(os.path.join(nodes[0].get_path(), 'node.conf')) as f:
+            self.assertIn(os.path.join(self.tmp, 'second'), f.read())
+        self.assertTrue(os.path.exists(os.path.join(nodes[0].get_path(), 'data', 'system')))
+        self.assertEqual(1, len(os.listdir(os.path.join(nodes[0].get_path(), 'data', 'system'))))
+
+    def restore_in_other_address_block_forgets_peers_test(self):
+        first = self.cluster('first')
+        boot.cluster, boot.block = first, 0
+        boot()
+        self.templates.save('key', first)
+
+        with patch('dtest.ADDRESS_BLOCK', 3), patch('dtest.CLUSTER_IP_PREFIX', '127.0.3.'):
+            second = self.cluster('second', block=3)
+            self.assertTrue(self.templates.restore('key', second))
+        node = second.nodelist()[0]
+        with open(os.path.join(node.get_path(), 'data', 'system-Data.db')) as f:
+            self.assertEqual('tokens', f.read())
+        self.assertEqual([], os.listdir(os.path.join(node.get_path(), 'data', 'system')))
+        with open(os.path.join(node.get_path(), 'conf', 'cassandra.yaml')) as f:
+            self.assertIn('127.0.3.1', f.read())
+
+    def save_discards_template_saved_concurrently_test(self):
+        first, second = self.cluster('first'), self.cluster('second')
+        for cluster in (first, second):
+            boot.cluster, boot.block = cluster, 0
+            boot()
+            self.templates.save('key', cluster)
+        self.assertEqual(['key'], os.listdir(self.templates.root))
+
+    def save_keeps_source_logs_test(self):
+        cluster = self.cluster('first')
+        boot.cluster, boot.block = cluster, 0
+        boot()
+        self.templates.save('key', cluster)
+        node = cluster.nodelist()[0]
+        with open(node.logfilename()) as f:
+            self.assertEqual('booted', f.read())
+        self.assertEqual([], os.listdir(os.path.join(self.templates.root, 'key', 'test', node.name, 'logs')))
+
+    def start_with_jvm_args_bypasses_templates_test(self):
+        cluster = self.cluster('first')
+        start = Mock()
+        self.templates.start(cluster, start, ((2,), {}), jvm_args=['-Dcassandra.join_ring=false'])
+        start.assert_called_once_with(jvm_args=['-Dcassandra.join_ring=false'])
+        self.assertFalse(os.path.exists(self.templates.root) and os.listdir(self.templates.root))
+
+    def clone_copies_across_filesystems_test(self):
+        source = os.path.join(self.tmp, 'source')
+        os.makedirs(source)
+        with open(os.path.join(source, 'ks-Data.db'), 'w') as f:
+            f.write('data')
+        with patch('os.link', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link')):
+            self.templates._clone_tree(source, os.path.join(self.tmp, 'destination'))
+        with open(os.path.join(self.tmp, 'destination', 'ks-Data.db')) as f:
+            self.assertEqual('data', f.read())
@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+from plugins import dtestphases
+
+
+def _record(module, cls, total, **phases):
+    return {'test': '{}:{}.test'.format(module, cls), 'module': module, 'class': cls,
+            'outcome': 'success', 'started_at': 0, 'total': total, 'phases': phases}
+
+
+class TestSummarize(TestCase):
+
+    def setUp(self):
+        self.records = [_record('a', 'A', 10, setUp=2, body=8),
+                        _record('a', 'B', 30, setUp=5, body=25),
+                        _record('b', 'C', 15, setUp=1, body=4, tearDown=10)]
+
+    def test_summarize_by_class(self):
+        summaries = dtestphases.summarize(self.records, by='class')
+        self.assertEqual(list(summaries), ['a:B', 'b:C', 'a:A'])
+        self.assertEqual(summaries['b:C'], {'tests': 1, 'total': 15, 'phases': {'setUp': 1, 'body': 4, 'tearDown': 10}})
+
+    def test_summarize_by_module(self):
+        summaries = dtestphases.summarize(self.records, by='module')
+        self.assertEqual(summaries['a'], {'tests': 2, 'total': 40, 'phases': {'setUp': 7, 'body': 33}})
+
+    def test_summarize_by_unknown_level(self):
+        with self.assertRaises(ValueError):
+            dtestphases.summarize(self.records, by='package')
+
+
+class TestTimedPhase(TestCase):
+
+    def tearDown(self):
+        dtestphases._PHASES = None
+
+    def test_records_only_while_enabled(self):
+        with dtestphases.timed_phase('disabled'):
+            pass
+        self.assertIsNone(dtestphases._PHASES)
+
+        dtestphases._PHASES = []
+        with dtestphases.timed_phase('enabled'):
+            pass
+        self.assertEqual([name for name, _, _ in dtestphases._PHASES], ['enabled'])
@@ -0,0 +1,82 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase
+
+from mock import patch
+
+from upgrade_tests import prebuild_versions
+
+
+def fake_compile(version, target_dir, verbose=False):
+    # builds run in processes of their own, so are logged to a file
+    with open(os.path.join(os.environ['CCM_CONFIG_DIR'], 'builds'), 'a') as f:
+        f.write(version + '\n')
+    os.mkdir(os.path.join(target_dir, 'build'))
+    with open(os.path.join(target_dir, 'build', 'apache-cassandra.jar'), 'w') as f:
+        f.write(open(os.path.join(target_dir, 'VERSION')).read())
+
+
+class TestPrebuildVersions(TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        env = patch.dict(os.environ, {'CCM_CONFIG_DIR': os.path.join(self.tmp, 'ccm')})
+        env.start()
+        self.addCleanup(env.stop)
+        compile_version = patch('ccmlib.repository.compile_version', fake_compile)
+        compile_version.start()
+        self.addCleanup(compile_version.stop)
+
+        work = os.path.join(self.tmp, 'work')
+        self.git(self.tmp, 'init', '-q', work)
+        self.commit(work, '2.1.17')
+        self.git(work, 'tag', 'cassandra-2.1.17')
+        self.git(work, 'checkout', '-q', '-b', 'cassandra-2.1')
+        self.commit(work, '2.1.18-SNAPSHOT')
+        self.mirror = os.path.join(self.tmp, 'cassandra.git')
+        self.git(self.tmp, 'clone', '-q', '--mirror', work, self.mirror)
+        self.work = work
+
+    def git(self, cwd, *args):
+        subprocess.check_call(('git', '-c', 'user.name=test', '-c', 'user.email=test@example.com') + args, cwd=cwd)
+
+    def commit(self, work, version):
+        with open(os.path.join(work, 'VERSION'), 'w') as f:
+            f.write(version)
+        self.git(work, 'add', 'VERSION')
+        self.git(work, 'commit', '-q', '-m', version)
+
+    def builds(self):
+        with open(os.path.join(self.tmp, 'ccm', 'builds')) as f:
+            return f.read().split()
+
+    def build_spec_test(self):
+        spec = prebuild_versions.build_spec('2.1.17', 8)
+        self.assertEqual('cassandra-2.1.17', spec.ref)
+        self.assertEqual('2.1.17', os.path.basename(spec.directory))
+        self.assertEqual('cassandra-2.1', prebuild_versions.build_spec('github:apache/cassandra-2.1', 8).ref)
+        self.assertEqual('trunk', prebuild_versions.build_spec('git:trunk', 8).ref)
+        with self.assertRaises(ValueError):
+            prebuild_versions.build_spec('github:someone/trunk', 8)
+
+    def prebuild_test(self):
+        versions = {'2.1.17': 7, 'github:apache/cassandra-2.1': 8}
+        self.assertEqual({}, prebuild_versions.prebuild(versions, self.mirror))
+        for version, built in (('2.1.17', '2.1.17'), ('github:apache/cassandra-2.1', '2.1.18-SNAPSHOT')):
+            with open(os.path.join(prebuild_versions.build_spec(version, 8).directory, 'build', 'apache-cassandra.jar')) as f:
+                self.assertEqual(built, f.read())
+
+        # up to date versions are skipped, until their branch moves
+        self.assertEqual({}, prebuild_versions.prebuild(versions, self.mirror))
+        self.assertEqual(['cassandra-2.1', 'cassandra-2.1.17'], sorted(self.builds()))
+        self.commit(self.work, '2.1.19-SNAPSHOT')
+        self.git(self.mirror, 'fetch', '-q', 'origin', '+refs/*:refs/*')
+        self.assertEqual({}, prebuild_versions.prebuild(versions))
+        self.assertEqual(['cassandra-2.1', 'cassandra-2.1.17', 'cassandra-2.1'], sorted(self.builds()[:2]) + self.builds()[2:])
+
+    def failed_build_test(self):
+        errors = prebuild_versions.prebuild({'git:no-such-branch': 8}, self.mirror)
+        self.assertEqual(['git:no-such-branch'], errors.keys())
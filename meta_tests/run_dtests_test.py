@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from mock import Mock, patch
+
+import dtest
+import run_dtests
+from plugins.dtesttimings import TimingsDatabase
+
+
+def _test(address, resource_intensive=False, group=None, hardcoded_addresses=False):
+    return {'test': address, 'resource_intensive': resource_intensive, 'group': group,
+            'hardcoded_addresses': hardcoded_addresses}
+
+
+class TestShardTests(TestCase):
+
+    def test_keeps_classes_together(self):
+        tests = [_test('a:A.test_1'), _test('a:A.test_2'), _test('a:B.test_1')]
+        shards = run_dtests.shard_tests(tests, 2)
+        self.assertItemsEqual(shards, [['a:A.test_1', 'a:A.test_2'], ['a:B.test_1']])
+
+    def test_keeps_shard_groups_together(self):
+        tests = [_test('a:A.test_1', group='g'), _test('a:B.test_1'), _test('a:C.test_1', group='g')]
+        shards = run_dtests.shard_tests(tests, 2)
+        self.assertItemsEqual(shards, [['a:A.test_1', 'a:C.test_1'], ['a:B.test_1']])
+
+    def test_balances_by_recorded_duration(self):
+        tests = [_test('a:A.test_1'), _test('a:B.test_1'), _test('a:C.test_1'), _test('a:D.test_1')]
+        estimates = {'a:A.test_1': 100, 'a:B.test_1': 60, 'a:C.test_1': 50, 'a:D.test_1': 10}
+        shards = run_dtests.shard_tests(tests, 2, estimates=estimates)
+        self.assertEqual(shards, [['a:A.test_1', 'a:D.test_1'], ['a:B.test_1', 'a:C.test_1']])
+
+    def test_unknown_tests_get_the_median_duration(self):
+        tests = [_test('a:A.test_1'), _test('a:B.test_1'), _test('a:C.test_1')]
+        estimates = {'a:A.test_1': 100, 'a:B.test_1': 1}
+        # C is assumed to take 100s too, so it doesn't end up on A's worker
+        shards = run_dtests.shard_tests(tests, 2, estimates=estimates)
+        self.assertItemsEqual(shards, [['a:A.test_1', 'a:B.test_1'], ['a:C.test_1']])
+
+    def test_resource_intensive_tests_stay_within_memory_budget(self):
+        tests = [_test('a:A.test_1', True), _test('a:B.test_1', True), _test('a:C.test_1')]
+        shards = run_dtests.shard_tests(tests, 3, memory_budget=3 * 2048 + 6144)
+        self.assertEqual(shards, [['a:A.test_1', 'a:B.test_1'], ['a:C.test_1'], []])
+
+    def test_hardcoded_addresses_go_to_first_worker(self):
+        tests = [_test('a:A.test_1', hardcoded_addresses=True), _test('a:B.test_1', hardcoded_addresses=True),
+                 _test('a:C.test_1')]
+        shards = run_dtests.shard_tests(tests, 2)
+        self.assertEqual(shards, [['a:A.test_1', 'a:B.test_1'], ['a:C.test_1']])
+
+    def test_resource_intensive_worker_count(self):
+        self.assertEqual(run_dtests.resource_intensive_worker_count(4), 4)
+        self.assertEqual(run_dtests.resource_intensive_worker_count(4, memory_budget=4 * 2048 + 2 * 6144), 2)
+        # always leave somewhere for resource-intensive tests to run
+        self.assertEqual(run_dtests.resource_intensive_worker_count(4, memory_budget=1024), 1)
+
+
+class TestCollectTests(TestCase):
+
+    @patch('run_dtests.subprocess.Popen')
+    def test_nose_failure_is_fatal(self, popen):
+        popen.return_value = Mock(returncode=2, communicate=Mock(return_value=('', 'no such option: --bogus-option')))
+        with self.assertRaisesRegexp(RuntimeError, 'bogus-option'):
+            run_dtests.collect_tests(dtest._default_config, ['--bogus-option'])
+
+        popen.return_value = Mock(returncode=0, communicate=Mock(return_value=('', '')))
+        with self.assertRaisesRegexp(RuntimeError, 'found none'):
+            run_dtests.collect_tests(dtest._default_config, ['no_such_test'])
+
+
+class TestTimingsDatabase(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = TimingsDatabase(os.path.join(self.tmpdir, 'timings.db'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_estimates_are_median_of_recent_runs(self):
+        for total in (1, 2, 3, 50, 60, 70):
+            self.db.record('a:A.test_1', total)
+        self.assertEqual(self.db.estimates(history=3), {'a:A.test_1': 60})
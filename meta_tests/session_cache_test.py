@@ -0,0 +1,69 @@
+from unittest import TestCase
+
+from cassandra.policies import WhiteListRoundRobinPolicy
+from mock import Mock
+
+from dtest import SessionCache
+
+
+def _node(name='node1', pid=1234, running=True):
+    node = Mock(pid=pid, network_interfaces={'binary': ('127.0.0.1', 9042)})
+    node.name = name
+    node.is_running.return_value = running
+    return node
+
+
+def _session(keyspace=None):
+    return Mock(is_shutdown=False, keyspace=keyspace, default_fetch_size=5000,
+                cluster=Mock(is_shutdown=False))
+
+
+class TestSessionCache(TestCase):
+
+    def setUp(self):
+        self.cache = SessionCache()
+        self.node = _node()
+
+    def _key(self, node=None, **kwargs):
+        return SessionCache.key(node or self.node, None, None, None, True, 4, 9042, None, kwargs)
+
+    def test_key_includes_whitelisted_hosts(self):
+        self.assertEqual(self._key(load_balancing_policy=WhiteListRoundRobinPolicy(['127.0.0.1'])),
+                         self._key(load_balancing_policy=WhiteListRoundRobinPolicy(['127.0.0.1'])))
+        self.assertNotEqual(self._key(load_balancing_policy=WhiteListRoundRobinPolicy(['127.0.0.1'])),
+                            self._key(load_balancing_policy=WhiteListRoundRobinPolicy(['127.0.0.2'])))
+        self.assertNotEqual(self._key(), self._key(node=_node(name='node2')))
+
+    def test_key_is_none_for_custom_objects(self):
+        self.assertIsNone(self._key(retry_policy=object()))
+
+    def test_reuses_session_and_resets_fetch_size(self):
+        session = _session()
+        self.cache.put(self.node, self._key(), session)
+        session.default_fetch_size = 2
+        self.assertIs(self.cache.get(self.node, self._key()), session)
+        self.assertEqual(session.default_fetch_size, 5000)
+
+    def test_forgets_session_once_node_restarted(self):
+        self.cache.put(self.node, self._key(), _session())
+        self.node.pid = 5678
+        self.assertIsNone(self.cache.get(self.node, self._key()))
+        self.node.pid = 1234
+        self.assertIsNone(self.cache.get(self.node, self._key()))
+
+    def test_forgets_session_once_node_stopped(self):
+        self.cache.put(self.node, self._key(), _session())
+        self.node.is_running.return_value = False
+        self.assertIsNone(self.cache.get(self.node, self._key()))
+
+    def test_forgets_shut_down_session(self):
+        session = _session()
+        self.cache.put(self.node, self._key(), session)
+        session.cluster.is_shutdown = True
+        self.assertIsNone(self.cache.get(self.node, self._key()))
+
+    def test_forgets_session_that_changed_keyspace(self):
+        session = _session()
+        self.cache.put(self.node, self._key(), session)
+        session.keyspace = 'ks'
+        self.assertIsNone(self.cache.get(self.node, self._key()))
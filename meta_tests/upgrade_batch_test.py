@@ -0,0 +1,121 @@
+import threading
+from unittest import SkipTest, TestCase
+
+from mock import Mock, patch
+
+from upgrade_tests.upgrade_batch import UpgradeBatch
+
+
+class FakeUpgradeTester(object):
+    """
+    Just enough of UpgradeTester for UpgradeBatch, recording what happens.
+    """
+    NODES, RF, CL = 2, 1, None
+
+    def __init__(self, name='run_upgrade_batch'):
+        self._testMethodName = name
+        self.upgrade_batch = None
+        self.protocol_version = None
+        self.upgrade_error = None
+
+    def prepare(self, **kwargs):
+        if self.upgrade_batch is not None:
+            return self.upgrade_batch.prepare(self, **kwargs)
+        self.events.append('prepare cluster')
+        return Mock()
+
+    def do_upgrade(self, session, return_nodes=False, **kwargs):
+        if self.upgrade_batch is not None:
+            return self.upgrade_batch.do_upgrade(self, return_nodes, **kwargs)
+        if self.upgrade_error is not None:
+            raise self.upgrade_error
+        self.events.append('upgrade')
+        self.wait_for_settled_cluster({})
+        return iter([(True, Mock()), (False, Mock())])
+
+    def patient_cql_connection(self, node, **kwargs):
+        return Mock(consistency_level=kwargs.get('consistency_level'))
+
+    patient_exclusive_cql_connection = patient_cql_connection
+
+    def check_upgrade_applies(self, version):
+        pass
+
+    def wait_for_settled_cluster(self, sessions):
+        self.events.append('settle')
+
+    def skip(self, msg):
+        raise SkipTest(msg)
+
+    def _upgrade_test(self, name, **prepare_kwargs):
+        session = self.prepare(**prepare_kwargs)
+        self.events.append('setup ' + name)
+        for is_upgraded, session in self.do_upgrade(session):
+            self.events.append('{} on {}'.format(name, 'upgraded' if is_upgraded else 'old'))
+            self.upgraded_consistency_level = session.consistency_level
+
+    def first_test(self):
+        self._upgrade_test('first')
+
+    def second_test(self):
+        self._upgrade_test('second', cl='QUORUM')
+        assert self.upgraded_consistency_level is None
+
+    def other_cluster_test(self):
+        self._upgrade_test('other', ordered=True)
+
+    def failing_test(self):
+        self._upgrade_test('failing')
+        raise AssertionError('failed')
+
+    def skipped_test(self):
+        self.skip('not applicable')
+
+    def hanging_test(self):
+        self.hang.wait()
+        self._upgrade_test('hanging')
+
+
+@patch('upgrade_tests.upgrade_batch.get_version_from_build', Mock(return_value='3.0'))
+@patch('upgrade_tests.upgrade_batch.create_ks')
+class TestUpgradeBatch(TestCase):
+
+    def setUp(self):
+        self.runner = FakeUpgradeTester()
+        self.runner.events = []
+        self.runner.cluster = Mock()
+        self.runner.cluster.nodelist.return_value = [Mock(), Mock()]
+        self.runner.hang = threading.Event()
+        self.addCleanup(self.runner.hang.set)
+
+    def test_one_upgrade_for_all_tests(self, create_ks):
+        # the batch's cluster is the default one, even when the first test needs another
+        names = ['other_cluster_test', 'first_test', 'skipped_test', 'failing_test', 'second_test']
+        outcomes = UpgradeBatch(self.runner, names).run()
+
+        self.assertEqual({'first_test': ('pass', None), 'second_test': ('pass', None),
+                          'skipped_test': ('skip', 'not applicable')}, outcomes)
+        self.assertEqual(['prepare cluster', 'setup first', 'setup failing', 'setup second', 'upgrade', 'settle',
+                          'first on upgraded', 'first on old', 'failing on upgraded', 'failing on old',
+                          'second on upgraded', 'second on old'], self.runner.events)
+        self.assertEqual(['upgrade_batch_ks1', 'upgrade_batch_ks3', 'upgrade_batch_ks4'],
+                         [call[0][1] for call in create_ks.call_args_list])
+
+    @patch.object(UpgradeBatch, 'TEST_TIMEOUT', 0.1)
+    def test_hanging_test_runs_on_its_own(self, create_ks):
+        batch = UpgradeBatch(self.runner, ['hanging_test', 'first_test'])
+        outcomes = batch.run()
+
+        self.assertEqual({'first_test': ('pass', None)}, outcomes)
+        self.assertEqual(['prepare cluster', 'setup first', 'upgrade', 'settle', 'first on upgraded', 'first on old'],
+                         self.runner.events)
+        # once it reaches do_upgrade, the abandoned test leaves the batch without waiting for an upgrade
+        self.runner.hang.set()
+        batch.tests[0].join(5)
+        self.assertFalse(batch.tests[0].is_alive())
+
+    def test_failed_upgrade_runs_tests_on_their_own(self, create_ks):
+        self.runner.upgrade_error = RuntimeError('upgrade failed')
+        with self.assertRaisesRegexp(RuntimeError, 'upgrade failed'):
+            UpgradeBatch(self.runner, ['first_test', 'second_test']).run()
+        self.assertEqual(['prepare cluster', 'setup first', 'setup second'], self.runner.events)
@@ -0,0 +1,25 @@
+from unittest import TestCase
+
+from upgrade_tests.upgrade_manifest import (UpgradePath, current_2_1_x,
+                                            current_2_2_x, indev_2_2_x,
+                                            indev_3_0_x, plan_upgrade_groups)
+
+
+def path(starting_meta, upgrade_meta):
+    return UpgradePath('Upgrade_{}_To_{}'.format(starting_meta.name, upgrade_meta.name), starting_meta.version,
+                       upgrade_meta.version, starting_meta, upgrade_meta)
+
+
+class TestPlanUpgradeGroups(TestCase):
+
+    def groups_by_starting_version_test(self):
+        paths = [path(current_2_1_x, indev_2_2_x), path(current_2_2_x, indev_3_0_x), path(current_2_1_x, indev_3_0_x)]
+        groups = plan_upgrade_groups(paths)
+        self.assertEqual(['From_current_2_1_x', 'From_current_2_2_x'], [g.name for g in groups])
+        self.assertEqual([paths[0], paths[2]], groups[0].paths)
+        self.assertEqual((current_2_2_x, 4, [paths[1]]), groups[1][1:])
+
+    def local_version_starts_its_own_group_test(self):
+        local = current_2_1_x._replace(version='github:apache/0123abc')
+        groups = plan_upgrade_groups([path(current_2_1_x, indev_2_2_x), path(local, indev_2_2_x)])
+        self.assertEqual(2, len(groups))
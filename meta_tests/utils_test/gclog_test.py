@@ -0,0 +1,85 @@
+from unittest import TestCase
+
+from tools.gclog import GcLogParser, assert_gc_stats, percentile
+
+CMS_LOG = """\
+2017-01-01T12:00:01.000+0000: 1.000: [GC (Allocation Failure) 2017-01-01T12:00:01.000+0000: 1.000: [ParNew
+Desired survivor size 4358144 bytes, new threshold 1 (max 1)
+- age   1:    6527384 bytes,    6527384 total
+: 68160K->8512K(76672K), 0.0100000 secs] 68160K->12000K(1040064K), 0.0110000 secs] [Times: user=0.03 sys=0.01, real=0.01 secs]
+2017-01-01T12:00:01.011+0000: 1.011: Total time for which application threads were stopped: 0.0120000 seconds, Stopping threads took: 0.0000100 seconds
+2017-01-01T12:00:02.000+0000: 2.000: [CMS-concurrent-mark: 0.017/0.017 secs] [Times: user=0.03 sys=0.00, real=0.02 secs]
+2017-01-01T12:00:03.000+0000: 3.000: [Full GC (System.gc()) 3.000: [CMS: 3488K->1000K(963392K), 0.0500000 secs] \
+76000K->1000K(1040064K), [Metaspace: 20000K->20000K(1067008K)], 0.0510000 secs] [Times: user=0.05 sys=0.00, real=0.05 secs]
+2017-01-01T12:00:03.051+0000: 3.051: Total time for which application threads were stopped: 0.0520000 seconds, Stopping threads took: 0.0000100 seconds
+"""
+
+G1_LOG = """\
+2017-01-01T12:00:01.000+0000: 1.000: [GC pause (G1 Evacuation Pause) (young), 0.0062000 secs]
+   [Parallel Time: 5.1 ms, GC Workers: 2]
+   [Eden: 24.0M(24.0M)->0.0B(20.0M) Survivors: 0.0B->4096.0K Heap: 24.0M(1024.0M)->8.0M(1024.0M)]
+ [Times: user=0.01 sys=0.00, real=0.01 secs]
+2017-01-01T12:00:02.000+0000: 2.000: [GC concurrent-mark-end, 0.0100000 secs]
+2017-01-01T12:00:03.000+0000: 3.000: [GC pause (G1 Evacuation Pause) (young), 0.0100000 secs]
+   [Eden: 20.0M(20.0M)->0.0B(20.0M) Survivors: 4096.0K->4096.0K Heap: 28.0M(1024.0M)->9.0M(1024.0M)]
+ [Times: user=0.01 sys=0.00, real=0.01 secs]
+"""
+
+UNIFIED_LOG = """\
+[1.000s][info][gc] GC(0) Pause Young (Normal) (G1 Evacuation Pause) 24M->8M(256M) 5.000ms
+[3.000s][info][gc] GC(1) Pause Full (System.gc()) 40M->4M(256M) 20.000ms
+"""
+
+
+def parse(log):
+    parser = GcLogParser()
+    for line in log.splitlines(True):
+        parser.feed(line)
+    return parser.stats()
+
+
+class TestGcLogParser(TestCase):
+
+    def test_cms(self):
+        stats = parse(CMS_LOG)
+        self.assertEqual(stats.pause_count, 2)
+        self.assertEqual(stats.max_pause, 0.051)
+        self.assertAlmostEqual(stats.total_pause, 0.062)
+        self.assertAlmostEqual(stats.total_stw, 0.064)
+        # 76000K on the heap before the full GC, 12000K after the young one, over two seconds
+        self.assertEqual(stats.allocation_rate, 64000 * 1024 / 2.0)
+
+    def test_g1(self):
+        stats = parse(G1_LOG)
+        self.assertEqual([stats.pause_count, stats.max_pause, stats.total_stw], [2, 0.01, 0.0162])
+        self.assertEqual(stats.allocation_rate, 20 * 1024 ** 2 / 2.0)
+
+    def test_unified(self):
+        stats = parse(UNIFIED_LOG)
+        self.assertEqual([stats.pause_count, stats.max_pause, stats.pause_percentiles[50]], [2, 0.02, 0.005])
+        self.assertEqual(stats.allocation_rate, 32 * 1024 ** 2 / 2.0)
+
+    def test_restarted_jvm(self):
+        # the second JVM's uptime starts over, and its first heap isn't what the first JVM left
+        stats = parse(UNIFIED_LOG + UNIFIED_LOG)
+        self.assertEqual([stats.pause_count, stats.elapsed], [4, 4.0])
+        self.assertEqual(stats.allocation_rate, 2 * 32 * 1024 ** 2 / 4.0)
+
+    def test_single_pause(self):
+        stats = parse(UNIFIED_LOG.splitlines(True)[0])
+        self.assertEqual([stats.pause_count, stats.elapsed, stats.allocation_rate], [1, 0, None])
+
+    def test_empty(self):
+        stats = parse('')
+        self.assertEqual([stats.pause_count, stats.max_pause, stats.allocation_rate], [0, None, None])
+        assert_gc_stats(stats, max_pause=0.001)
+
+    def test_thresholds(self):
+        stats = parse(CMS_LOG)
+        assert_gc_stats(stats, max_pause=0.1, total_stw=1)
+        self.assertRaisesRegexp(AssertionError, 'max pause 0.051 exceeds 0.05', assert_gc_stats, stats, max_pause=0.05)
+
+    def test_percentile(self):
+        self.assertEqual(percentile(range(1, 101), 99), 99)
+        self.assertEqual(percentile(range(1, 101), 99.9), 100)
+        self.assertEqual(percentile([3], 50), 3)
@@ -0,0 +1,33 @@
+from unittest import TestCase
+
+from tools.jfr import format_summary, jfr_jvm_options, summarize_events
+
+
+def event(type, frame, **values):
+    cls, method = frame.rsplit('.', 1)
+    values['stackTrace'] = {'frames': [{'method': {'type': {'name': cls}, 'name': method}, 'lineNumber': 1}]}
+    return {'type': type, 'values': values}
+
+
+class TestJfr(TestCase):
+
+    def test_jvm_options(self):
+        self.assertEqual(jfr_jvm_options('11.0'), ['-XX:StartFlightRecording=name=dtest,settings=profile'])
+        self.assertEqual(jfr_jvm_options('1.8')[:2], ['-XX:+UnlockCommercialFeatures', '-XX:+FlightRecorder'])
+
+    def test_summary(self):
+        events = [event('jdk.ExecutionSample', 'org.apache.cassandra.db.Memtable.put'),
+                  event('jdk.ExecutionSample', 'org.apache.cassandra.db.Memtable.put'),
+                  event('jdk.ExecutionSample', 'java.util.HashMap.get'),
+                  event('jdk.ObjectAllocationInNewTLAB', 'org.apache.cassandra.utils.ByteBufferUtil.read',
+                        objectClass={'name': 'byte[]'}, tlabSize=3 * 1024 ** 2),
+                  event('jdk.ObjectAllocationOutsideTLAB', 'java.util.ArrayList.grow',
+                        objectClass={'name': 'java.lang.Object[]'}, allocationSize=1024 ** 2)]
+        summary = summarize_events(events)
+        self.assertEqual(summary.cpu_samples, 3)
+        self.assertEqual(summary.hot_methods[0], ('org.apache.cassandra.db.Memtable.put', 2))
+        self.assertEqual(summary.allocation_sites[0],
+                         ('org.apache.cassandra.utils.ByteBufferUtil.read (byte[])', 3 * 1024 ** 2))
+        text = format_summary(summary)
+        self.assertIn(' 66.67%        2 org.apache.cassandra.db.Memtable.put', text)
+        self.assertIn(' 75.00%      3.0 MB org.apache.cassandra.utils.ByteBufferUtil.read (byte[])', text)
@@ -0,0 +1,101 @@
+import errno
+import socket
+from unittest import TestCase
+from urllib2 import URLError
+
+from mock import Mock, patch
+
+from tools.jmxnodetool import STORAGE_SERVICE, JmxNodetool, ThreadPoolStats, forget_jmx_nodetools, jmx_nodetool
+
+METRICS = 'org.apache.cassandra.metrics'
+
+
+class TestJmxNodetool(TestCase):
+
+    def setUp(self):
+        self.node = Mock()
+        self.node.pid = 1234
+        patcher = patch('tools.jmxnodetool.JolokiaAgent')
+        self.agent = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.attributes = {}
+        self.agent.read_attribute.side_effect = lambda mbean, attribute: self.attributes[(mbean, attribute)]
+        self.agent.read_attributes.side_effect = lambda attributes: [self.attributes[a] for a in attributes]
+        self.agent.execute_batch.side_effect = lambda requests: [
+            self.attributes[(r['mbean'], r['attribute'])] if r['type'] == 'read' else self._exec(r)
+            for r in requests]
+        self.nodetool = JmxNodetool(self.node)
+
+    def _exec(self, request):
+        return self.agent.execute_method(request['mbean'], request['operation'], request['arguments'])
+
+    def test_starts_agent_once_per_node_process(self):
+        self.attributes[(STORAGE_SERVICE, 'Keyspaces')] = ['ks']
+        self.nodetool.flush()
+        self.nodetool.flush()
+        self.assertEqual(self.agent.start.call_count, 1)
+        self.node.pid = 5678
+        self.nodetool.flush()
+        self.assertEqual(self.agent.start.call_count, 2)
+        self.agent.execute_method.assert_called_with(
+            STORAGE_SERVICE, 'forceKeyspaceFlush(java.lang.String,[Ljava.lang.String;)', ['ks', []])
+
+    def test_restarts_stopped_agent(self):
+        refused = socket.error(errno.ECONNREFUSED, 'Connection refused')
+        self.agent.execute_method.side_effect = [URLError(refused), None]
+        self.nodetool.replaybatchlog()
+        self.assertEqual(self.agent.start.call_count, 2)
+
+    def test_does_not_retry_timeouts(self):
+        self.agent.execute_method.side_effect = [URLError(socket.timeout('timed out')), None]
+        self.assertRaises(URLError, self.nodetool.replaybatchlog)
+        self.assertEqual(self.agent.execute_method.call_count, 1)
+        self.assertEqual(self.agent.start.call_count, 1)
+
+    def test_tpstats(self):
+        def pools(name, attribute, values):
+            pattern = '{}:type=ThreadPools,path=*,scope=*,name={}'.format(METRICS, name)
+            self.attributes[(pattern, attribute)] = {
+                '{}:type=ThreadPools,path=request,scope={},name={}'.format(METRICS, pool, name): {attribute: value}
+                for pool, value in values.items()}
+
+        pools('ActiveTasks', 'Value', {'MutationStage': 2, 'ReadStage': 0})
+        pools('PendingTasks', 'Value', {'MutationStage': 5, 'ReadStage': 0})
+        pools('CompletedTasks', 'Value', {'MutationStage': 100, 'ReadStage': 7})
+        pools('CurrentlyBlockedTasks', 'Count', {'MutationStage': 0, 'ReadStage': 0})
+        pools('TotalBlockedTasks', 'Count', {'MutationStage': 1, 'ReadStage': 0})
+        self.attributes[('{}:type=DroppedMessage,scope=*,name=Dropped'.format(METRICS), 'Count')] = {
+            '{}:type=DroppedMessage,scope=MUTATION,name=Dropped'.format(METRICS): {'Count': 3}}
+
+        tpstats = self.nodetool.tpstats()
+        self.assertEqual(tpstats.thread_pools.keys(), ['MutationStage', 'ReadStage'])
+        self.assertEqual(tpstats.thread_pools['MutationStage'], ThreadPoolStats(2, 5, 100, 0, 1))
+        self.assertEqual(tpstats.dropped_messages, {'MUTATION': 3})
+
+    def test_status(self):
+        self.attributes.update({
+            (STORAGE_SERVICE, 'LiveNodes'): ['127.0.0.1'],
+            (STORAGE_SERVICE, 'JoiningNodes'): [],
+            (STORAGE_SERVICE, 'LeavingNodes'): [],
+            (STORAGE_SERVICE, 'MovingNodes'): [],
+            (STORAGE_SERVICE, 'LoadMap'): {'127.0.0.1': '1.2 MB', '127.0.0.2': '1 MB'},
+            (STORAGE_SERVICE, 'Ownership'): {'/127.0.0.1': 0.5, 'localhost/127.0.0.2': 0.5},
+            (STORAGE_SERVICE, 'TokenToEndpointMap'): {'100': '127.0.0.2', '-20': '127.0.0.1'},
+        })
+        self.agent.execute_method.side_effect = lambda mbean, operation, args: \
+            'datacenter1' if operation == 'getDatacenter' else 'rack1'
+
+        self.assertEqual(self.nodetool.ring(), [('-20', '127.0.0.1'), ('100', '127.0.0.2')])
+        down = self.nodetool.status()[1]
+        self.assertEqual((down.address, down.status, down.state, down.load, down.tokens, down.owns),
+                         ('127.0.0.2', 'D', 'N', '1 MB', ['100'], 0.5))
+        self.assertEqual(down.datacenter, 'datacenter1')
+
+    def test_forgets_nodetools_of_cleaned_up_cluster(self):
+        nodes = [Mock(get_path=Mock(return_value=path)) for path in ('/tmp/dtest-1/test/node1', '/tmp/dtest-10/test/node1')]
+        nodetools = [jmx_nodetool(node) for node in nodes]
+        forget_jmx_nodetools('/tmp/dtest-1/test')
+        self.assertIsNot(nodetools[0], jmx_nodetool(nodes[0]))
+        self.assertIs(nodetools[1], jmx_nodetool(nodes[1]))
+        forget_jmx_nodetools('/tmp/dtest-1')
+        forget_jmx_nodetools('/tmp/dtest-10')
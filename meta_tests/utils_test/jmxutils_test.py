@@ -0,0 +1,134 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from unittest import TestCase
+from urllib2 import URLError
+
+import yaml
+from mock import Mock, patch
+
+from dtest import use_node_jvm_options
+from tools.jmxutils import (JolokiaAgent, javaagent_jolokia_port,
+                            jolokia_javaagent_option)
+
+
+class FakeJolokiaHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep connections alive
+
+    def do_POST(self):
+        self.server.connections.add(self.client_address)
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        self.server.requests.append(body)
+
+        def respond(request):
+            if request['mbean'] == 'slow:type=Slow':
+                time.sleep(0.5)
+            if request['mbean'] == 'missing:type=Missing':
+                return {'status': 404, 'error': 'javax.management.InstanceNotFoundException'}
+            return {'status': 200, 'value': request.get('attribute')}
+
+        data = json.dumps([respond(r) for r in body] if isinstance(body, list) else respond(body))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestJolokiaAgent(TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 8778), FakeJolokiaHandler)
+        self.server.connections = set()
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        node = Mock()
+        node.network_interfaces = {'binary': ('127.0.0.1', 9042)}
+        self.jmx = JolokiaAgent(node)
+        self.addCleanup(self.jmx._close_connection)
+
+    def test_reuses_connection(self):
+        for _ in range(3):
+            self.assertEqual(self.jmx.read_attribute('org.apache.cassandra.db:type=StorageService', 'LiveNodes'),
+                             'LiveNodes')
+        self.assertEqual(len(self.server.connections), 1)
+
+    def test_reconnects_after_agent_closed_connection(self):
+        self.jmx.read_attribute('org.apache.cassandra.db:type=StorageService', 'LiveNodes')
+        self.jmx._connection.sock.close()
+        self.assertEqual(self.jmx.read_attribute('org.apache.cassandra.db:type=StorageService', 'Keyspaces'),
+                         'Keyspaces')
+
+    def test_timeouts_are_not_retried(self):
+        self.jmx.read_attribute('org.apache.cassandra.db:type=StorageService', 'LiveNodes')
+        self.jmx.timeout = 0.1
+        self.assertRaises(URLError, self.jmx.read_attribute, 'slow:type=Slow', 'Value')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_exec_waits_for_operation(self):
+        self.jmx.timeout = 0.1
+        self.jmx.execute_method('slow:type=Slow', 'forceKeyspaceFlush')
+        self.assertEqual(len(self.server.requests), 1)
+        self.jmx.exec_timeout = 0.1
+        self.assertRaises(URLError, self.jmx.execute_method, 'slow:type=Slow', 'forceKeyspaceFlush')
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_read_attributes(self):
+        mbean = 'org.apache.cassandra.db:type=StorageService'
+        self.assertEqual(self.jmx.read_attributes([(mbean, 'LiveNodes'), (mbean, 'Keyspaces', 'path')]),
+                         ['LiveNodes', 'Keyspaces'])
+        self.assertRaisesRegexp(Exception, 'InstanceNotFoundException', self.jmx.read_attributes,
+                                [(mbean, 'LiveNodes'), ('missing:type=Missing', 'Value')])
+
+    def test_agent_not_running(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.assertRaises(URLError, self.jmx.read_attribute, 'org.apache.cassandra.db:type=StorageService', 'LiveNodes')
+
+
+class TestJolokiaAtStart(TestCase):
+
+    def test_nodes_added_get_agent_on_own_port(self):
+        cluster = Mock()
+        use_node_jvm_options(cluster, lambda node: [jolokia_javaagent_option(node)])
+        node = Mock()
+        node.network_interfaces = {'binary': ('127.0.0.2', 9042)}
+        node.jmx_port = '7200'
+        cluster.add(node, True)
+        key, value = node.set_environment_variable.call_args[0]
+        self.assertEqual(key, 'JVM_EXTRA_OPTS')
+        self.assertRegexpMatches(value, r'-javaagent:\S+/lib/jolokia-jvm-[\d.]+-agent\.jar=host=127\.0\.0\.2,port=17200$')
+
+    def test_finds_port_of_running_agent(self):
+        process = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(60)',
+                                    '-javaagent:/dtest/lib/jolokia-jvm-1.2.3-agent.jar=host=127.0.0.1,port=17100'])
+        self.addCleanup(process.wait)
+        self.addCleanup(process.kill)
+        node = Mock()
+        node.pid = process.pid
+        self.assertEqual(javaagent_jolokia_port(node), 17100)
+        node.pid = 0
+        self.assertIsNone(javaagent_jolokia_port(node))
+
+    def test_finds_port_of_saved_agent_without_proc(self):
+        node_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, node_path)
+        node = Mock(get_path=Mock(return_value=node_path))
+        with patch('os.path.isdir', Mock(return_value=False)):
+            self.assertIsNone(javaagent_jolokia_port(node))
+            with open(os.path.join(node_path, 'node.conf'), 'w') as f:
+                yaml.safe_dump({'environment_variables': {'JVM_EXTRA_OPTS': '-Xss256k -javaagent:/dtest/lib/'
+                                                                            'jolokia-jvm-1.2.3-agent.jar=host=127.0.0.1,port=17100'}}, f)
+            self.assertEqual(javaagent_jolokia_port(node), 17100)
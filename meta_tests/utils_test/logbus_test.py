@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from ccmlib.node import TimeoutError
+from mock import Mock
+
+from tools.logbus import LogBus, log_bus, stop_log_buses
+
+
+class TestLogBus(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'system.log')
+        self.bus = LogBus(self.path, name='node1', poll_interval=0.01)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _log(self, text):
+        with open(self.path, 'a') as f:
+            f.write(text)
+
+    def test_matches_lines_already_logged(self):
+        self._log('INFO Starting\nINFO Prepare completed\n')
+        line, match = self.bus.subscribe('Prepare completed').wait(1)
+        self.assertEqual(line, 'INFO Prepare completed\n')
+
+    def test_from_mark_skips_earlier_lines(self):
+        self._log('INFO JOINING: one\n')
+        mark = os.path.getsize(self.path)
+        subscription = self.bus.subscribe('JOINING: (\\w+)', from_mark=mark)
+        self._log('INFO JOINING: two\n')
+        self.assertEqual(subscription.wait(5)[1].group(1), 'two')
+
+    def test_shares_one_tailer_between_subscribers(self):
+        results = []
+        first = self.bus.subscribe(['Compacting', 'Compacted'], callback=results.append)
+        second = self.bus.subscribe('Compacted')
+        self.assertIsNotNone(self.bus.thread)
+        self._log('INFO Compacting ks.t\nINFO Compacted ks.t\n')
+        self.assertEqual([line for line, _ in first.wait(5)], ['INFO Compacting ks.t\n', 'INFO Compacted ks.t\n'])
+        self.assertEqual(second.wait(5)[0], 'INFO Compacted ks.t\n')
+        self.assertEqual(len(results), 1)
+
+    def test_timeout(self):
+        with self.assertRaises(TimeoutError):
+            self.bus.subscribe('never logged').wait(0.1)
+        self.assertEqual(self.bus.subscriptions, [])
+
+    def test_fails_once_the_writer_stopped(self):
+        running = [True]
+        subscription = self.bus.subscribe('Prepare completed', alive=lambda: running[0])
+        self._log('INFO Starting\n')
+        running[0] = False
+        with self.assertRaisesRegexp(RuntimeError, 'stopped running'):
+            subscription.wait(5)
+        self.assertEqual(self.bus.subscriptions, [])
+
+    def test_stop_log_buses_fails_waits_and_forgets_buses(self):
+        node = Mock(get_path=Mock(return_value=os.path.join(self.tmpdir, 'test', 'node1')))
+        node.name = 'node1'
+        self.addCleanup(stop_log_buses, os.path.join(self.tmpdir, 'test'))
+        bus = log_bus(node)
+        subscription = bus.subscribe('never logged')
+        stop_log_buses(os.path.join(self.tmpdir, 'test'))
+        with self.assertRaisesRegexp(RuntimeError, 'stopped watching'):
+            subscription.wait(5)
+        self.assertIsNot(bus, log_bus(node))
@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from tools.logscan import LogCursor, combine_patterns
+
+
+class TestLogCursor(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'system.log')
+        self.cursor = LogCursor(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _append(self, text):
+        with open(self.path, 'a') as f:
+            f.write(text)
+
+    def test_missing_log(self):
+        self.assertEqual(self.cursor.read_new(), '')
+
+    def test_reads_only_appended_complete_lines(self):
+        self._append('INFO one\nERROR tw')
+        self.assertEqual(self.cursor.read_new(), 'INFO one\n')
+        self._append('o\n')
+        self.assertEqual(self.cursor.read_new(), 'ERROR two\n')
+        self.assertEqual(self.cursor.read_new(), '')
+
+    def test_skips_to_seek_start(self):
+        self._append('ERROR old\nINFO new\n')
+        self.assertEqual(self.cursor.read_new(seek_start=len('ERROR old\n')), 'INFO new\n')
+
+    def test_rereads_rotated_log(self):
+        self._append('INFO a fairly long first line\n')
+        self.cursor.read_new()
+        os.rename(self.path, self.path + '.1')
+        self._append('ERROR x\n')
+        self.assertEqual(self.cursor.read_new(), 'ERROR x\n')
+
+
+class TestCombinePatterns(TestCase):
+
+    def test_matches_any_pattern(self):
+        combined = combine_patterns([r'Streaming error occurred', r'node \d+ is down'])
+        self.assertTrue(combined.search('ERROR Streaming error occurred'))
+        self.assertTrue(combined.search('WARN node 2 is down'))
+        self.assertFalse(combined.search('ERROR node two is down'))
+
+    def test_no_patterns(self):
+        self.assertIsNone(combine_patterns(()))
@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+from mock import Mock
+
+from tools.logwatch import LogWatcher
+
+
+class TestLogWatcher(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.tmpdir, 'logs'))
+        node = Mock()
+        node.name = 'node1'
+        node.get_path.return_value = self.tmpdir
+        self.cluster = Mock()
+        self.cluster.nodelist.return_value = [node]
+        self.reported = []
+        self.error_seen = threading.Event()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _on_error(self, errordata):
+        self.reported.append(errordata)
+        self.error_seen.set()
+
+    def _log(self, text):
+        with open(os.path.join(self.tmpdir, 'logs', 'system.log'), 'a') as f:
+            f.write(text)
+
+    def test_reports_errors_as_they_are_logged(self):
+        watcher = LogWatcher(self.cluster, self._on_error)
+        watcher.start()
+        try:
+            self._log('INFO starting\n')
+            self._log('ERROR [main] something broke\n\tat Foo.bar\n')
+            self.assertTrue(self.error_seen.wait(5))
+        finally:
+            watcher.stop()
+        self.assertFalse(watcher.is_alive())
+        self.assertEqual(self.reported, [{'node1': [['ERROR [main] something broke', '\tat Foo.bar']]}])
+
+    def test_from_end_skips_earlier_errors(self):
+        self._log('ERROR [main] from an earlier test\n')
+        watcher = LogWatcher(self.cluster, self._on_error, from_end=True)
+        watcher.start()
+        watcher.stop()
+        self.assertEqual(self.reported, [])
@@ -0,0 +1,62 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from tools.metricsampler import Metric, MetricsSampler
+
+POOLS = 'org.apache.cassandra.metrics:type=ThreadPools,path=*,scope=*,name=PendingTasks'
+METRICS = (Metric('pending_tasks', POOLS, 'Value'),
+           Metric('heap_used', 'java.lang:type=Memory', 'HeapMemoryUsage', 'used'))
+
+
+class TestMetricsSampler(TestCase):
+
+    def setUp(self):
+        self.node = Mock()
+        self.node.name = 'node1'
+        self.node.pid = 1234
+        self.node.is_running.return_value = True
+        cluster = Mock()
+        cluster.nodelist.return_value = [self.node]
+        self.sampler = MetricsSampler(cluster, METRICS, capacity=2)
+        patcher = patch('tools.metricsampler.jmx_nodetool')
+        self.nodetool = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_samples_into_ring_buffer(self):
+        for heap in range(3):
+            self.nodetool.read.return_value = [
+                {'org.apache.cassandra.metrics:type=ThreadPools,path=request,scope=MutationStage,name=PendingTasks':
+                    {'Value': 4}},
+                heap]
+            self.sampler.sample()
+        self.nodetool.read.assert_called_with([(POOLS, 'Value', None),
+                                               ('java.lang:type=Memory', 'HeapMemoryUsage', 'used')])
+        samples = list(self.sampler.samples['node1'])
+        self.assertEqual([s['heap_used'] for s in samples], [1, 2])
+        self.assertEqual(samples[-1]['pending_tasks'], {'request/MutationStage': 4})
+
+    def test_skips_nodes_the_agent_cannot_attach_to(self):
+        self.nodetool.read.side_effect = subprocess.CalledProcessError(1, 'java')
+        self.sampler.sample()
+        self.sampler.sample()
+        self.assertEqual(self.nodetool.read.call_count, 1)
+        self.assertNotIn('node1', self.sampler.samples)
+        self.node.pid = 5678
+        self.sampler.sample()
+        self.assertEqual(self.nodetool.read.call_count, 2)
+
+    def test_dump(self):
+        self.nodetool.read.side_effect = Exception('Jolokia agent returned non-200 status')
+        self.sampler.sample()
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.sampler.dump(os.path.join(tmpdir, 'metrics.json'))
+        with open(os.path.join(tmpdir, 'metrics.json')) as f:
+            dumped = json.load(f)
+        self.assertEqual(dumped['node1'][0]['error'], 'Jolokia agent returned non-200 status')
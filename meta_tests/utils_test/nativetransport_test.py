@@ -0,0 +1,56 @@
+import socket
+import struct
+import threading
+from unittest import TestCase
+
+from tools import nativetransport
+
+
+class FakeNativeTransport(threading.Thread):
+    """
+    Answers each request on one connection with an empty response frame,
+    SUPPORTED to OPTIONS and READY to anything else.
+    """
+
+    def __init__(self):
+        super(FakeNativeTransport, self).__init__()
+        self.daemon = True
+        self.server = socket.socket()
+        self.server.bind(('127.0.0.1', 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.requests = []
+
+    def run(self):
+        conn, _ = self.server.accept()
+        try:
+            while True:
+                header = conn.recv(9)
+                if not header:
+                    break
+                version, _, stream, opcode, length = struct.unpack('>BBhBi', header)
+                if length:
+                    conn.recv(length)
+                self.requests.append(opcode)
+                response = nativetransport.SUPPORTED if opcode == nativetransport.OPTIONS else 0x02
+                conn.sendall(struct.pack('>BBhBi', 0x80 | version, 0, stream, response, 0))
+        finally:
+            conn.close()
+            self.server.close()
+
+
+class TestNativeTransportProbe(TestCase):
+
+    def test_handshake_with_ready_node(self):
+        node = FakeNativeTransport()
+        node.start()
+        self.assertTrue(nativetransport.wait_for_native_transport('127.0.0.1', node.port, 4, timeout=5))
+        node.join(5)
+        self.assertEqual(node.requests, [nativetransport.OPTIONS, nativetransport.STARTUP])
+
+    def test_gives_up_on_closed_port(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.assertFalse(nativetransport.wait_for_native_transport('127.0.0.1', port, 4, timeout=0.5))
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase
+
+from tools.perfbaseline import PerfBaselines, assert_no_regression, find_regressions
+from tools.stress import Latency, StressGc, StressSummary
+
+
+def summary(op_rate, p99):
+    return StressSummary(op_rate=op_rate, partition_rate=op_rate, row_rate=op_rate,
+                         latency=Latency(mean=1.0, median=1.0, p95=2.0, p99=p99, p999=10.0, max=20.0),
+                         total_partitions=1000, total_errors=0, gc=StressGc(0, 0, 0), operation_time=60,
+                         by_operation={})
+
+
+class TestPerfBaselines(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.baselines = PerfBaselines(os.path.join(self.directory, 'perf_baselines.json'))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_find_regressions(self):
+        baseline = {'op_rate': 1000, 'partition_rate': 1000, 'mean': 1.0, 'p99': 5.0}
+        self.assertEqual([], find_regressions(baseline, {'op_rate': 850, 'partition_rate': 2000, 'mean': 0.5, 'p99': 5.9}, 0.2))
+        regressions = find_regressions(baseline, {'op_rate': 700, 'partition_rate': 1000, 'mean': 1.0, 'p99': 7.0}, 0.2)
+        self.assertEqual(['op_rate', 'p99'], [r.metric for r in regressions])
+        self.assertAlmostEqual(-0.3, regressions[0].change)
+
+    def test_baseline_is_accepted_results(self):
+        self.assertEqual((None, None), self.baselines.baseline('writes'))
+        self.baselines.record('sha1', 'writes', {'op_rate': 1})
+        self.baselines.record('sha2', 'writes', {'op_rate': 2})
+        self.assertEqual((None, None), self.baselines.baseline('writes'))
+        self.baselines.accept('sha1', 'writes', {'op_rate': 1})
+        self.assertEqual(('sha1', {'op_rate': 1}), self.baselines.baseline('writes'))
+        self.assertEqual(2, self.baselines.baseline('writes', baseline_sha='sha2')[1]['op_rate'])
+
+    def test_concurrent_records(self):
+        workers = [threading.Thread(target=self.baselines.record, args=('sha1', 'workload{}'.format(i), {'op_rate': i}))
+                   for i in range(10)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(10, len(self.baselines.load()['results']['sha1']))
+
+    def test_assert_no_regression(self):
+        assert_no_regression(self.baselines, 'sha1', 'writes', summary(1000, 5.0), 0.2)
+        # regressions within tolerance don't add up: the baseline stays the first run
+        assert_no_regression(self.baselines, 'sha2', 'writes', summary(850, 5.5), 0.2)
+        with self.assertRaisesRegexp(AssertionError, 'op_rate'):
+            assert_no_regression(self.baselines, 'sha3', 'writes', summary(750, 5.5), 0.2)
+        self.assertEqual('sha1', self.baselines.baseline('writes')[0])
+        # results are recorded even when they regressed, but never accepted
+        self.assertEqual(750, self.baselines.load()['results']['sha3']['writes']['op_rate'])
+        with self.assertRaisesRegexp(AssertionError, 'op_rate'):
+            assert_no_regression(self.baselines, 'sha4', 'writes', summary(750, 5.5), 0.2, accept=True)
+        self.assertEqual('sha1', self.baselines.baseline('writes')[0])
+
+        assert_no_regression(self.baselines, 'sha5', 'writes', summary(1100, 5.0), 0.2, accept=True)
+        self.assertEqual('sha5', self.baselines.baseline('writes')[0])
+
+    def test_missing_summary(self):
+        with self.assertRaisesRegexp(AssertionError, 'no summary'):
+            assert_no_regression(self.baselines, 'sha1', 'writes', None, 0.2)
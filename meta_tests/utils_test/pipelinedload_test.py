@@ -0,0 +1,98 @@
+import threading
+import time
+from unittest import TestCase
+
+from tools.pipelinedload import Batcher, Pipeline, RowBatches
+
+
+class FakeFuture(object):
+    """
+    Completes, from a thread of its own like the driver's, after `delay`.
+    """
+
+    def __init__(self, session, parameters):
+        self.session = session
+        self.parameters = parameters
+
+    def add_callbacks(self, callback, errback, callback_args=(), errback_args=()):
+        def complete():
+            time.sleep(self.session.delay)
+            with self.session.lock:
+                self.session.in_flight -= 1
+            if self.parameters == ('fail',):
+                errback(RuntimeError('write failed'), *errback_args)
+            else:
+                callback([self.parameters], *callback_args)
+        threading.Thread(target=complete).start()
+
+
+class FakeSession(object):
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def execute_async(self, statement, parameters):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return FakeFuture(self, parameters)
+
+
+class TestPipeline(TestCase):
+
+    def bounded_in_flight_test(self):
+        session = FakeSession()
+        pipeline = Pipeline(session, 'test', max_in_flight=5)
+        results = []
+        for i in range(50):
+            pipeline.submit('statement', (i,), results.append)
+        pipeline.drain()
+        self.assertEqual(range(50), sorted(rows[0][0] for rows in results))
+        self.assertEqual(5, session.max_in_flight)
+
+        interval = pipeline.report(force=True)
+        self.assertEqual((50, 0), (interval.ops, interval.errors))
+        self.assertGreaterEqual(interval.p99, 10)
+        self.assertIsNone(pipeline.report())
+
+    def error_test(self):
+        pipeline = Pipeline(FakeSession(), 'test', max_in_flight=5)
+        pipeline.submit('statement', ('fail',))
+        with self.assertRaisesRegexp(RuntimeError, 'write failed'):
+            pipeline.drain()
+
+        def check(rows):
+            raise AssertionError('Data did not match expected value!')
+
+        pipeline = Pipeline(FakeSession(), 'test', max_in_flight=5)
+        pipeline.submit('statement', (1,), check)
+        with self.assertRaises(AssertionError):
+            pipeline.drain()
+
+
+class TestBatches(TestCase):
+
+    def batcher_test(self):
+        shipped = []
+        batcher = Batcher(shipped.append, batch_size=3)
+        for i in range(7):
+            batcher.add(i)
+        batcher.flush(partial=False)
+        self.assertEqual([[0, 1, 2], [3, 4, 5]], shipped)
+        batcher.flush()
+        self.assertEqual([6], shipped[-1])
+
+    def row_batches_test(self):
+        batches = RowBatches()
+        batches.put([('k1', 'v1'), ('k2', 'v2')])
+        batches.put([('k3', 'v3')])
+        self.assertEqual(3, batches.qsize())
+        self.assertEqual([('k1', 'v1'), ('k2', 'v2')], batches.get(timeout=1))
+        # rows count until verified, not until taken off the queue
+        self.assertEqual(3, batches.qsize())
+        batches.verified(2)
+        self.assertEqual(1, batches.qsize())
+        self.assertEqual([('k3', 'v3')], batches.get(timeout=1))
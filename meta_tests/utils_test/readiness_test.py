@@ -0,0 +1,80 @@
+from unittest import TestCase
+
+from mock import Mock, patch
+
+from tools.readiness import ClusterNotReady, cluster_problems, wait_for_ready
+
+STATUS = """\
+Datacenter: datacenter1
+=======================
+Status=Up/Down
+|/ State=Normal/Leaving/Joining/Moving
+--  Address    Load       Tokens       Owns (effective)  Host ID                               Rack
+UN  127.0.0.1  103.6 KiB  1            100.0%            0b5a5b5c-61f4-4b5e-9e7b-2c0e0c9d7d21  rack1
+UJ  127.0.0.2  98.2 KiB   1            100.0%            6c5a5b5c-61f4-4b5e-9e7b-2c0e0c9d7d22  rack1
+"""
+
+TPSTATS = """\
+Pool Name                    Active   Pending      Completed   Blocked  All time blocked
+MutationStage                     0         0             12         0                 0
+Native-Transport-Requests         1         0             30         0                 0
+CompactionExecutor                1         3             40         0                 0
+
+Message type           Dropped
+READ                         0
+"""
+
+
+def node(name, address, running=True):
+    n = Mock()
+    n.name = name
+    n.address.return_value = address
+    n.is_running.return_value = running
+    n.get_cassandra_version.return_value = '3.0.12'
+    n.get_path.return_value = '/nonexistent'
+    n.nodetool.side_effect = lambda cmd: ({'status': STATUS, 'tpstats': TPSTATS}[cmd], '', 0)
+    return n
+
+
+class TestReadiness(TestCase):
+
+    def setUp(self):
+        self.nodes = [node('node1', '127.0.0.1'), node('node2', '127.0.0.2'), node('node3', '127.0.0.3', running=False)]
+
+    def test_nodetool_problems(self):
+        problems = cluster_problems(self.nodes, use_jmx=False)
+        self.assertEqual(['node1 sees node2 as UJ',
+                          'node1 has busy thread pools: CompactionExecutor (1 active, 3 pending)',
+                          'node2 sees node2 as UJ',
+                          'node2 has busy thread pools: CompactionExecutor (1 active, 3 pending)'], problems)
+
+    def test_jmx_when_agent_running(self):
+        with patch('tools.readiness.javaagent_jolokia_port', side_effect=lambda n: 17100 if n is self.nodes[0] else None), \
+                patch('tools.readiness._jmx_state', return_value=({}, {})) as jmx_state, \
+                patch('tools.readiness._pending_batches'), patch('tools.readiness._pending_hints'):
+            cluster_problems(self.nodes)
+        jmx_state.assert_called_once_with(self.nodes[0])
+        self.assertEqual([], self.nodes[0].nodetool.call_args_list)
+        self.assertEqual(2, self.nodes[1].nodetool.call_count)
+
+    def test_schema_and_batches_through_sessions(self):
+        session = Mock(is_shutdown=False)
+        session.execute.side_effect = lambda query: {
+            'SELECT peer, schema_version FROM system.peers': [
+                Mock(peer='127.0.0.2', schema_version='b'), Mock(peer='127.0.0.3', schema_version='c')],
+            "SELECT schema_version FROM system.local WHERE key='local'": [Mock(schema_version='a')],
+            'SELECT id FROM system.batches LIMIT 1': [Mock()]}[query]
+        with patch('tools.readiness.node_problems', return_value=[]):
+            problems = cluster_problems(self.nodes, {'node1': session}, use_jmx=False)
+        self.assertEqual(['schema disagreement: node1=a, node2=b'], problems)
+
+    @patch('tools.readiness.cluster_problems')
+    def test_wait_for_ready(self, problems):
+        problems.side_effect = [['node1 sees node2 as DN'], []]
+        wait_for_ready(self.nodes, interval=0)
+        self.assertEqual(2, problems.call_count)
+
+        problems.side_effect = None
+        problems.return_value = ['node1 sees node2 as DN']
+        with self.assertRaisesRegexp(ClusterNotReady, 'node1 sees node2 as DN'):
+            wait_for_ready(self.nodes, timeout=0, interval=0)
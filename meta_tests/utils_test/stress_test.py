@@ -0,0 +1,153 @@
+import subprocess
+from unittest import TestCase
+
+from ccmlib.node import ToolError
+from mock import Mock
+
+from tools.stress import (Latency, StressCommand, StressGc, StressSummary,
+                          merge_summaries, parse_stress_output,
+                          run_parallel_stress, run_stress)
+
+STRESS_3_11_OUTPUT = """\
+Running WRITE with 200 threads for 10000 iteration
+type       total ops,    op/s,    pk/s,   row/s,    mean,     med,     .95,     .99,    .999,     max,   time,   stderr, errors,  gc: #,  max ms,  sum ms,  sdv ms,      mb
+total,          3345,    3345,    3345,    3345,    40.5,    32.7,   104.2,   143.4,   171.5,   180.2,    1.0,  0.00000,      0,      0,       0,       0,       0,       0
+total,         10000,    6655,    6655,    6655,    12.1,     9.0,    30.1,    60.2,    90.0,   100.1,    2.0,  0.35000,      0,      1,      12,      12,       0,     150
+
+
+Results:
+Op rate                   :    5,000 op/s  [WRITE: 5,000 op/s]
+Partition rate            :    5,000 pk/s  [WRITE: 5,000 pk/s]
+Row rate                  :    5,000 row/s [WRITE: 5,000 row/s]
+Latency mean              :   20.1 ms [WRITE: 20.1 ms]
+Latency median            :   10.8 ms [WRITE: 10.8 ms]
+Latency 95th percentile   :   60.0 ms [WRITE: 60.0 ms]
+Latency 99th percentile   :   93.6 ms [WRITE: 93.6 ms]
+Latency 99.9th percentile :  123.3 ms [WRITE: 123.3 ms]
+Latency max               :  180.2 ms [WRITE: 180.2 ms]
+Total partitions          :     10,000 [WRITE: 10,000]
+Total errors              :          0 [WRITE: 0]
+Total GC count            : 1
+Total GC memory           : 150.000 MiB
+Total GC time             :    0.0 seconds
+Avg GC time               :   12.0 ms
+StdDev GC time            :    0.0 ms
+Total operation time      : 00:00:02
+
+END
+"""
+
+STRESS_2_1_OUTPUT = """\
+type,      total ops,    op/s,    pk/s,   row/s,    mean,     med,     .95,     .99,    .999,     max,   time,   stderr, errors,  gc: #,  max ms,  sum ms,  sdv ms,      mb
+READ,           1000,    1000,    1000,    1000,     5.0,     4.1,    12.3,    20.0,    30.0,    40.0,    1.0,  0.00000,      0,      0,       0,       0,       0,       0
+WRITE,          1000,    1000,    1000,    1000,     3.0,     2.1,     6.3,    10.0,    15.0,    20.0,    1.0,  0.00000,      0,      0,       0,       0,       0,       0
+
+Results:
+op rate                   : 2000 [READ:1000, WRITE:1000]
+partition rate            : 2000 [READ:1000, WRITE:1000]
+row rate                  : 2000 [READ:1000, WRITE:1000]
+latency mean              : 4.0 [READ:5.0, WRITE:3.0]
+latency median            : 3.1 [READ:4.1, WRITE:2.1]
+latency 95th percentile   : 9.3 [READ:12.3, WRITE:6.3]
+latency 99th percentile   : 15.0 [READ:20.0, WRITE:10.0]
+latency 99.9th percentile : 22.5 [READ:30.0, WRITE:15.0]
+latency max               : 40.0 [READ:40.0, WRITE:20.0]
+Total partitions          : 2000 [READ:1000, WRITE:1000]
+Total errors              : 0 [READ:0, WRITE:0]
+total gc count            : 0
+total gc mb               : 0
+total gc time (s)         : 0
+avg gc time(ms)           : NaN
+stdev gc time(ms)         : 0
+Total operation time      : 00:01:01
+"""
+
+
+class TestStressCommand(TestCase):
+
+    def test_args(self):
+        command = StressCommand('write', n='10K', cl='ONE', no_warmup=True, truncate=None) \
+            .option('rate', threads=50).option('schema', 'replication(factor=2)').option('pop', seq='1..5')
+        self.assertEqual(command.args(), ['write', 'cl=ONE', 'n=10K', 'no-warmup', '-rate', 'threads=50',
+                                          '-schema', 'replication(factor=2)', '-pop', 'seq=1..5'])
+
+    def test_run_stress(self):
+        node = Mock()
+        node.stress.return_value = (STRESS_3_11_OUTPUT, '', 0)
+        result = run_stress(node, StressCommand('write', n=10000))
+        node.stress.assert_called_once_with(['write', 'n=10000'], whitelist=False)
+        self.assertEqual(result.summary.op_rate, 5000)
+
+
+class TestParseStressOutput(TestCase):
+
+    def test_3_11(self):
+        result = parse_stress_output(STRESS_3_11_OUTPUT)
+        self.assertEqual(len(result.intervals), 2)
+        last = result.intervals[-1]
+        self.assertEqual((last.type, last.total_ops, last.op_rate, last.p99, last.gc_count, last.gc_mb),
+                         ('total', 10000, 6655, 60.2, 1, 150))
+        summary = result.summary
+        self.assertEqual((summary.op_rate, summary.partition_rate, summary.total_partitions, summary.total_errors),
+                         (5000, 5000, 10000, 0))
+        self.assertEqual(summary.latency, (20.1, 10.8, 60.0, 93.6, 123.3, 180.2))
+        self.assertEqual(summary.gc, (1, 150, 0))
+        self.assertEqual(summary.operation_time, 2)
+        self.assertEqual(summary.by_operation['op_rate'], {'WRITE': 5000})
+
+    def test_2_1_mixed(self):
+        result = parse_stress_output(STRESS_2_1_OUTPUT)
+        self.assertEqual([i.type for i in result.intervals], ['READ', 'WRITE'])
+        self.assertEqual(result.summary.latency.p999, 22.5)
+        self.assertEqual(result.summary.by_operation['p99'], {'READ': 20.0, 'WRITE': 10.0})
+        self.assertEqual(result.summary.gc, (0, 0, 0))
+        self.assertEqual(result.summary.operation_time, 61)
+
+    def test_no_summary(self):
+        result = parse_stress_output('Connected to cluster\njava.lang.RuntimeException: failed\n')
+        self.assertIsNone(result.summary)
+        self.assertEqual(result.intervals, [])
+
+
+def summary(op_rate, latency, partitions):
+    return StressSummary(op_rate=op_rate, partition_rate=op_rate, row_rate=op_rate, latency=latency,
+                         total_partitions=partitions, total_errors=0, gc=StressGc(1, 10.0, 0.5),
+                         operation_time=10, by_operation={'op_rate': {'WRITE': op_rate}})
+
+
+class TestParallelStress(TestCase):
+
+    def test_merge_identical_clients(self):
+        latency = Latency(2.0, 1.0, 5.0, 10.0, 20.0, 40.0)
+        merged = merge_summaries([summary(1000, latency, 10000)] * 3)
+        self.assertEqual((merged.op_rate, merged.total_partitions, merged.gc), (3000, 30000, (3, 30.0, 1.5)))
+        self.assertEqual(merged.by_operation['op_rate'], {'WRITE': 3000})
+        for merged_value, value in zip(merged.latency, latency):
+            self.assertAlmostEqual(merged_value, value, places=6)
+
+    def test_merge_weights_by_partitions(self):
+        fast = summary(1000, Latency(1.0, 1.0, 1.0, 1.0, 1.0, 1.0), 99000)
+        slow = summary(10, Latency(100.0, 100.0, 100.0, 100.0, 100.0, 100.0), 1000)
+        merged = merge_summaries([fast, slow])
+        self.assertAlmostEqual(merged.latency.mean, 1.99)
+        self.assertLess(merged.latency.median, 1.01)
+        self.assertGreater(merged.latency.p999, 99)
+        self.assertEqual(merged.latency.max, 100)
+
+    def _node(self, output, rc=0):
+        node = Mock()
+        command = ['printf', '%s', output] if rc == 0 else ['false']
+        node.stress_process.side_effect = lambda args, whitelist: subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return node
+
+    def test_run_parallel_stress(self):
+        nodes = [self._node(STRESS_3_11_OUTPUT), self._node(STRESS_3_11_OUTPUT)]
+        result = run_parallel_stress([(node, StressCommand('write', n=10000)) for node in nodes])
+        nodes[0].stress_process.assert_called_once_with(['write', 'n=10000'], whitelist=True)
+        self.assertEqual(len(result.results), 2)
+        self.assertEqual(result.summary.op_rate, 10000)
+
+    def test_failed_client(self):
+        nodes = [self._node(STRESS_3_11_OUTPUT), self._node('', rc=1)]
+        self.assertRaises(ToolError, run_parallel_stress, [(node, ['write', 'n=1']) for node in nodes])
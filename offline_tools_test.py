@@ -3,12 +3,14 @@ import os
 import random
 import re
 import subprocess
+import time
 
 from ccmlib import common
 from ccmlib.node import ToolError
 
-from dtest import Tester, debug, create_ks
+from dtest import JOLOKIA_AT_START, Tester, debug, create_ks
 from tools.decorators import since
+from tools.jmxnodetool import jmx_nodetool
 
 
 class TestOfflineTools(Tester):
@@ -91,6 +93,11 @@ class TestOfflineTools(Tester):
         return map(int, re.findall("SSTable Level: ([0-9])", out))
 
     def wait_for_compactions(self, node):
+        if JOLOKIA_AT_START:
+            nodetool = jmx_nodetool(node)
+            while nodetool.compactionstats().pending_tasks:
+                time.sleep(0.1)
+            return
         pattern = re.compile("pending tasks: 0")
         while True:
             output, err, _ = node.nodetool("compactionstats")
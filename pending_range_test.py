@@ -7,6 +7,7 @@ from tools.decorators import no_vnodes
 
 @no_vnodes()
 class TestPendingRangeMovements(Tester):
+    hardcoded_addresses = True  # watches the log for a node by address
 
     @attr('resource-intensive')
     def pending_range_test(self):
@@ -0,0 +1,98 @@
+import os
+
+from nose.plugins.attrib import attr
+
+from dtest import CASSANDRA_GITREF, Tester
+from tools.decorators import since
+from tools.perfbaseline import PerfBaselines, assert_no_regression
+from tools.stress import StressCommand, one_client_per_node, run_parallel_stress, run_stress
+
+# where results are stored, by Cassandra SHA and workload
+PERF_BASELINE_FILE = os.environ.get('PERF_BASELINE_FILE', 'perf_baselines.json')
+# compare against the results of this SHA rather than the accepted baseline
+PERF_BASELINE_SHA = os.environ.get('PERF_BASELINE_SHA')
+# make the results of passing runs the accepted baseline of their workload
+PERF_ACCEPT_BASELINE = os.environ.get('PERF_ACCEPT_BASELINE', '').lower() in ('yes', 'true')
+# overrides the tolerance of every workload, as a fraction of the baseline
+PERF_TOLERANCE = os.environ.get('PERF_TOLERANCE')
+DEFAULT_TOLERANCE = 0.2
+
+PROFILES = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'profiles')
+DURATION = '60s'
+
+
+def profile(name):
+    return 'profile=' + os.path.join(PROFILES, name + '.yaml')
+
+
+@since('3.0')
+@attr('resource-intensive')
+class TestPerformance(Tester):
+    """
+    A fixed catalogue of workloads, each run through cassandra-stress for a
+    fixed duration on a 3 node cluster with one stress client per node. The
+    results are stored by Cassandra SHA in PERF_BASELINE_FILE and each run
+    fails if its throughput or latencies regressed from the accepted
+    baseline by more than the workload's tolerance.
+    """
+    # throughput under contention varies more between runs
+    tolerances = {'lwt_contention': 0.3}
+
+    def prepare(self, config=None):
+        cluster = self.cluster
+        if config:
+            cluster.set_configuration_options(values=config)
+        cluster.populate(3).start(wait_for_binary_proto=True)
+        return cluster.nodelist()
+
+    def check_regression(self, workload, result):
+        sha = CASSANDRA_GITREF or 'version:{}'.format(self.cluster.version())
+        tolerance = float(PERF_TOLERANCE) if PERF_TOLERANCE else self.tolerances.get(workload, DEFAULT_TOLERANCE)
+        assert_no_regression(PerfBaselines(PERF_BASELINE_FILE), sha, workload, result.summary, tolerance,
+                             baseline_sha=PERF_BASELINE_SHA, accept=PERF_ACCEPT_BASELINE)
+
+    def write_heavy_lcs_test(self):
+        """
+        Writes through leveled compaction, each client to its own keys.
+        """
+        nodes = self.prepare()
+        clients = [(node, StressCommand('write', duration=DURATION, cl='QUORUM')
+                    .option('schema', 'replication(factor=3)', 'compaction(strategy=LeveledCompactionStrategy)')
+                    .option('pop', 'seq={}..{}'.format(i * 10000000 + 1, (i + 1) * 10000000))
+                    .option('rate', threads=50))
+                   for i, node in enumerate(nodes)]
+        # staggered so the clients don't all try to create the schema at once
+        self.check_regression('write_heavy_lcs', run_parallel_stress(clients, stagger=5))
+
+    def read_heavy_row_cache_test(self):
+        """
+        Reads, with some writes, of a table that fits in the row cache.
+        """
+        nodes = self.prepare({'row_cache_size_in_mb': 100})
+        run_stress(nodes[0], StressCommand('user', profile('row_cache'), 'ops(insert=1)', n='100K', no_warmup=True)
+                   .option('rate', threads=50))
+        command = (StressCommand('user', profile('row_cache'), 'ops(read=9,insert=1)', duration=DURATION, cl='QUORUM')
+                   .option('rate', threads=50))
+        self.check_regression('read_heavy_row_cache', run_parallel_stress(one_client_per_node(nodes, command)))
+
+    def wide_partitions_test(self):
+        """
+        Slices of, and appends to, partitions of 10000 rows.
+        """
+        nodes = self.prepare()
+        run_stress(nodes[0], StressCommand('user', profile('wide_partitions'), 'ops(insert=1)', n='10K', no_warmup=True)
+                   .option('rate', threads=50))
+        command = (StressCommand('user', profile('wide_partitions'), 'ops(slice=9,insert=1)', duration=DURATION,
+                                 cl='QUORUM')
+                   .option('rate', threads=50))
+        self.check_regression('wide_partitions', run_parallel_stress(one_client_per_node(nodes, command)))
+
+    def lwt_contention_test(self):
+        """
+        Conditional updates from every node to the same 100 partitions.
+        """
+        nodes = self.prepare()
+        run_stress(nodes[0], StressCommand('user', profile('lwt'), 'ops(insert=1)', n='1K', no_warmup=True))
+        command = (StressCommand('user', profile('lwt'), 'ops(cas=1)', duration=DURATION, cl='QUORUM')
+                   .option('rate', threads=50))
+        self.check_regression('lwt_contention', run_parallel_stress(one_client_per_node(nodes, command)))
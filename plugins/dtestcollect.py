@@ -0,0 +1,45 @@
+import json
+
+from nose import plugins
+
+from plugins.dtesttimings import test_address
+
+
+class DtestCollectPlugin(plugins.Plugin):
+    """
+    Record every test nose runs in a file, one JSON object per line with
+    the test's address, whether it is tagged resource-intensive, the
+    shard_group of its class, if it has one, and whether its class has
+    hardcoded_addresses.
+
+    Meant to be used together with nose's --collect-only option so that
+    run_dtests.py can learn which tests a set of arguments selects and shard
+    them across worker processes.
+    """
+    enabled = True  # if this plugin is loaded at all, we're using it
+    name = 'dtest_collect'
+
+    def __init__(self, output_file=None):
+        """
+        @param output_file path of the file tests are written to.
+        """
+        super(DtestCollectPlugin, self).__init__()
+        self.output_file = output_file
+        self.tests = []
+
+    def configure(self, options, conf):
+        pass
+
+    def startTest(self, test):
+        testcase = getattr(test, 'test', None)
+        method = getattr(testcase, getattr(testcase, '_testMethodName', ''), None)
+        # @attr('resource-intensive') can be applied to test methods or whole classes
+        resource_intensive = any(getattr(tagged, 'resource-intensive', False) for tagged in (method, type(testcase)))
+        self.tests.append({'test': test_address(test), 'resource_intensive': bool(resource_intensive),
+                           'group': getattr(type(testcase), 'shard_group', None),
+                           'hardcoded_addresses': getattr(type(testcase), 'hardcoded_addresses', False)})
+
+    def finalize(self, result):
+        with open(self.output_file, 'w') as f:
+            for test in self.tests:
+                f.write(json.dumps(test) + '\n')
@@ -0,0 +1,138 @@
+"""
+Usage: dtestphases.py FILE [--by LEVEL]
+
+Summarize the per-test phase timings written by DtestPhasesPlugin. Run it
+from the dtest directory as `python -m plugins.dtestphases`.
+
+options:
+    --by LEVEL  aggregate by 'module', 'class' or 'test' [default: class]
+"""
+from __future__ import print_function
+
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from plugins.dtesttimings import PhaseTimingPlugin, test_address
+
+# The phases recorded for the test that is currently running, or None if
+# DtestPhasesPlugin isn't enabled.
+_PHASES = None
+
+
+@contextmanager
+def timed_phase(name):
+    """
+    Record the time spent in the with block as `name`, a phase of the
+    running test. Does nothing when phase timing is disabled.
+
+        with timed_phase('check_logs_for_errors'):
+            ...
+    """
+    started_at = time.time()
+    try:
+        yield
+    finally:
+        if _PHASES is not None:
+            _PHASES.append((name, started_at, time.time()))
+
+
+def time_method_as_phase(obj, method_name, phase=None):
+    """
+    Replace obj's method_name with a wrapper that records every call as a
+    phase of the running test, named after the method by default.
+    """
+    method = getattr(obj, method_name)
+
+    def timed(*args, **kwargs):
+        with timed_phase(phase or method_name):
+            return method(*args, **kwargs)
+    setattr(obj, method_name, timed)
+
+
+class DtestPhasesPlugin(PhaseTimingPlugin):
+    """
+    Append one JSON record per test to a file, with how long the test spent
+    in each phase: setUp and its steps, populating and starting the cluster,
+    the test body, and the steps of tearDown.
+
+    dtest.Tester marks its phases with timed_phase, besides the setUp, body
+    and tearDown split of PhaseTimingPlugin. Phases that run more than once
+    in a test, e.g. start, are summed. Phases can nest: populate and start
+    are part of body.
+    """
+    name = 'dtest_phases'
+
+    def __init__(self, output_file=None):
+        """
+        @param output_file path of the file records are appended to. Several
+                           processes may append to the same file.
+        """
+        super(DtestPhasesPlugin, self).__init__()
+        self.output_file = output_file
+
+    def startTest(self, test):
+        global _PHASES
+        _PHASES = []
+        super(DtestPhasesPlugin, self).startTest(test)
+
+    def timed(self, test, total, setup, body, teardown):
+        global _PHASES
+        recorded, _PHASES = _PHASES or [], None
+
+        phases = OrderedDict((name, duration) for name, duration in
+                             (('setUp', setup), ('body', body), ('tearDown', teardown)) if duration is not None)
+        for name, started_at, finished_at in recorded:
+            phases[name] = phases.get(name, 0) + finished_at - started_at
+
+        _, module, call = test.address()
+        record = OrderedDict([
+            ('test', test_address(test)),
+            ('module', module),
+            ('class', call.rsplit('.', 1)[0] if call and '.' in call else None),
+            ('outcome', self.outcome),
+            ('started_at', self.started_at),
+            ('total', total),
+            ('phases', phases),
+        ])
+        # a single write of a whole line, so concurrent workers don't interleave records
+        with open(self.output_file, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+
+def read_records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records, by='class'):
+    """
+    Aggregate records by 'module', 'class' or 'test'. Returns an ordered
+    dict from each module, class or test to the number of tests, their
+    total time and the total time spent in each phase, slowest first.
+    """
+    if by not in ('module', 'class', 'test'):
+        raise ValueError("Can only summarize by 'module', 'class' or 'test', not {!r}".format(by))
+    summaries = {}
+    for record in records:
+        if by == 'class' and record['class']:
+            key = '{}:{}'.format(record['module'], record['class'])
+        else:
+            key = record[by] if by != 'class' else record['module']
+        summary = summaries.setdefault(key, {'tests': 0, 'total': 0, 'phases': {}})
+        summary['tests'] += 1
+        summary['total'] += record['total']
+        for phase, duration in record['phases'].items():
+            summary['phases'][phase] = summary['phases'].get(phase, 0) + duration
+    return OrderedDict(sorted(summaries.items(), key=lambda item: item[1]['total'], reverse=True))
+
+
+if __name__ == '__main__':
+    from docopt import docopt
+
+    options = docopt(__doc__)
+    for key, summary in summarize(read_records(options['FILE']), by=options['--by']).items():
+        print('{} ({} tests): {:.1f}s'.format(key, summary['tests'], summary['total']))
+        for phase, duration in sorted(summary['phases'].items(), key=lambda item: item[1], reverse=True):
+            print('    {:<24}{:8.2f}s'.format(phase, duration))
@@ -0,0 +1,145 @@
+import sqlite3
+import time
+from abc import ABCMeta, abstractmethod
+
+from nose import plugins
+
+
+class TimingsDatabase(object):
+    """
+    A local sqlite database of how long each test took, split into the
+    setUp, test body and tearDown phases, used by run_dtests.py to balance
+    tests across workers.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS timings ('
+                             'test TEXT NOT NULL, setup REAL, body REAL, teardown REAL, '
+                             'total REAL NOT NULL, outcome TEXT, recorded_at REAL NOT NULL)')
+                conn.execute('CREATE INDEX IF NOT EXISTS timings_test ON timings (test, recorded_at)')
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # workers write concurrently, so wait on the lock rather than failing
+        return sqlite3.connect(self.path, timeout=60)
+
+    def record(self, test, total, setup=None, body=None, teardown=None, outcome=None):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('INSERT INTO timings (test, setup, body, teardown, total, outcome, recorded_at) '
+                             'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (test, setup, body, teardown, total, outcome, time.time()))
+        finally:
+            conn.close()
+
+    def estimates(self, history=5):
+        """
+        Returns a dict mapping test addresses to the median total duration
+        of their last `history` recorded runs, in seconds.
+        """
+        durations = {}
+        conn = self._connect()
+        try:
+            for test, total in conn.execute('SELECT test, total FROM timings ORDER BY recorded_at DESC'):
+                runs = durations.setdefault(test, [])
+                if len(runs) < history:
+                    runs.append(total)
+        finally:
+            conn.close()
+        return {test: sorted(runs)[len(runs) // 2] for test, runs in durations.items()}
+
+
+def test_address(test):
+    """
+    The address nose accepts on the command line for a nose.case.Test,
+    e.g. 'paging_test:TestPagingSize.test_with_no_results'.
+    """
+    _, module, call = test.address()
+    return '{}:{}'.format(module, call) if call else module
+
+
+# nose will discover this as a test, so we manually make it not a test
+test_address.__test__ = False
+
+
+class PhaseTimingPlugin(plugins.Plugin):
+    """
+    Base of the plugins timing every test, that record, in timed, its wall
+    time split into the setUp, test body and tearDown phases.
+
+    dtest.Tester marks the end of setUp and the start of tearDown with the
+    setup_finished_at and teardown_started_at attributes, which are used to
+    split the total time into phases; tests that aren't Testers only get a
+    total.
+    """
+    __metaclass__ = ABCMeta
+    enabled = True  # if this plugin is loaded at all, we're using it
+
+    def __init__(self):
+        super(PhaseTimingPlugin, self).__init__()
+        self.outcome = None
+        self.started_at = None
+
+    def configure(self, options, conf):
+        pass
+
+    def startTest(self, test):
+        self.outcome = None
+        self.started_at = time.time()
+
+    def addSuccess(self, test):
+        self.outcome = 'success'
+
+    def addFailure(self, test, err):
+        self.outcome = 'failure'
+
+    def addError(self, test, err):
+        self.outcome = 'error'
+
+    def stopTest(self, test):
+        stopped_at = time.time()
+        testcase = getattr(test, 'test', None)
+        setup_finished_at = getattr(testcase, 'setup_finished_at', None)
+        teardown_started_at = getattr(testcase, 'teardown_started_at', None)
+
+        setup = body = teardown = None
+        if setup_finished_at is not None:
+            setup = setup_finished_at - self.started_at
+            if teardown_started_at is not None:
+                body = teardown_started_at - setup_finished_at
+                teardown = stopped_at - teardown_started_at
+
+        self.timed(test, stopped_at - self.started_at, setup, body, teardown)
+
+    @abstractmethod
+    def timed(self, test, total, setup, body, teardown):
+        """
+        Records the timings of test, with self.outcome. The phases are None
+        when unknown.
+        """
+
+
+class DtestTimingsPlugin(PhaseTimingPlugin):
+    """
+    Record the wall time of every test in a TimingsDatabase.
+    """
+    name = 'dtest_timings'
+
+    def __init__(self, db_path=None):
+        """
+        @param db_path path of the sqlite database to record timings in.
+        """
+        super(DtestTimingsPlugin, self).__init__()
+        self.db_path = db_path
+
+    def begin(self):
+        self.db = TimingsDatabase(self.db_path)
+
+    def timed(self, test, total, setup, body, teardown):
+        self.db.record(test_address(test), total, setup=setup, body=body, teardown=teardown, outcome=self.outcome)
@@ -82,6 +82,7 @@ class TestPushedNotifications(Tester):
     """
     Tests for pushed native protocol notification from Cassandra.
     """
+    hardcoded_addresses = True  # rpc addresses and added nodes are fixed
 
     @no_vnodes()
     def move_single_node_test(self):
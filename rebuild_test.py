@@ -10,6 +10,7 @@ from tools.decorators import since, no_vnodes
 
 
 class TestRebuild(Tester):
+    hardcoded_addresses = True  # added nodes are given fixed addresses
     ignore_log_patterns = (
         # This one occurs when trying to send the migration to a
         # node that hasn't started yet, and when it does, it gets
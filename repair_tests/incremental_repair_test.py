@@ -28,6 +28,7 @@ class ConsistentState(object):
 
 
 class TestIncRepair(Tester):
+    hardcoded_addresses = True  # the replacement node is given a fixed address
     ignore_log_patterns = (r'Can\'t send migration request: node.*is down',)
 
     @classmethod
@@ -151,6 +151,7 @@ class BaseRepairTest(Tester):
 
 class TestRepair(BaseRepairTest):
     __test__ = True
+    hardcoded_addresses = True  # repair -hosts names the nodes by address
 
     @since('2.2.1', '4')
     def no_anticompaction_after_dclocal_repair_test(self):
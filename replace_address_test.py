@@ -21,6 +21,8 @@ class NodeUnavailable(Exception):
 
 class BaseReplaceAddressTest(Tester):
     __test__ = False
+    allow_cluster_templates = False  # the replaced nodes' tokens and versions come from their first boot
+    hardcoded_addresses = True  # replacement nodes are given fixed addresses
     replacement_node = None
     ignore_log_patterns = (
         # This one occurs when trying to send the migration to a
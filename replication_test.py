@@ -298,6 +298,7 @@ class SnitchConfigurationUpdateTest(Tester):
     Since CASSANDRA-10243 it is no longer possible to change rack or dc for live nodes so we must specify
     which nodes should be shutdown in order to have the rack changed.
     """
+    hardcoded_addresses = True  # snitch and broadcast_address settings name the nodes by address
 
     ignore_log_patterns = ["Fatal exception during initialization",
                            "Cannot start node if snitch's rack(.*) differs from previous rack(.*)",
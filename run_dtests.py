@@ -1,7 +1,9 @@
 #!/usr/bin/env python
 """
 Usage: run_dtests.py [--nose-options NOSE_OPTIONS] [TESTS...] [--vnodes VNODES_OPTIONS...]
-                 [--runner-debug | --runner-quiet] [--dry-run]
+                 [--runner-debug | --runner-quiet] [--dry-run] [--workers WORKERS]
+                 [--timings-db TIMINGS_DB] [--memory-budget MEMORY_BUDGET]
+                 [--config-concurrency CONFIG_CONCURRENCY] [--phase-timings PHASE_TIMINGS]
 
 nosetests options:
     --nose-options NOSE_OPTIONS  specify options to pass to `nosetests`.
@@ -10,6 +12,32 @@ nosetests options:
 script configuration options:
     --runner-debug -d            print debug statements in this script
     --runner-quiet -q            quiet all output from this script
+    --workers WORKERS            shard the selected tests across this many
+                                 concurrent nosetests processes [default: 1].
+                                 Worker N runs its clusters on 127.0.N.x, logs
+                                 to logs/workerN, and the xunit reports of all
+                                 workers are merged into one.
+    --timings-db TIMINGS_DB      sqlite database the wall time of each test is
+                                 recorded in. With --workers, tests are packed
+                                 onto workers longest first using the durations
+                                 recorded there [default: dtest_timings.db]
+    --memory-budget MEMORY_BUDGET
+                                 memory in MB the clusters of all workers may
+                                 use together. Limits how many workers may run
+                                 resource-intensive tests at the same time.
+    --config-concurrency CONFIG_CONCURRENCY
+                                 how many points of the configuration matrix
+                                 to run at the same time. Each concurrent run
+                                 gets its own address blocks and logs to
+                                 logs/configN, and their xunit reports are
+                                 merged into one. Tests with hardcoded
+                                 addresses take turns in the first block
+                                 [default: 1]
+    --phase-timings PHASE_TIMINGS
+                                 append a JSON record per test with the time
+                                 spent in each of its phases to this file.
+                                 Summarize it with
+                                 `python -m plugins.dtestphases PHASE_TIMINGS`
 
 cluster configuration options:
     --vnodes VNODES_OPTIONS...   specify whether to run with or without vnodes.
@@ -22,15 +50,23 @@ example:
 """
 from __future__ import print_function
 
+import atexit
+import json
+import os
+import shutil
 import subprocess
-from collections import namedtuple
+import threading
+from collections import OrderedDict, namedtuple
 from itertools import product
+from multiprocessing.pool import ThreadPool
 from os import getcwd
-from tempfile import NamedTemporaryFile
+from tempfile import NamedTemporaryFile, mkdtemp
+from xml.etree import ElementTree
 
 from docopt import docopt
 
 from plugins.dtestconfig import GlobalConfigObject
+from plugins.dtesttimings import TimingsDatabase
 
 
 # Generate values in a matrix from these lists of values for each attribute
@@ -40,10 +76,36 @@ default_config_matrix = GlobalConfigObject(
 )
 
 
+# Used to schedule tests across workers when there is no better information.
+DEFAULT_TEST_DURATION_S = 60
+# Rough memory footprints of the cluster a worker runs: the typical test runs
+# a few nodes with ccm's default 500M heap, while tests tagged
+# resource-intensive run more or bigger nodes.
+WORKER_MEMORY_MB = 2048
+RESOURCE_INTENSIVE_MEMORY_MB = 8192
+
+# Tests with hardcoded_addresses only work in address block 0, which the
+# concurrent runs of the configuration matrix take turns in.
+_FIRST_BLOCK_LOCK = threading.Lock()
+
+
 def _noop(*args, **kwargs):
     pass
 
 
+def _synchronized(func):
+    """
+    Wrap func so only one thread calls it at a time, e.g. to keep the
+    messages of concurrent runs from interleaving.
+    """
+    lock = threading.Lock()
+
+    def wrapper(*args, **kwargs):
+        with lock:
+            return func(*args, **kwargs)
+    return wrapper
+
+
 class ValidationResult(namedtuple('_ValidationResult', ['serialized', 'error_messages'])):
     """
     A value to be returned from validation functions. If serialization works,
@@ -163,6 +225,294 @@ def product_of_values(d):
     return tuple(dict(result) for result in product(*tuple_list))
 
 
+def timings_plugin(db_path):
+    """
+    A plugin spec for write_nose_script that records test durations in the
+    TimingsDatabase at db_path.
+    """
+    return ('from plugins.dtesttimings import DtestTimingsPlugin',
+            'DtestTimingsPlugin({!r})'.format(os.path.abspath(db_path)))
+
+
+def phase_timings_plugin(output_file):
+    """
+    A plugin spec for write_nose_script that appends the phase timings of
+    each test to output_file.
+    """
+    return ('from plugins.dtestphases import DtestPhasesPlugin',
+            'DtestPhasesPlugin({!r})'.format(os.path.abspath(output_file)))
+
+
+def write_nose_script(config, plugins=()):
+    """
+    Generate a file that runs nose, passing in config as the configuration
+    object. `plugins` is an iterable of (import statement, constructor
+    expression) pairs for additional plugins to load.
+
+    Yes, this is icky. The reason we do it is because we're dealing with
+    global configuration. We've decided global, nosetests-run-level
+    configuration is the way to go. This means we don't want to call
+    nose.main() multiple times in the same Python interpreter -- I have
+    not yet found a way to re-execute modules (thus getting new
+    module-level configuration) for each call. This didn't even work for
+    me with exec(script, {}, {}). So, here we are.
+
+    How do we execute code in a new interpreter each time? Generate the
+    code as text, then shell out to a new interpreter.
+
+    Returns the NamedTemporaryFile, which is deleted when closed.
+    """
+    # These properties have to hold if we want to evaluate their reprs
+    # below in the generated file.
+    assert eval(repr(config), {'GlobalConfigObject': GlobalConfigObject}, {}) == config
+
+    to_execute = (
+        'import nose\n'
+        'from plugins.dtestconfig import DtestConfigPlugin, GlobalConfigObject\n'
+        '{imports}'
+        'nose.main(addplugins=[DtestConfigPlugin({config}){plugins}])\n'
+    ).format(config=repr(config),
+             imports=''.join(imp + '\n' for imp, _ in plugins),
+             plugins=''.join(', ' + constructor for _, constructor in plugins))
+    temp = NamedTemporaryFile(dir=getcwd())
+    temp.write(to_execute)
+    temp.flush()
+    return temp
+
+
+def collect_tests(config, nose_argv):
+    """
+    Returns the tests nose would run for nose_argv under config, in the
+    order it would run them, without running them. Each test is a dict with
+    its 'test' address, whether it's 'resource_intensive', its class's
+    shard 'group', if any, and whether its class has 'hardcoded_addresses'.
+
+    Raises a RuntimeError, with nose's output, if nose failed, e.g. on a
+    bad option or a module that doesn't import, or selected no tests.
+    """
+    with NamedTemporaryFile(dir=getcwd()) as collected:
+        plugin = ('from plugins.dtestcollect import DtestCollectPlugin',
+                  'DtestCollectPlugin({!r})'.format(collected.name))
+        script = write_nose_script(config, plugins=(plugin,))
+        with open(os.devnull, 'w') as devnull:
+            proc = subprocess.Popen(['python', script.name, '--collect-only'] + nose_argv,
+                                    stdout=devnull, stderr=subprocess.PIPE)
+            _, stderr = proc.communicate()
+        script.close()
+        tests = [json.loads(line) for line in collected if line.strip()]
+    if proc.returncode != 0 or not tests:
+        raise RuntimeError('Collecting the tests for {} {} (exit code {}):\n{}'.format(
+            nose_argv, 'failed' if proc.returncode != 0 else 'found none', proc.returncode, stderr))
+    return tests
+
+
+def resource_intensive_worker_count(workers, memory_budget=None):
+    """
+    How many of the workers can run resource-intensive tests at the same
+    time while the others run regular tests without exceeding
+    memory_budget, in MB. Always at least one, so every test gets to run.
+    """
+    if memory_budget is None:
+        return workers
+    extra_memory = RESOURCE_INTENSIVE_MEMORY_MB - WORKER_MEMORY_MB
+    count = (memory_budget - workers * WORKER_MEMORY_MB) // extra_memory
+    return max(1, min(workers, count))
+
+
+def shard_tests(tests, workers, estimates=None, memory_budget=None):
+    """
+    Split tests, as returned by collect_tests, into `workers` lists of test
+    addresses so that the workers finish at about the same time.
+
+    Tests from the same class are kept together, so class-level setup such as
+    ReusableClusterTester's shared cluster is only paid once, and so are the
+    tests of classes with the same shard_group. Groups are handed out longest-processing-time-first, each to
+    the worker with the least work so far, using the durations in
+    `estimates` (a dict of test address to seconds) or the median known
+    duration for new tests. Groups with resource-intensive tests only go to
+    the first resource_intensive_worker_count() workers, and groups with
+    hardcoded_addresses to the first worker, which runs in address block 0.
+    """
+    estimates = estimates or {}
+    known_durations = sorted(estimates[test['test']] for test in tests if test['test'] in estimates)
+    default_duration = known_durations[len(known_durations) // 2] if known_durations else DEFAULT_TEST_DURATION_S
+
+    groups = OrderedDict()
+    for test in tests:
+        group = groups.setdefault(test.get('group') or test['test'].rsplit('.', 1)[0],
+                                  {'tests': [], 'duration': 0, 'resource_intensive': False, 'hardcoded_addresses': False})
+        group['tests'].append(test['test'])
+        group['duration'] += estimates.get(test['test'], default_duration)
+        group['resource_intensive'] = group['resource_intensive'] or test['resource_intensive']
+        group['hardcoded_addresses'] = group['hardcoded_addresses'] or test.get('hardcoded_addresses', False)
+
+    resource_intensive_workers = resource_intensive_worker_count(workers, memory_budget)
+    loads = [0] * workers
+    shards = [[] for _ in range(workers)]
+    for group in sorted(groups.values(), key=lambda g: g['duration'], reverse=True):
+        if group['hardcoded_addresses']:
+            candidates = [0]
+        else:
+            candidates = range(resource_intensive_workers if group['resource_intensive'] else workers)
+        worker = min(candidates, key=lambda i: loads[i])
+        loads[worker] += group['duration']
+        shards[worker].extend(group['tests'])
+    return shards
+
+
+def split_xunit_options(nose_option_list):
+    """
+    Returns nose_option_list without xunit options, and the xunit report
+    file name they asked for (or None if they didn't ask for a report).
+    """
+    options, xunit_file, with_xunit = [], 'nosetests.xml', False
+    for option in nose_option_list:
+        if option == '--with-xunit':
+            with_xunit = True
+        elif option.startswith('--xunit-file='):
+            xunit_file = option.split('=', 1)[1]
+        else:
+            options.append(option)
+    return options, (xunit_file if with_xunit else None)
+
+
+def worker_environment(block, log_dir):
+    """
+    Environment for a worker process whose clusters live on 127.0.<block>.x,
+    with its own saved logs and last_test_dir file, see dtest.ADDRESS_BLOCK.
+    """
+    env = dict(os.environ)
+    env['ADDRESS_BLOCK'] = str(block)
+    env['LOG_SAVED_DIR'] = log_dir
+    env['LAST_TEST_DIR'] = os.path.join(log_dir, 'last_test_dir')
+    return env
+
+
+def share_cluster_templates():
+    """
+    Makes the workers share the cluster templates they build, see
+    dtest.ClusterTemplateCache, in a directory removed when the run exits
+    unless CLUSTER_TEMPLATE_DIR says where to keep them.
+    """
+    if os.environ.get('ENABLE_CLUSTER_TEMPLATES', '').lower() in ('yes', 'true') and not os.environ.get('CLUSTER_TEMPLATE_DIR'):
+        template_dir = mkdtemp(prefix='dtest-templates-')
+        atexit.register(shutil.rmtree, template_dir, True)
+        os.environ['CLUSTER_TEMPLATE_DIR'] = template_dir
+
+
+def merge_xunit_reports(report_files, output_file, labels=None):
+    """
+    Merge the xunit reports written by nose's xunit plugin into one, summing
+    the counts on the testsuite elements. Missing reports are ignored.
+
+    If labels are given, the classnames of the test cases in each report are
+    prefixed with the report's label, so the same test run under different
+    configurations can be told apart.
+    """
+    merged = ElementTree.Element('testsuite', name='nosetests')
+    totals = {'tests': 0, 'errors': 0, 'failures': 0, 'skip': 0}
+    for report_file, label in zip(report_files, labels or [None] * len(report_files)):
+        if not os.path.exists(report_file):
+            continue
+        suite = ElementTree.parse(report_file).getroot()
+        for key in totals:
+            totals[key] += int(suite.get(key, 0))
+        for testcase in suite:
+            if label:
+                testcase.set('classname', '{}.{}'.format(label, testcase.get('classname', '')))
+            merged.append(testcase)
+    for key, value in totals.items():
+        merged.set(key, str(value))
+    ElementTree.ElementTree(merged).write(output_file, encoding='UTF-8', xml_declaration=True)
+
+
+def run_workers(script_name, nose_option_list, shards, base_block=0, log_dir='logs', xunit_file=None, debug=_noop, output=_noop,
+                first_block_shard=None):
+    """
+    Run one nose process per shard concurrently, each in its own address
+    block and log directory, and wait for all of them. Each worker's output
+    goes to nosetests.out in its log directory.
+
+    first_block_shard, tests with hardcoded addresses, is run by one more
+    worker in address block 0, once no other run of run_workers uses it.
+
+    Returns the list of exit codes.
+    """
+    def start(block, shard):
+        worker_log_dir = os.path.join(log_dir, 'worker{}'.format(block))
+        if not os.path.exists(worker_log_dir):
+            os.makedirs(worker_log_dir)
+        cmd_list = ['python', script_name] + nose_option_list
+        if xunit_file:
+            cmd_list += ['--with-xunit', '--xunit-file={}'.format(os.path.join(worker_log_dir, 'nosetests.xml'))]
+        cmd_list += shard
+        debug('worker {} running {} tests: {cmd_list}'.format(block, len(shard), cmd_list=cmd_list))
+        out = open(os.path.join(worker_log_dir, 'nosetests.out'), 'w')
+        return (block, worker_log_dir, out,
+                subprocess.Popen(cmd_list, stdout=out, stderr=subprocess.STDOUT,
+                                 env=worker_environment(block, worker_log_dir)))
+
+    procs = [start(base_block + i, shard) for i, shard in enumerate(shards)]
+    if first_block_shard:
+        with _FIRST_BLOCK_LOCK:
+            procs.append(start(0, first_block_shard))
+            procs[-1][3].wait()
+
+    results = []
+    for block, worker_log_dir, out, proc in procs:
+        results.append(proc.wait())
+        out.close()
+        output('worker {} exited with {}, see {}'.format(block, results[-1], os.path.join(worker_log_dir, 'nosetests.out')))
+
+    if xunit_file:
+        merge_xunit_reports([os.path.join(worker_log_dir, 'nosetests.xml') for _, worker_log_dir, _, _ in procs], xunit_file)
+    return results
+
+
+def run_config(config, script_name, nose_option_list, test_list, workers=1, base_block=0, log_dir=None,
+               estimates=None, memory_budget=None, debug=_noop, output=_noop):
+    """
+    Run test_list under config with the nose script at script_name, written
+    by write_nose_script, sharding the tests across `workers` processes.
+
+    Without a log_dir, a single worker runs in the foreground exactly like
+    `nosetests` would. With one, the run is one of several concurrent runs of
+    the configuration matrix: its workers use the address blocks from
+    base_block on and keep their logs, output and xunit reports under
+    log_dir. Tests with hardcoded addresses then wait for address block 0,
+    see run_workers.
+
+    Returns the list of exit codes.
+    """
+    nose_argv = nose_option_list + test_list
+    if workers == 1 and log_dir is None:
+        # We pass nose_argv as options to the python call to maintain
+        # compatibility with the nosetests command. Arguments passed in via the
+        # command line are treated one way, args passed in as
+        # nose.main(argv=...) are treated another. Compare with the options
+        # -xsv for an example.
+        cmd_list = ['python', script_name] + nose_argv
+        debug('subprocess.call-ing {cmd_list}'.format(cmd_list=cmd_list))
+        return [subprocess.call(cmd_list)]
+
+    first_block_shard = None
+    if workers > 1 or base_block:
+        tests = collect_tests(config, nose_argv)
+        if base_block:
+            first_block_shard = [test['test'] for test in tests if test.get('hardcoded_addresses')]
+            tests = [test for test in tests if not test.get('hardcoded_addresses')]
+        output('Sharding {} tests across {} workers'.format(len(tests), workers))
+        shards = [shard for shard in shard_tests(tests, workers, estimates=estimates, memory_budget=memory_budget)
+                  if shard]
+    else:
+        shards = [test_list]
+    worker_options, xunit_file = split_xunit_options(nose_option_list)
+    if xunit_file and log_dir is not None:
+        xunit_file = os.path.join(log_dir, 'nosetests.xml')
+    return run_workers(script_name, worker_options, shards, base_block=base_block, log_dir=log_dir or 'logs',
+                       xunit_file=xunit_file, debug=debug, output=output, first_block_shard=first_block_shard)
+
+
 if __name__ == '__main__':
     options = docopt(__doc__)
     validated_options = validate_and_serialize_options(options)
@@ -178,8 +528,10 @@ if __name__ == '__main__':
     if options['--runner-quiet']:  # --debug and --quiet are mutually exclusive, enforced by docopt
         verbosity = 0
 
-    debug = print if verbosity >= 2 else _noop
-    output = print if verbosity >= 1 else _noop
+    # configurations may run concurrently, see --config-concurrency
+    synchronized_print = _synchronized(print)
+    debug = synchronized_print if verbosity >= 2 else _noop
+    output = synchronized_print if verbosity >= 1 else _noop
 
     # Get dictionaries corresponding to each point in the configuration matrix
     # we want to run, then generate a config object for each of them.
@@ -189,61 +541,95 @@ if __name__ == '__main__':
     output('About to run nosetests with config objects:\n'
            '\t{configs}\n'.format(configs='\n\t'.join(map(repr, all_configs))))
 
-    results = []
+    try:
+        workers = int(options['--workers'])
+        assert workers >= 1
+    except (ValueError, AssertionError):
+        raise ValueError('--workers must be a positive integer, got {}'.format(options['--workers']))
+    try:
+        config_concurrency = min(int(options['--config-concurrency']), len(all_configs))
+        assert config_concurrency >= 1
+    except (ValueError, AssertionError):
+        raise ValueError('--config-concurrency must be a positive integer, got {}'.format(options['--config-concurrency']))
+    # every worker of every concurrent run needs its own 127.0.N.x block, past
+    # block 0 which they share for tests with hardcoded addresses, and
+    # address_block_port shifts JMX ports, which are 100 apart, by N
+    if 1 + len(all_configs) * workers > 100 and config_concurrency > 1:
+        raise ValueError('{} configurations with {} workers each need more than 100 address blocks'.format(
+            len(all_configs), workers))
+    memory_budget = int(options['--memory-budget']) if options['--memory-budget'] else None
+    if memory_budget is not None:
+        if config_concurrency * workers * WORKER_MEMORY_MB > memory_budget:
+            output('Warning: {} workers likely need more than the {}MB memory budget'.format(
+                config_concurrency * workers, memory_budget))
+        # concurrent runs share the budget
+        memory_budget //= config_concurrency
+
+    scripts = []
     for config in all_configs:
-        # These properties have to hold if we want to evaluate their reprs
-        # below in the generated file.
-        assert eval(repr(config), {'GlobalConfigObject': GlobalConfigObject}, {}) == config
         assert eval(repr(nose_argv), {}, {}) == nose_argv
 
-        output('Running dtests with config object {}'.format(config))
-
-        # Generate a file that runs nose, passing in config as the
-        # configuration object.
-        #
-        # Yes, this is icky. The reason we do it is because we're dealing with
-        # global configuration. We've decided global, nosetests-run-level
-        # configuration is the way to go. This means we don't want to call
-        # nose.main() multiple times in the same Python interpreter -- I have
-        # not yet found a way to re-execute modules (thus getting new
-        # module-level configuration) for each call. This didn't even work for
-        # me with exec(script, {}, {}). So, here we are.
-        #
-        # How do we execute code in a new interpreter each time? Generate the
-        # code as text, then shell out to a new interpreter.
-        to_execute = (
-            'import nose\n'
-            'from plugins.dtestconfig import DtestConfigPlugin, GlobalConfigObject\n'
-            'nose.main(addplugins=[DtestConfigPlugin({config})])\n'
-        ).format(config=repr(config))
-        temp = NamedTemporaryFile(dir=getcwd())
-        debug('Writing the following to {}:'.format(temp.name))
-
-        debug('```\n{to_execute}```\n'.format(to_execute=to_execute))
-        temp.write(to_execute)
-        temp.flush()
-
-        # We pass nose_argv as options to the python call to maintain
-        # compatibility with the nosetests command. Arguments passed in via the
-        # command line are treated one way, args passed in as
-        # nose.main(argv=...) are treated another. Compare with the options
-        # -xsv for an example.
-        cmd_list = ['python', temp.name] + nose_argv
-        debug('subprocess.call-ing {cmd_list}'.format(cmd_list=cmd_list))
+        script_plugins = [timings_plugin(options['--timings-db'])]
+        if options['--phase-timings']:
+            script_plugins.append(phase_timings_plugin(options['--phase-timings']))
+        temp = write_nose_script(config, plugins=script_plugins)
+        scripts.append(temp)
+        debug('Wrote the following to {}:'.format(temp.name))
+        with open(temp.name, 'r') as f:
+            debug('```\n{to_execute}```\n'.format(to_execute=f.read()))
 
         if options['--dry-run']:
-            print('Would run the following command:\n\t{}'.format(cmd_list))
+            cmd_list = ['python', temp.name] + nose_argv
+            print('Would run the following command{}:\n\t{}'.format(
+                ' sharded across {} workers'.format(workers) if workers > 1 else '', cmd_list))
             with open(temp.name, 'r') as f:
                 contents = f.read()
             print('{temp_name} contains:\n```\n{contents}```\n'.format(
                 temp_name=temp.name,
                 contents=contents
             ))
+
+    results = []
+    if not options['--dry-run']:
+        estimates = TimingsDatabase(options['--timings-db']).estimates() if workers > 1 else None
+        if workers > 1 or config_concurrency > 1:
+            share_cluster_templates()
+
+        def run(index):
+            config, temp = all_configs[index], scripts[index]
+            if config_concurrency == 1:
+                output('Running dtests with config object {}'.format(config))
+                return run_config(config, temp.name, nose_option_list, test_list, workers=workers,
+                                  estimates=estimates, memory_budget=memory_budget, debug=debug, output=output)
+            log_dir = os.path.join('logs', 'config{}'.format(index))
+            output('Running dtests with config object {} in {}'.format(config, log_dir))
+            config_results = run_config(config, temp.name, nose_option_list, test_list, workers=workers,
+                                        base_block=1 + index * workers, log_dir=log_dir, estimates=estimates,
+                                        memory_budget=memory_budget, debug=debug, output=output)
+            output('Finished dtests with config object {}'.format(config))
+            return config_results
+
+        if config_concurrency == 1:
+            for index in range(len(all_configs)):
+                results.extend(run(index))
+                # separate the end of the last subprocess.call output from the
+                # beginning of the next by printing a newline.
+                print()
         else:
-            results.append(subprocess.call(cmd_list))
-        # separate the end of the last subprocess.call output from the
-        # beginning of the next by printing a newline.
-        print()
+            pool = ThreadPool(config_concurrency)
+            try:
+                for config_results in pool.map(run, range(len(all_configs))):
+                    results.extend(config_results)
+            finally:
+                pool.close()
+            _, xunit_file = split_xunit_options(nose_option_list)
+            if xunit_file:
+                labels = ['config{}'.format(index) for index in range(len(all_configs))]
+                merge_xunit_reports([os.path.join('logs', label, 'nosetests.xml') for label in labels],
+                                    xunit_file, labels=labels)
+
+    for temp in scripts:
+        temp.close()
 
     # If this answer:
     # http://stackoverflow.com/a/21788998/3408454
@@ -20,6 +20,7 @@ from tools.misc import new_node
 
 
 class TestSecondaryIndexes(Tester):
+    hardcoded_addresses = True  # expected tracing names the nodes by address
 
     @staticmethod
     def _index_sstables_files(node, keyspace, table, index):
@@ -1165,6 +1166,7 @@ class TestUpgradeSecondaryIndexes(Tester):
 @skipIf(CASSANDRA_VERSION_FROM_BUILD == '3.9', "Test doesn't run on 3.9")
 @since('3.10')
 class TestPreJoinCallback(Tester):
+    hardcoded_addresses = True  # ignored log patterns name the nodes by address
 
     def __init__(self, *args, **kwargs):
         # Ignore these log patterns:
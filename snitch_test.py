@@ -14,6 +14,7 @@ from tools.jmxutils import (JolokiaAgent, make_mbean,
 
 @since('2.2.5')
 class TestGossipingPropertyFileSnitch(Tester):
+    hardcoded_addresses = True  # listen and broadcast addresses are fixed
 
     # Throws connection refused if cannot connect
     def _test_connect(self, address, port):
@@ -98,6 +99,8 @@ class TestGossipingPropertyFileSnitch(Tester):
 
 
 class TestDynamicEndpointSnitch(Tester):
+    hardcoded_addresses = True  # expected scores name a node by address
+
     @attr('resource-intensive')
     @since('3.10')
     def test_multidatacenter_local_quorum(self):
@@ -15,6 +15,7 @@ _LOG_ERR_CERT = "^javax.net.ssl.SSLHandshakeException: Received fatal alert: cer
 
 @since('3.6')
 class TestNodeToNodeSSLEncryption(Tester):
+    hardcoded_addresses = True  # certificates are generated for fixed addresses
 
     def ssl_enabled_test(self):
         """Should be able to start with valid ssl options"""
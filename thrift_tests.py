@@ -46,6 +46,7 @@ def pid():
 
 @since('2.0', max_version='4')
 class ThriftTester(ReusableClusterTester):
+    hardcoded_addresses = True  # get_thrift_client and expected rings use 127.0.0.1
     client = None
     extra_args = []
     cluster_options = {'partitioner': 'org.apache.cassandra.dht.ByteOrderedPartitioner',
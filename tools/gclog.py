@@ -0,0 +1,191 @@
+"""
+Parsing of node GC logs into pause and allocation statistics, so tests can
+catch GC pressure regressions and not only functional ones.
+
+Understands the HotSpot logs Cassandra writes on Java 8 (-XX:+PrintGCDetails
+with ParNew/CMS or G1, including multi-line events from
+-XX:+PrintTenuringDistribution) and Java 9+ unified logging.
+
+Example usage:
+
+    stats = node_gc_stats(node)
+    debug('p99 GC pause: {}s'.format(stats.pause_percentiles[99]))
+    assert_gc_stats(stats, max_pause=1, p99_pause=0.5)
+"""
+import glob
+import math
+import os
+import re
+from collections import OrderedDict, namedtuple
+
+GcPause = namedtuple('GcPause', ['uptime', 'kind', 'duration'])
+GcStats = namedtuple('GcStats', ['pause_count', 'pause_percentiles', 'max_pause', 'total_pause',
+                                 'total_stw', 'allocation_rate', 'elapsed'])
+
+PERCENTILES = (50, 90, 99, 99.9)
+UNITS = {'B': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+# Java 8: "2017-01-01T12:00:00.123+0000: 1.234: [GC (Allocation Failure) ..." or "[Full GC ...",
+# but not G1's "[GC concurrent-mark-end, 0.0123 secs]"
+EVENT_START = re.compile(r'(\d+\.\d+): \[(Full GC|GC(?! concurrent))')
+EVENT_DURATION = re.compile(r', (\d+\.\d+) secs\]')
+HEAP_TRANSITION = re.compile(r'(\d+(?:\.\d+)?)([BKMG])->(\d+(?:\.\d+)?)([BKMG])\(\d+(?:\.\d+)?[BKMG]\)')
+G1_HEAP_TRANSITION = re.compile(r'Heap: (\d+(?:\.\d+)?)([BKMG])\(\d+(?:\.\d+)?[BKMG]\)->(\d+(?:\.\d+)?)([BKMG])')
+# Java 9+: "[1.234s][info][gc] GC(3) Pause Young (Normal) (G1 Evacuation Pause) 24M->8M(256M) 3.456ms"
+UNIFIED_PAUSE = re.compile(r'\[(\d+\.\d+)s\].*GC\(\d+\) (Pause .*?) (\d+)([BKMG])->(\d+)([BKMG])\(\d+[BKMG]\) (\d+\.\d+)ms')
+# not part of the heap on Java 8, e.g. "[Metaspace: 20000K->20000K(1067008K)]"
+NON_HEAP = re.compile(r'\[(?:Metaspace|PSPermGen|CMS Perm ?|Perm ?): [^\]]*\]')
+STOPPED = re.compile(r'Total time for which application threads were stopped: (\d+\.\d+) seconds')
+
+
+def _bytes(amount, unit):
+    return float(amount) * UNITS[unit]
+
+
+def percentile(values, p):
+    """
+    The nearest-rank p-th percentile of values, or None if there are none.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, int(math.ceil(p / 100.0 * len(ordered))) - 1)]
+
+
+class GcLogParser(object):
+    """
+    Accumulates GC statistics from log lines fed to it one at a time, so
+    logs can be parsed as they are read.
+    """
+
+    def __init__(self):
+        self.pauses = []
+        self.total_stw = None
+        self.allocated = 0
+        # the uptimes of the first and last pause of the current JVM, and the time elapsed in earlier ones
+        self.first_uptime = None
+        self.last_uptime = None
+        self.earlier_elapsed = 0
+        self.last_heap_after = None
+        self._event = None
+
+    def _record(self, uptime, kind, duration, heap_before=None, heap_after=None):
+        self.pauses.append(GcPause(uptime, kind, duration))
+        if self.last_uptime is not None and uptime < self.last_uptime:
+            # the node restarted, and so did the JVM's uptime: its log goes on with the new JVM's
+            self.earlier_elapsed += self.last_uptime - self.first_uptime
+            self.first_uptime = None
+            self.last_heap_after = None
+        if self.first_uptime is None:
+            self.first_uptime = uptime
+        self.last_uptime = uptime
+        if heap_before is not None:
+            if self.last_heap_after is not None:
+                self.allocated += max(0, heap_before - self.last_heap_after)
+            self.last_heap_after = heap_after
+
+    def _finish_event(self):
+        event, self._event = self._event, None
+        if event is None or event['duration'] is None:
+            return
+        self._record(event['uptime'], event['kind'], event['duration'], event['heap_before'], event['heap_after'])
+
+    def feed(self, line):
+        stopped = STOPPED.search(line)
+        if stopped:
+            self.total_stw = (self.total_stw or 0) + float(stopped.group(1))
+            return
+
+        unified = UNIFIED_PAUSE.search(line)
+        if unified:
+            uptime, kind, before, before_unit, after, after_unit, millis = unified.groups()
+            self._record(float(uptime), kind, float(millis) / 1000,
+                         _bytes(before, before_unit), _bytes(after, after_unit))
+            return
+
+        start = EVENT_START.search(line)
+        if start:
+            self._finish_event()
+            self._event = {'uptime': float(start.group(1)), 'kind': start.group(2),
+                           'duration': None, 'heap_before': None, 'heap_after': None}
+        if self._event is None:
+            return
+
+        durations = EVENT_DURATION.findall(line)
+        if durations:
+            # the outermost event, e.g. the whole GC rather than its ParNew part, ends last
+            self._event['duration'] = float(durations[-1])
+        heap_line = NON_HEAP.sub('', line)
+        heaps = G1_HEAP_TRANSITION.findall(heap_line) or HEAP_TRANSITION.findall(heap_line)
+        if heaps:
+            before, before_unit, after, after_unit = heaps[-1]
+            self._event['heap_before'] = _bytes(before, before_unit)
+            self._event['heap_after'] = _bytes(after, after_unit)
+        if '[Times:' in line:
+            self._finish_event()
+
+    def stats(self):
+        """
+        The statistics so far, as a GcStats. Durations are in seconds and
+        the allocation rate in bytes per second. total_stw is the time
+        application threads were stopped for any safepoint, where the log
+        has it (-XX:+PrintGCApplicationStoppedTime), and the total GC pause
+        otherwise. elapsed sums the time between the first and last pause
+        of each JVM the log is of.
+        """
+        self._finish_event()
+        durations = [p.duration for p in self.pauses]
+        elapsed = self.earlier_elapsed + self.last_uptime - self.first_uptime if self.pauses else 0
+        return GcStats(pause_count=len(durations),
+                       pause_percentiles=OrderedDict((p, percentile(durations, p)) for p in PERCENTILES),
+                       max_pause=max(durations) if durations else None,
+                       total_pause=sum(durations),
+                       total_stw=self.total_stw if self.total_stw is not None else sum(durations),
+                       allocation_rate=self.allocated / elapsed if elapsed > 0 else None,
+                       elapsed=elapsed)
+
+
+def gc_log_files(node):
+    """
+    The node's GC log, with the files rotated out of it, oldest first.
+    """
+    return sorted(glob.glob(os.path.join(os.path.dirname(node.gclogfilename()), 'gc.log*')), key=os.path.getmtime)
+
+
+def gc_stats(filenames):
+    parser = GcLogParser()
+    for filename in filenames:
+        with open(filename) as f:
+            for line in f:
+                parser.feed(line)
+    return parser.stats()
+
+
+def node_gc_stats(node):
+    return gc_stats(gc_log_files(node))
+
+
+def cluster_gc_stats(cluster):
+    """
+    The GcStats of every node, by name.
+    """
+    return OrderedDict((node.name, node_gc_stats(node)) for node in cluster.nodelist())
+
+
+def assert_gc_stats(stats, max_pause=None, p99_pause=None, total_stw=None, allocation_rate=None):
+    """
+    Assert that GC statistics, from node_gc_stats, stay within the given
+    thresholds, in seconds and bytes per second.
+
+    Examples:
+    assert_gc_stats(node_gc_stats(node1), max_pause=1)
+    assert_gc_stats(node_gc_stats(node1), p99_pause=0.2, total_stw=10)
+    """
+    exceeded = []
+    for name, value, threshold in (('max pause', stats.max_pause, max_pause),
+                                   ('p99 pause', stats.pause_percentiles[99], p99_pause),
+                                   ('total STW time', stats.total_stw, total_stw),
+                                   ('allocation rate', stats.allocation_rate, allocation_rate)):
+        if threshold is not None and value is not None and value > threshold:
+            exceeded.append('{} {} exceeds {}'.format(name, value, threshold))
+    assert not exceeded, 'GC thresholds exceeded: {} ({})'.format(', '.join(exceeded), stats)
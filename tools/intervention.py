@@ -3,6 +3,7 @@ import time
 from threading import Thread
 
 from dtest import debug
+from tools.logbus import watch_log_for
 
 
 class InterruptBootstrap(Thread):
@@ -12,7 +13,7 @@ class InterruptBootstrap(Thread):
         self.node = node
 
     def run(self):
-        self.node.watch_log_for("Prepare completed")
+        watch_log_for(self.node, "Prepare completed")
         self.node.stop(gently=False)
 
 
@@ -35,7 +36,7 @@ class InterruptCompaction(Thread):
         self.mark = node.mark_log(filename=self.filename)
 
     def run(self):
-        self.node.watch_log_for("Compacting(.*)%s" % (self.tablename,), from_mark=self.mark, filename=self.filename)
+        watch_log_for(self.node, "Compacting(.*)%s" % (self.tablename,), from_mark=self.mark, filename=self.filename)
         if self.delay > 0:
             random_delay = random.uniform(0, self.delay)
             debug("Sleeping for {} seconds".format(random_delay))
@@ -51,5 +52,5 @@ class KillOnBootstrap(Thread):
         self.node = node
 
     def run(self):
-        self.node.watch_log_for("JOINING: Starting to bootstrap")
+        watch_log_for(self.node, "JOINING: Starting to bootstrap")
         self.node.stop(gently=False)
@@ -0,0 +1,136 @@
+"""
+Java Flight Recorder support: recording every node from JVM start, dumping
+the recordings and summarizing them into the methods hottest on CPU and the
+sites allocating most, as text that can be diffed between Cassandra SHAs.
+
+Summaries need the `jfr` tool of JDK 11+, looked up in $JAVA_HOME/bin and
+then on the PATH. Recordings can be made and dumped on Java 8 too.
+"""
+import json
+import os
+import subprocess
+from collections import Counter, namedtuple
+
+from ccmlib.common import get_jdk_version
+
+from dtest import debug
+
+RECORDING_NAME = 'dtest'
+ALLOCATION_EVENTS = ('jdk.ObjectAllocationInNewTLAB', 'jdk.ObjectAllocationOutsideTLAB', 'jdk.ObjectAllocationSample')
+
+_JDK_VERSION = None
+
+JfrSummary = namedtuple('JfrSummary', ['cpu_samples', 'hot_methods', 'allocated', 'allocation_sites'])
+
+
+def jfr_jvm_options(jdk_version=None):
+    """
+    The JVM options starting a recording, named RECORDING_NAME, with the
+    JDK's profiling settings as soon as the JVM starts.
+    """
+    global _JDK_VERSION
+    if jdk_version is None:
+        if _JDK_VERSION is None:
+            _JDK_VERSION = get_jdk_version()
+        jdk_version = _JDK_VERSION
+    options = ['-XX:StartFlightRecording=name={},settings=profile'.format(RECORDING_NAME)]
+    if jdk_version.startswith('1.'):
+        # flight recording is a commercial feature of Oracle's Java 8
+        options = ['-XX:+UnlockCommercialFeatures', '-XX:+FlightRecorder'] + options
+    return options
+
+
+def dump_recording(node, filename):
+    """
+    Dumps the node's recording to filename. Returns False if that failed,
+    e.g. because the node wasn't started with jfr_jvm_options.
+    """
+    try:
+        p = subprocess.Popen(['jcmd', str(node.pid), 'JFR.dump', 'name={}'.format(RECORDING_NAME),
+                              'filename={}'.format(os.path.abspath(filename))],
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError as e:
+        debug('Could not run jcmd: {}'.format(e))
+        return False
+    stdout, _ = p.communicate()
+    debug(stdout)
+    return p.returncode == 0 and os.path.exists(filename)
+
+
+def jfr_tool():
+    if 'JAVA_HOME' in os.environ:
+        tool = os.path.join(os.environ['JAVA_HOME'], 'bin', 'jfr')
+        if os.path.exists(tool):
+            return tool
+    return 'jfr'
+
+
+def _top_frame(event):
+    frames = (event['values'].get('stackTrace') or {}).get('frames') or []
+    if not frames:
+        return '<unknown>'
+    method = frames[0]['method']
+    return '{}.{}'.format(method['type']['name'], method['name'])
+
+
+def summarize_events(events, top=20):
+    """
+    Summarizes recording events, as printed by `jfr print --json`, into a
+    JfrSummary of the `top` methods by CPU samples and of the `top`
+    allocating methods and allocated classes by bytes.
+    """
+    hot, allocations = Counter(), Counter()
+    for event in events:
+        if event['type'] == 'jdk.ExecutionSample':
+            hot[_top_frame(event)] += 1
+        elif event['type'] in ALLOCATION_EVENTS:
+            values = event['values']
+            weight = values.get('weight') or values.get('tlabSize') or values.get('allocationSize') or 0
+            site = '{} ({})'.format(_top_frame(event), (values.get('objectClass') or {}).get('name', '?'))
+            allocations[site] += weight
+    return JfrSummary(sum(hot.values()), hot.most_common(top), sum(allocations.values()), allocations.most_common(top))
+
+
+def summarize_recording(filename, top=20):
+    """
+    Summarizes a recording into a JfrSummary with the `jfr` tool, or
+    returns None if the tool is missing or failed.
+    """
+    args = [jfr_tool(), 'print', '--json', '--stack-depth', '1',
+            '--events', ','.join(('jdk.ExecutionSample',) + ALLOCATION_EVENTS), filename]
+    try:
+        output = subprocess.check_output(args, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError) as e:
+        debug('Could not summarize {}: {}'.format(filename, e))
+        return None
+    return summarize_events(json.loads(output)['recording']['events'], top)
+
+
+def format_summary(summary):
+    lines = ['Top CPU methods, of {} samples:'.format(summary.cpu_samples)]
+    for method, samples in summary.hot_methods:
+        lines.append('{:6.2f}% {:>8} {}'.format(100.0 * samples / max(1, summary.cpu_samples), samples, method))
+    lines.append('')
+    lines.append('Top allocation sites, of {:.1f} MB:'.format(summary.allocated / 1024.0 ** 2))
+    for site, allocated in summary.allocation_sites:
+        share = 100.0 * allocated / max(1, summary.allocated)
+        lines.append('{:6.2f}% {:>8.1f} MB {}'.format(share, allocated / 1024.0 ** 2, site))
+    return '\n'.join(lines) + '\n'
+
+
+def save_recordings(cluster, directory):
+    """
+    Dumps the recording of every running node of the cluster into
+    directory, as <node>.jfr, next to a <node>_jfr_summary.txt where the
+    jfr tool is available.
+    """
+    for node in cluster.nodelist():
+        if not node.is_running():
+            continue
+        filename = os.path.join(directory, node.name + '.jfr')
+        if not dump_recording(node, filename):
+            continue
+        summary = summarize_recording(filename)
+        if summary is not None:
+            with open(os.path.join(directory, node.name + '_jfr_summary.txt'), 'w') as f:
+                f.write(format_summary(summary))
@@ -0,0 +1,286 @@
+"""
+In-process equivalents of the nodetool commands tests run most, talking to
+a Jolokia agent that stays attached to the node for its lifetime instead of
+starting a nodetool JVM per command, and returning Python objects instead of
+text to parse.
+
+Unless nodes are started with the agent loaded (JOLOKIA_AT_START=yes), the
+agent attaches to the node's JVM, so like any JolokiaAgent use it needs
+remove_perf_disable_shared_mem(node) before the node is started.
+
+Example usage:
+
+    nodetool = jmx_nodetool(node)
+    nodetool.flush('ks', 'cf')
+    while any(pool.active or pool.pending for pool in nodetool.tpstats().thread_pools.values()):
+        time.sleep(0.1)
+"""
+import errno
+import os
+import socket
+from collections import OrderedDict, namedtuple
+from urllib2 import URLError
+
+from distutils.version import LooseVersion
+from tools.jmxutils import JolokiaAgent, make_mbean, mbean_properties
+
+ThreadPoolStats = namedtuple('ThreadPoolStats', ['active', 'pending', 'completed', 'blocked', 'all_time_blocked'])
+TpStats = namedtuple('TpStats', ['thread_pools', 'dropped_messages'])
+CompactionStats = namedtuple('CompactionStats', ['pending_tasks', 'active'])
+NodeStatus = namedtuple('NodeStatus', ['address', 'datacenter', 'rack', 'status', 'state', 'load', 'tokens', 'owns'])
+NetStats = namedtuple('NetStats', ['mode', 'streams', 'pending_commands', 'completed_commands',
+                                   'pending_responses', 'completed_responses'])
+
+STORAGE_SERVICE = make_mbean('db', 'StorageService')
+
+
+def _address(inet_address):
+    """
+    JMX renders InetAddresses as 'hostname/127.0.0.1' or '/127.0.0.1'.
+    """
+    return inet_address.rsplit('/', 1)[-1]
+
+
+def _agent_not_running(error):
+    """
+    Whether a URLError is the agent refusing the connection, in which case
+    the request was never sent.
+    """
+    return isinstance(error.reason, socket.error) and error.reason.errno == errno.ECONNREFUSED
+
+
+def _token_key(token):
+    try:
+        return (0, int(token))
+    except ValueError:
+        return (1, token)
+
+
+class JmxNodetool(object):
+    """
+    The nodetool commands, for one node. The Jolokia agent is started on
+    first use and again whenever the node was restarted.
+    """
+
+    def __init__(self, node):
+        self.node = node
+        self.jmx = JolokiaAgent(node)
+        self.agent_pid = None
+
+    def _agent(self):
+        if self.agent_pid != self.node.pid:
+            self.jmx.start()
+            self.agent_pid = self.node.pid
+        return self.jmx
+
+    def _call(self, method, *args):
+        try:
+            return getattr(self._agent(), method)(*args)
+        except URLError as e:
+            if not _agent_not_running(e):
+                # a timeout, or a failure once the request was sent: executing it again could run it twice
+                raise
+            # someone else stopped the agent, e.g. a `with JolokiaAgent(node)` block
+            self.agent_pid = None
+            return getattr(self._agent(), method)(*args)
+
+    def _read(self, mbean, attribute):
+        return self._call('read_attribute', mbean, attribute)
+
+    def _exec(self, mbean, operation, *arguments):
+        return self._call('execute_method', mbean, operation, list(arguments))
+
+    def _read_all(self, attributes):
+        return self._call('read_attributes', attributes)
+
+    def _read_patterns(self, patterns):
+        """
+        Reads (pattern, attribute) pairs in one round trip. Returns, for
+        each, a dict from the key properties of the matching mbeans, as
+        frozensets of pairs, to the value of attribute.
+        """
+        return [{frozenset(mbean_properties(name).items()): values[attribute]
+                 for name, values in matches.items()}
+                for (_, attribute), matches in zip(patterns, self._read_all(patterns))]
+
+    def read(self, attributes):
+        """
+        Reads any attributes, for what nodetool has no command for, in one
+        round trip. See JolokiaAgent.read_attributes.
+        """
+        return self._read_all(attributes)
+
+    def execute(self, mbean, operation, *arguments):
+        """
+        Executes any operation, for what nodetool has no command for.
+        """
+        return self._exec(mbean, operation, *arguments)
+
+    def keyspaces(self):
+        return self._read(STORAGE_SERVICE, 'Keyspaces')
+
+    def flush(self, keyspace=None, *tables):
+        """
+        Like `nodetool flush [keyspace [tables...]]`.
+        """
+        for ks in [keyspace] if keyspace else self.keyspaces():
+            self._exec(STORAGE_SERVICE, 'forceKeyspaceFlush(java.lang.String,[Ljava.lang.String;)', ks, list(tables))
+
+    def compact(self, keyspace=None, *tables, **kwargs):
+        """
+        Like `nodetool compact [-s] [keyspace [tables...]]`, split_output
+        being -s.
+        """
+        split_output = kwargs.pop('split_output', False)
+        for ks in [keyspace] if keyspace else self.keyspaces():
+            if self.node.get_cassandra_version() >= LooseVersion('2.2'):
+                self._exec(STORAGE_SERVICE, 'forceKeyspaceCompaction(boolean,java.lang.String,[Ljava.lang.String;)',
+                           split_output, ks, list(tables))
+            else:
+                self._exec(STORAGE_SERVICE, 'forceKeyspaceCompaction(java.lang.String,[Ljava.lang.String;)',
+                           ks, list(tables))
+
+    def tpstats(self):
+        """
+        Like `nodetool tpstats`. Returns a TpStats with the ThreadPoolStats
+        of each pool by name, and the number of dropped messages by verb.
+        """
+        patterns = [('org.apache.cassandra.metrics:type=ThreadPools,path=*,scope=*,name={}'.format(name), attribute)
+                    for name, attribute in (('ActiveTasks', 'Value'), ('PendingTasks', 'Value'),
+                                            ('CompletedTasks', 'Value'), ('CurrentlyBlockedTasks', 'Count'),
+                                            ('TotalBlockedTasks', 'Count'))]
+        patterns.append(('org.apache.cassandra.metrics:type=DroppedMessage,scope=*,name=Dropped', 'Count'))
+        by_scope = [{dict(props)['scope']: value for props, value in values.items()}
+                    for values in self._read_patterns(patterns)]
+        active, pending, completed, blocked, all_time_blocked, dropped = by_scope
+
+        thread_pools = OrderedDict(
+            (pool, ThreadPoolStats(active[pool], pending.get(pool, 0), completed.get(pool, 0),
+                                   blocked.get(pool, 0), all_time_blocked.get(pool, 0)))
+            for pool in sorted(active))
+        return TpStats(thread_pools, OrderedDict(sorted(dropped.items())))
+
+    def compactionstats(self):
+        """
+        Like `nodetool compactionstats`. Returns a CompactionStats with the
+        number of pending tasks and a list of dicts describing the running
+        compactions, with keys such as 'keyspace', 'columnfamily',
+        'taskType', 'completed' and 'total'.
+        """
+        return CompactionStats(*self._read_all([(make_mbean('metrics', 'Compaction', name='PendingTasks'), 'Value'),
+                                                (make_mbean('db', 'CompactionManager'), 'Compactions')]))
+
+    def ring(self):
+        """
+        Like `nodetool ring`. Returns (token, address) pairs in token order.
+        """
+        token_map = self._read(STORAGE_SERVICE, 'TokenToEndpointMap')
+        return [(token, _address(endpoint)) for token, endpoint in sorted(token_map.items(), key=lambda t: _token_key(t[0]))]
+
+    def status(self, keyspace=None):
+        """
+        Like `nodetool status [keyspace]`. Returns a NodeStatus per node,
+        ordered by address, with status 'U' or 'D', state 'N', 'J', 'L' or
+        'M', and ownership as a fraction: effective ownership if a keyspace
+        is given.
+        """
+        requests = [{'type': 'read', 'mbean': STORAGE_SERVICE, 'attribute': attribute}
+                    for attribute in ('LiveNodes', 'JoiningNodes', 'LeavingNodes', 'MovingNodes', 'LoadMap',
+                                      'TokenToEndpointMap')]
+        if keyspace:
+            requests.append({'type': 'exec', 'mbean': STORAGE_SERVICE, 'operation': 'effectiveOwnership',
+                             'arguments': [keyspace]})
+        else:
+            requests.append({'type': 'read', 'mbean': STORAGE_SERVICE, 'attribute': 'Ownership'})
+        live, joining, leaving, moving, loads, token_map, ownership = self._call('execute_batch', requests)
+        live, joining, leaving, moving = [set(map(_address, nodes)) for nodes in (live, joining, leaving, moving)]
+        loads = {_address(endpoint): load for endpoint, load in loads.items()}
+        ownership = {_address(endpoint): owns for endpoint, owns in ownership.items()}
+
+        tokens = OrderedDict()
+        for token, endpoint in sorted(token_map.items(), key=lambda t: _token_key(t[0])):
+            tokens.setdefault(_address(endpoint), []).append(token)
+        for address in joining:
+            tokens.setdefault(address, [])
+
+        addresses = sorted(tokens)
+        snitch = make_mbean('db', 'EndpointSnitchInfo')
+        locations = self._call('execute_batch', [{'type': 'exec', 'mbean': snitch, 'operation': operation,
+                                                  'arguments': [address]}
+                                                 for address in addresses for operation in ('getDatacenter', 'getRack')])
+        statuses = []
+        for i, address in enumerate(addresses):
+            if address in joining:
+                state = 'J'
+            elif address in leaving:
+                state = 'L'
+            elif address in moving:
+                state = 'M'
+            else:
+                state = 'N'
+            statuses.append(NodeStatus(address=address,
+                                       datacenter=locations[2 * i],
+                                       rack=locations[2 * i + 1],
+                                       status='U' if address in live else 'D',
+                                       state=state,
+                                       load=loads.get(address),
+                                       tokens=tokens[address],
+                                       owns=ownership.get(address)))
+        return statuses
+
+    def replaybatchlog(self):
+        """
+        Like `nodetool replaybatchlog`.
+        """
+        self._exec(make_mbean('db', 'BatchlogManager'), 'forceBatchlogReplay')
+
+    def netstats(self):
+        """
+        Like `nodetool netstats`. Returns a NetStats with the node's
+        operation mode, the raw state of its current streams, and its
+        messaging task counts summed over all peers.
+        """
+        messaging = make_mbean('net', 'MessagingService')
+        values = self._read_all([(STORAGE_SERVICE, 'OperationMode'),
+                                 (make_mbean('net', 'StreamManager'), 'CurrentStreams')] +
+                                [(messaging, attribute) for attribute in ('CommandPendingTasks', 'CommandCompletedTasks',
+                                                                          'ResponsePendingTasks', 'ResponseCompletedTasks')])
+        mode, streams = values[:2]
+        return NetStats(mode, streams, *[sum(by_peer.values()) for by_peer in values[2:]])
+
+    def getendpoints(self, keyspace, table, key):
+        """
+        Like `nodetool getendpoints`. Returns the addresses of the replicas
+        of key.
+        """
+        endpoints = self._exec(STORAGE_SERVICE, 'getNaturalEndpoints(java.lang.String,java.lang.String,java.lang.String)',
+                               keyspace, table, str(key))
+        return [_address(endpoint) for endpoint in endpoints]
+
+    def settraceprobability(self, probability):
+        """
+        Like `nodetool settraceprobability`.
+        """
+        self._exec(STORAGE_SERVICE, 'setTraceProbability', float(probability))
+
+
+_NODETOOLS = {}
+
+
+def jmx_nodetool(node):
+    """
+    The JmxNodetool shared by everyone using the node.
+    """
+    if node.get_path() not in _NODETOOLS:
+        _NODETOOLS[node.get_path()] = JmxNodetool(node)
+    return _NODETOOLS[node.get_path()]
+
+
+def forget_jmx_nodetools(path):
+    """
+    Forgets the JmxNodetool's of the nodes under path, the directory of a
+    node or cluster being cleaned up.
+    """
+    prefix = os.path.join(path, '')
+    for node_path in [node_path for node_path in _NODETOOLS if os.path.join(node_path, '').startswith(prefix)]:
+        del _NODETOOLS[node_path]
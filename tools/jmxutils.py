@@ -1,16 +1,26 @@
+import httplib
 import json
 import os
+import re
+import select
+import socket
 import subprocess
-from urllib2 import urlopen
+import threading
+from urllib2 import URLError
 
 import ccmlib.common as common
+import yaml
 
-from dtest import warning
+from dtest import JOLOKIA_AT_START, warning
 from distutils.version import LooseVersion
 
 JOLOKIA_JAR = os.path.join('lib', 'jolokia-jvm-1.2.3-agent.jar')
 CLASSPATH_SEP = ';' if common.is_win() else ':'
 JVM_OPTIONS = "jvm.options"
+JOLOKIA_PORT = 8778
+# Nodes started with the agent loaded listen on their JMX port plus this
+# offset, which is unique per node and address block, on their own address.
+JOLOKIA_PORT_OFFSET = 10000
 
 
 def jolokia_classpath():
@@ -54,6 +64,16 @@ def make_mbean(package, type, **kwargs):
     return rv
 
 
+def mbean_properties(name):
+    """
+    The key properties of an mbean name or pattern, as a dict.
+
+    >>> mbean_properties('org.apache.cassandra.metrics:type=ThreadPools,path=*,scope=*,name=PendingTasks')
+    {'path': '*', 'scope': '*', 'type': 'ThreadPools', 'name': 'PendingTasks'}
+    """
+    return dict(prop.split('=', 1) for prop in name.split(':', 1)[1].split(',') if '=' in prop)
+
+
 def enable_jmx_ssl(node,
                    require_client_auth=False,
                    disable_user_auth=True,
@@ -152,12 +172,62 @@ def apply_jmx_authentication(node):
     common.replaces_in_file(node.envfilename(), replacement_list)
 
 
+def jolokia_javaagent_option(node):
+    """
+    The JVM option loading the Jolokia agent into the node at startup, see
+    dtest.node_jvm_options.
+    """
+    return '-javaagent:{jar}=host={host},port={port}'.format(
+        jar=os.path.abspath(JOLOKIA_JAR), host=node.network_interfaces['binary'][0],
+        port=int(node.jmx_port) + JOLOKIA_PORT_OFFSET)
+
+
+def javaagent_jolokia_port(node):
+    """
+    The port of the Jolokia agent the node's running JVM was started with,
+    or None if it wasn't or we can't tell. Where there is no /proc to read
+    the JVM's command line from, e.g. on macOS, that is the agent of the JVM
+    options saved with the node, see dtest.use_node_jvm_options.
+    """
+    if os.path.isdir('/proc'):
+        try:
+            with open('/proc/{}/cmdline'.format(node.pid)) as f:
+                args = f.read().split('\0')
+        except IOError:
+            return None
+    else:
+        args = _saved_jvm_options(node)
+    for arg in args:
+        match = re.match(r'-javaagent:.*jolokia.*port=(\d+)', arg)
+        if match:
+            return int(match.group(1))
+    return None
+
+
+def _saved_jvm_options(node):
+    """
+    The JVM_EXTRA_OPTS the node starts with, as saved in its node.conf.
+    """
+    try:
+        with open(os.path.join(node.get_path(), 'node.conf')) as f:
+            environment = (yaml.safe_load(f) or {}).get('environment_variables') or {}
+    except IOError:
+        return []
+    return environment.get('JVM_EXTRA_OPTS', '').split()
+
+
 def remove_perf_disable_shared_mem(node):
     """
     The Jolokia agent is incompatible with the -XX:+PerfDisableSharedMem JVM
     option (see https://github.com/rhuss/jolokia/issues/198 for details).  This
     edits cassandra-env.sh (or the Windows equivalent), or jvm.options file on 3.2+ to remove that option.
+
+    Only attaching the agent to a running JVM is affected, so nothing needs
+    to be done when nodes are started with the agent loaded.
     """
+    if JOLOKIA_AT_START:
+        return
+
     if node.cluster.version() >= LooseVersion('3.2'):
         conf_file = os.path.join(node.get_conf_dir(), JVM_OPTIONS)
         pattern = '\-XX:\+PerfDisableSharedMem'
@@ -175,6 +245,10 @@ class JolokiaAgent(object):
     This class provides a simple way to read, write, and execute
     JMX attributes and methods through a Jolokia agent.
 
+    If the node was started with the agent loaded (JOLOKIA_AT_START=yes),
+    start() and stop() cost nothing; otherwise they attach the agent to the
+    running node and detach it.
+
     Example usage:
 
         node = cluster.nodelist()[0]
@@ -186,15 +260,28 @@ class JolokiaAgent(object):
     """
 
     node = None
+    # seconds to wait for the agent to answer reads and writes
+    timeout = 10.0
+    # exec requests run operations such as flush, compaction or drain to completion
+    exec_timeout = 600.0
 
     def __init__(self, node):
         self.node = node
+        self.port = JOLOKIA_PORT
+        self.attached = False
+        self._connection = None
+        self._connection_lock = threading.Lock()
 
     def start(self):
         """
         Starts the Jolokia agent.  The process will fork from the parent
         and continue running until stop() is called.
         """
+        port = javaagent_jolokia_port(self.node)
+        if port is not None:
+            self.port = port
+            return
+
         args = (java_bin(),
                 '-cp', jolokia_classpath(),
                 'org.jolokia.jvmagent.client.AgentLauncher',
@@ -208,15 +295,23 @@ class JolokiaAgent(object):
             print "Exit status was: %d" % (exc.returncode,)
             print "Output was: %s" % (exc.output,)
             raise
+        self.port = JOLOKIA_PORT
+        self.attached = True
 
     def stop(self):
         """
         Stops the Jolokia agent.
         """
+        with self._connection_lock:
+            self._close_connection()
+        if not self.attached:
+            return
+
         args = (java_bin(),
                 '-cp', jolokia_classpath(),
                 'org.jolokia.jvmagent.client.AgentLauncher',
                 'stop', str(self.node.pid))
+        self.attached = False
         try:
             subprocess.check_output(args, stderr=subprocess.STDOUT)
         except subprocess.CalledProcessError as exc:
@@ -225,15 +320,66 @@ class JolokiaAgent(object):
             print "Output was: %s" % (exc.output,)
             raise
 
-    def _query(self, body, verbose=True):
-        request_data = json.dumps(body)
-        url = 'http://%s:8778/jolokia/' % (self.node.network_interfaces['binary'][0],)
-        response = urlopen(url, data=request_data, timeout=10.0)
-        if response.code != 200:
-            raise Exception("Failed to query Jolokia agent; HTTP response code: %d; response: %s" % (response.code, response.readlines()))
+    def _connect(self):
+        return httplib.HTTPConnection(self.node.network_interfaces['binary'][0], self.port, timeout=self.timeout)
 
-        raw_response = response.readline()
-        response = json.loads(raw_response)
+    def _is_stale(self):
+        """
+        Whether the agent closed the kept-alive connection while it was
+        idle, which makes it readable, at EOF.
+        """
+        sock = self._connection.sock
+        if sock is None:
+            return False
+        try:
+            return bool(select.select([sock], [], [], 0)[0])
+        except (select.error, socket.error, ValueError):
+            return True
+
+    def _close_connection(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _post(self, request_data, timeout):
+        """
+        POSTs to the agent over a kept-alive connection, returning the HTTP
+        response code and body, waiting up to `timeout` seconds for it.
+
+        The request is only sent again, over a new connection, if sending
+        it over a reused one failed, as when the agent closed it unnoticed.
+        Once the agent may have received it, failures, timeouts included,
+        are raised, as operations must not be executed twice.
+        """
+        with self._connection_lock:
+            if self._connection is not None and self._is_stale():
+                self._close_connection()
+            while True:
+                reused = self._connection is not None
+                if not reused:
+                    self._connection = self._connect()
+                try:
+                    if self._connection.sock is None:
+                        self._connection.connect()
+                    self._connection.sock.settimeout(timeout)
+                    self._connection.request('POST', '/jolokia/', request_data, {'Content-Type': 'application/json'})
+                except socket.timeout as exc:
+                    self._close_connection()
+                    raise URLError(exc)
+                except (httplib.HTTPException, socket.error) as exc:
+                    self._close_connection()
+                    if not reused:
+                        # what urlopen, used here before, raised
+                        raise URLError(exc)
+                    continue
+                try:
+                    response = self._connection.getresponse()
+                    return response.status, response.read()
+                except (httplib.HTTPException, socket.error) as exc:
+                    self._close_connection()
+                    raise URLError(exc)
+
+    def _check_response(self, response, verbose=True):
         if response['status'] != 200:
             stacktrace = response.get('stacktrace')
             if stacktrace and verbose:
@@ -243,6 +389,22 @@ class JolokiaAgent(object):
             raise Exception("Jolokia agent returned non-200 status: %s" % (response,))
         return response
 
+    def _query(self, body, verbose=True):
+        """
+        Sends a request, or a list of requests, to the agent in a single
+        round trip, returning the response or the list of responses.
+        """
+        requests = body if isinstance(body, list) else [body]
+        timeout = self.exec_timeout if any(request['type'] == 'exec' for request in requests) else self.timeout
+        code, raw_response = self._post(json.dumps(body), timeout)
+        if code != 200:
+            raise Exception("Failed to query Jolokia agent; HTTP response code: %d; response: %s" % (code, raw_response))
+
+        response = json.loads(raw_response)
+        if isinstance(body, list):
+            return [self._check_response(r, verbose=verbose) for r in response]
+        return self._check_response(response, verbose=verbose)
+
     def read_attribute(self, mbean, attribute, path=None, verbose=True):
         """
         Reads a single JMX attribute.
@@ -309,6 +471,48 @@ class JolokiaAgent(object):
         response = self._query(body)
         return response['value']
 
+    def read_attributes(self, attributes, verbose=True):
+        """
+        Reads any number of JMX attributes in a single round trip to the
+        agent, returning their values in the same order.
+
+        `attributes` is a list of (mbean, attribute) or (mbean, attribute,
+        path) tuples, as for read_attribute(). `mbean` may be a pattern like
+        'org.apache.cassandra.metrics:type=Table,keyspace=ks,*', in which case
+        the value is a dict from the names of the matching mbeans to dicts of
+        their attributes; `attribute` may then be None to read all of them.
+
+        Example usage:
+
+            sizes = jmx.read_attributes([(make_mbean('metrics', type='Table', keyspace='ks', scope=table,
+                                                     name='LiveDiskSpaceUsed'), 'Count')
+                                         for table in tables])
+        """
+        requests = []
+        for attribute in attributes:
+            mbean, attribute, path = (tuple(attribute) + (None,))[:3]
+            request = {'type': 'read', 'mbean': mbean}
+            if attribute is not None:
+                request['attribute'] = attribute
+            if path:
+                request['path'] = path
+            requests.append(request)
+        return self.execute_batch(requests, verbose=verbose)
+
+    def execute_batch(self, requests, verbose=True):
+        """
+        Sends any number of requests to the agent in a single round trip,
+        returning the value of each in the same order. Raises if any of them
+        failed.
+
+        `requests` are dicts in Jolokia's JSON request format, e.g.
+        {'type': 'read', 'mbean': mbean, 'attribute': attribute} or
+        {'type': 'exec', 'mbean': mbean, 'operation': operation, 'arguments': []}.
+        """
+        if not requests:
+            return []
+        return [response['value'] for response in self._query(list(requests), verbose=verbose)]
+
     def __enter__(self):
         """ For contextmanager-style usage. """
         self.start()
@@ -0,0 +1,238 @@
+"""
+A shared tailer per node log, so that any number of threads waiting for
+lines to show up in the same log cost a single read of it instead of one
+each, as with node.watch_log_for.
+"""
+import os
+import re
+import threading
+import time
+
+from ccmlib.node import TimeoutError
+from six import string_types
+
+from tools.logscan import combine_patterns
+
+
+class LogSubscription(object):
+    """
+    A wait for lines matching each of a set of regular expressions, with the
+    semantics of node.watch_log_for: the result is a list of (line, match)
+    pairs, or a single pair if exprs is a single expression.
+
+    Behaves like a future: wait() blocks until every expression matched,
+    and the callback, if any, is called with the result from the tailer's
+    thread, so it should be quick.
+
+    With `alive`, a function telling whether whatever writes the log, e.g.
+    the node, still runs, wait() fails as soon as it stopped without logging
+    the missing lines, as node.watch_log_for does with a process.
+    """
+
+    def __init__(self, bus, exprs, start=0, callback=None, alive=None):
+        self.bus = bus
+        self.single = isinstance(exprs, string_types)
+        self.pending = [re.compile(e) for e in ([exprs] if self.single else exprs)]
+        self.patterns = tuple(e.pattern for e in self.pending)
+        self.start = start
+        self.callback = callback
+        self.alive = alive
+        self.matchings = []
+        self.error = None
+        self.done = threading.Event()
+
+    def feed(self, line):
+        """
+        Match a line against the expressions not found yet. Returns True
+        once all were found.
+        """
+        for e in list(self.pending):
+            m = e.search(line)
+            if m:
+                self.matchings.append((line, m))
+                self.pending.remove(e)
+        return not self.pending
+
+    def complete(self):
+        self.done.set()
+        if self.callback is not None:
+            self.callback(self.result())
+
+    def fail(self, reason):
+        self.error = RuntimeError(time.strftime("%d %b %Y %H:%M:%S", time.gmtime()) +
+                                  " [{}] {}, missing: {}\nSee {} for the log".format(
+                                      self.bus.name, reason, [e.pattern for e in self.pending], self.bus.path))
+        self.done.set()
+
+    def result(self):
+        return self.matchings[0] if self.single else self.matchings
+
+    def wait(self, timeout=600):
+        if not self.done.wait(timeout):
+            self.cancel()
+            raise TimeoutError(time.strftime("%d %b %Y %H:%M:%S", time.gmtime()) +
+                               " [{}] Missing: {}\nSee {} for the log".format(
+                                   self.bus.name, [e.pattern for e in self.pending], self.bus.path))
+        if self.error is not None:
+            raise self.error
+        return self.result()
+
+    def cancel(self):
+        self.bus.unsubscribe(self)
+
+
+class LogBus(object):
+    """
+    Tails one log file in a thread for as long as anyone is subscribed,
+    reading each line once and handing it to the subscriptions whose
+    expressions may match, found with a single alternation of all of them.
+
+    Subscriptions can start from a mark, as returned by node.mark_log(),
+    including one behind what the tailer has read already; that part of the
+    log is read once more for the new subscription only.
+    """
+
+    def __init__(self, path, name=None, poll_interval=0.1):
+        self.path = path
+        self.name = name or path
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.subscriptions = []
+        self.inode = None
+        self.offset = None
+        self.thread = None
+
+    def _read_lines(self, start, end=None):
+        """
+        Returns (offset, line) pairs of the complete lines in [start, end),
+        or from start to the end of the file, and the offset after them.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(start)
+                data = f.read() if end is None else f.read(max(0, end - start))
+        except IOError:
+            return [], start
+        lines, position = [], start
+        # the last piece is a partially written line, or empty
+        for line in data.split('\n')[:-1]:
+            lines.append((position, line + '\n'))
+            position += len(line) + 1
+        return lines, position
+
+    def _check_rotation(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            # a new log: everyone starts over at its beginning
+            self.inode, self.offset = stat.st_ino, 0
+            for subscription in self.subscriptions:
+                subscription.start = 0
+
+    def subscribe(self, exprs, from_mark=None, callback=None, alive=None):
+        """
+        Wait for lines matching exprs from from_mark on, or from the start
+        of the log. Returns a LogSubscription.
+        """
+        subscription = LogSubscription(self, exprs, start=from_mark or 0, callback=callback, alive=alive)
+        with self.lock:
+            if self.offset is None:
+                self.offset = 0
+                self._check_rotation()
+                lines, self.offset = self._read_lines(subscription.start)
+            else:
+                lines, _ = self._read_lines(subscription.start, self.offset)
+            finished = not subscription.pending or any(subscription.feed(line) for _, line in lines)
+            if not finished:
+                self.subscriptions.append(subscription)
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._tail, name='LogBus {}'.format(self.name))
+                    self.thread.daemon = True
+                    self.thread.start()
+        if finished:
+            subscription.complete()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+    def stop(self):
+        """
+        Fails every subscription, which ends the tailer.
+        """
+        with self.lock:
+            subscriptions, self.subscriptions = self.subscriptions, []
+        for subscription in subscriptions:
+            subscription.fail('stopped watching the log')
+
+    def _tail(self):
+        while True:
+            finished = []
+            with self.lock:
+                if not self.subscriptions:
+                    self.thread = None
+                    return
+                # checked before reading, so whatever was logged before stopping is read first
+                stopped = [s for s in self.subscriptions if s.alive is not None and not s.alive()]
+                self._check_rotation()
+                lines, self.offset = self._read_lines(self.offset)
+                combined = combine_patterns(p for s in self.subscriptions for p in s.patterns)
+                for position, line in lines:
+                    if not combined.search(line):
+                        continue
+                    for subscription in list(self.subscriptions):
+                        if position >= subscription.start and subscription.feed(line):
+                            self.subscriptions.remove(subscription)
+                            finished.append(subscription)
+                stopped = [s for s in stopped if s in self.subscriptions]
+                for subscription in stopped:
+                    self.subscriptions.remove(subscription)
+            for subscription in finished:
+                subscription.complete()
+            for subscription in stopped:
+                subscription.fail('stopped running')
+            if not lines:
+                time.sleep(self.poll_interval)
+
+
+_BUSES = {}
+_BUSES_LOCK = threading.Lock()
+
+
+def log_bus(node, filename='system.log'):
+    """
+    The LogBus shared by everyone watching the given log of node.
+    """
+    path = os.path.join(node.get_path(), 'logs', filename)
+    with _BUSES_LOCK:
+        if path not in _BUSES:
+            _BUSES[path] = LogBus(path, name=node.name)
+        return _BUSES[path]
+
+
+def stop_log_buses(path):
+    """
+    Stops and forgets the LogBus's of the logs under path, the directory of
+    a node or cluster being cleaned up.
+    """
+    prefix = os.path.join(path, '')
+    with _BUSES_LOCK:
+        buses = [_BUSES.pop(log_path) for log_path in list(_BUSES) if log_path.startswith(prefix)]
+    for bus in buses:
+        bus.stop()
+
+
+def watch_log_for(node, exprs, from_mark=None, timeout=600, filename='system.log'):
+    """
+    Like node.watch_log_for(exprs, from_mark=from_mark, timeout=timeout,
+    filename=filename), but sharing one read of the log with every other
+    thread watching it through log_bus. If the node is running, the wait
+    fails as soon as it stops without logging the lines.
+    """
+    # a node that isn't running yet may be about to start
+    alive = node.is_running if node.is_running() else None
+    return log_bus(node, filename).subscribe(exprs, from_mark=from_mark, alive=alive).wait(timeout)
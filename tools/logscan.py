@@ -0,0 +1,73 @@
+"""
+Incremental scanning of node logs, so that checking a log again only reads
+what was appended since the last check.
+"""
+import os
+import re
+
+from ccmlib.node import _grep_log_for_errors
+
+
+class LogCursor(object):
+    """
+    The position up to which a log file has been read, as the file's inode
+    and a byte offset into it. A new inode or a file shorter than the offset
+    means the log was rotated or truncated, and it's read from the start.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.inode = None
+        self.offset = 0
+
+    def read_new(self, seek_start=0):
+        """
+        Returns the complete lines appended to the log since the last call,
+        skipping anything before seek_start. A partially written last line is
+        left for the next call.
+        """
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return ''
+        if stat.st_ino != self.inode or stat.st_size < self.offset:
+            self.inode, self.offset = stat.st_ino, 0
+
+        start = max(self.offset, seek_start)
+        with open(self.path, 'rb') as f:
+            f.seek(start)
+            data = f.read()
+        complete = data.rfind('\n') + 1
+        self.offset = start + complete
+        return data[:complete]
+
+
+def grep_log_for_new_errors(node, filename='system.log'):
+    """
+    Like node.grep_log_for_errors(), but only scans what was appended to the
+    node's log since the last time this was called for it, so that repeated
+    checks of a long-lived node's log don't re-read and re-report it all.
+    Respects node.mark_log_for_errors().
+    """
+    path = os.path.join(node.get_path(), 'logs', filename)
+    cursors = getattr(node, 'log_error_cursors', None)
+    if cursors is None:
+        cursors = node.log_error_cursors = {}
+    if path not in cursors:
+        cursors[path] = LogCursor(path)
+    return _grep_log_for_errors(cursors[path].read_new(seek_start=getattr(node, 'error_mark', 0)))
+
+
+_COMBINED_PATTERNS = {}
+
+
+def combine_patterns(patterns):
+    """
+    Returns a compiled regex that matches wherever any of the patterns
+    matches, or None if there are none. Cached, since tests keep asking for
+    the same patterns.
+    """
+    patterns = tuple(patterns)
+    if patterns not in _COMBINED_PATTERNS:
+        _COMBINED_PATTERNS[patterns] = re.compile('|'.join('(?:{})'.format(p) for p in patterns)) if patterns else None
+    return _COMBINED_PATTERNS[patterns]
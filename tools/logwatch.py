@@ -0,0 +1,178 @@
+"""
+Active watching of node logs for errors while a test runs, woken by Linux
+inotify when logs change and falling back to polling elsewhere.
+"""
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import threading
+from collections import OrderedDict
+
+from ccmlib.node import _grep_log_for_errors
+
+from tools.logscan import LogCursor
+
+# from sys/inotify.h
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+
+class Inotify(object):
+    """
+    A minimal ctypes binding of inotify, for waiting on changes to files in
+    a set of directories. Raises OSError if inotify isn't available.
+    """
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, 'libc not found')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify not supported')
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path, mask=IN_MODIFY | IN_CREATE | IN_MOVED_TO):
+        if self._libc.inotify_add_watch(self.fd, path, mask) < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed for {}'.format(path))
+
+    def drain(self):
+        """
+        Discard pending events. We only care that something changed.
+        """
+        while True:
+            try:
+                if not os.read(self.fd, 4096):
+                    return
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    return
+                raise
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LogWatcher(threading.Thread):
+    """
+    A thread that tails the logs of every node of a cluster and calls
+    on_error with an OrderedDict mapping node names to lists of errors, in
+    the format of node.grep_log_for_errors(), whenever new errors show up.
+
+    Where inotify is available the thread sleeps until a log directory
+    changes, checking for new nodes every max_interval seconds. Elsewhere it
+    polls every poll_interval seconds.
+
+    Unlike ccm's Cluster.actively_watch_logs_for_error, the watcher can be
+    stopped while the cluster lives on and started again later, with
+    from_end=True to skip what earlier watchers already saw.
+    """
+
+    def __init__(self, cluster, on_error, filenames=('system.log',), from_end=False,
+                 poll_interval=0.25, max_interval=1):
+        super(LogWatcher, self).__init__()
+        self.daemon = True  # exit with the main thread if never stopped
+        self.cluster = cluster
+        self.on_error = on_error
+        self.filenames = filenames
+        self.poll_interval = poll_interval
+        self.max_interval = max_interval
+        self.cursors = {}
+        self.watched_dirs = set()
+        self.stop_requested = threading.Event()
+        self._wake_read, self._wake_write = os.pipe()
+        try:
+            self.inotify = Inotify()
+        except OSError:
+            self.inotify = None
+        if from_end:
+            # skip what's already in the logs by reading it now
+            for node in cluster.nodelist():
+                for filename in filenames:
+                    self._cursor(node, filename).read_new()
+
+    def _cursor(self, node, filename):
+        path = os.path.join(node.get_path(), 'logs', filename)
+        if path not in self.cursors:
+            self.cursors[path] = LogCursor(path)
+        return self.cursors[path]
+
+    def _watch_new_log_dirs(self):
+        for node in self.cluster.nodelist():
+            log_dir = os.path.join(node.get_path(), 'logs')
+            if log_dir not in self.watched_dirs and os.path.isdir(log_dir):
+                try:
+                    self.inotify.add_watch(log_dir)
+                except OSError:
+                    continue  # removed in the meantime, the next scan will tell
+                self.watched_dirs.add(log_dir)
+
+    def scan(self):
+        errordata = OrderedDict()
+        try:
+            for node in self.cluster.nodelist():
+                errors = []
+                for filename in self.filenames:
+                    errors.extend(_grep_log_for_errors(self._cursor(node, filename).read_new()))
+                if errors:
+                    errordata[node.name] = errors
+        except (IOError, OSError) as e:
+            # report problems with the watcher as errors of their own
+            errordata['log_scanner'] = [[str(e)]]
+        return errordata
+
+    def scan_and_report(self):
+        errordata = self.scan()
+        if errordata:
+            self.on_error(errordata)
+
+    def _wait(self):
+        """
+        Sleep until a log changes, or for the polling interval.
+        """
+        if self.inotify is None:
+            select.select([self._wake_read], [], [], self.poll_interval)
+            return
+        self._watch_new_log_dirs()
+        readable, _, _ = select.select([self.inotify.fd, self._wake_read], [], [], self.max_interval)
+        if self.inotify.fd in readable:
+            # let a burst of writes settle into one scan
+            self.stop_requested.wait(0.05)
+            self.inotify.drain()
+
+    def run(self):
+        try:
+            while not self.stop_requested.is_set():
+                self.scan_and_report()
+                self._wait()
+            # a final scan to make sure we got to the very end of the logs
+            self.scan_and_report()
+        finally:
+            if self.inotify is not None:
+                self.inotify.close()
+
+    def stop(self, timeout=60):
+        """
+        Stop watching after a final scan of the logs. Can be called more than
+        once.
+        """
+        if not self.stop_requested.is_set():
+            self.stop_requested.set()
+            os.write(self._wake_write, 'x')
+            super(LogWatcher, self).join(timeout)
+            if not self.is_alive():
+                os.close(self._wake_read)
+                os.close(self._wake_write)
+        else:
+            super(LogWatcher, self).join(timeout)
+
+    def join(self, timeout=None):
+        # dtest.stop_active_log_watch joins the watcher like ccm's watching thread
+        self.stop(timeout)
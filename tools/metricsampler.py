@@ -0,0 +1,101 @@
+"""
+Background sampling of JMX metrics on every running node of a cluster, so
+that when a test fails or times out there is a record of what the cluster
+was doing in the meantime: thread pool backlogs, request latencies, pending
+commitlog and compaction work, heap usage...
+
+Samples are kept in ring buffers, the last `capacity` per node, and dumped
+as JSON next to the logs Tester.copy_logs saves.
+"""
+import json
+import subprocess
+import threading
+import time
+from collections import deque, namedtuple
+
+from tools.jmxnodetool import jmx_nodetool
+from tools.jmxutils import make_mbean, mbean_properties
+
+Metric = namedtuple('Metric', ['name', 'mbean', 'attribute', 'path'])
+Metric.__new__.__defaults__ = (None,)
+
+DEFAULT_METRICS = (
+    Metric('active_tasks', 'org.apache.cassandra.metrics:type=ThreadPools,path=*,scope=*,name=ActiveTasks', 'Value'),
+    Metric('pending_tasks', 'org.apache.cassandra.metrics:type=ThreadPools,path=*,scope=*,name=PendingTasks', 'Value'),
+    Metric('read_latency_p99', make_mbean('metrics', 'ClientRequest', scope='Read', name='Latency'), '99thPercentile'),
+    Metric('write_latency_p99', make_mbean('metrics', 'ClientRequest', scope='Write', name='Latency'), '99thPercentile'),
+    Metric('commitlog_pending_tasks', make_mbean('metrics', 'CommitLog', name='PendingTasks'), 'Value'),
+    Metric('compaction_pending_tasks', make_mbean('metrics', 'Compaction', name='PendingTasks'), 'Value'),
+    Metric('heap_used', 'java.lang:type=Memory', 'HeapMemoryUsage', 'used'),
+)
+
+
+def _sample_value(metric, value):
+    """
+    Values of mbean patterns come back keyed by mbean name; key them by the
+    values of the pattern's wildcards instead, e.g. 'request/MutationStage'.
+    """
+    if '*' not in metric.mbean:
+        return value
+    wildcards = sorted(k for k, v in mbean_properties(metric.mbean).items() if v == '*')
+    return {'/'.join(mbean_properties(name)[k] for k in wildcards): values[metric.attribute]
+            for name, values in value.items()}
+
+
+class MetricsSampler(threading.Thread):
+    """
+    A thread reading a set of Metrics from every running node of a cluster
+    every `interval` seconds, through the node's jmx_nodetool, so the Jolokia
+    agent is shared with the test.
+
+    Nodes the agent couldn't be attached to (see
+    remove_perf_disable_shared_mem) are skipped until they restart. Other
+    failures are recorded as samples with an 'error'.
+    """
+
+    def __init__(self, cluster, metrics=DEFAULT_METRICS, interval=1, capacity=600):
+        super(MetricsSampler, self).__init__(name='MetricsSampler')
+        self.daemon = True  # exit with the main thread if never stopped
+        self.cluster = cluster
+        self.metrics = metrics
+        self.interval = interval
+        self.capacity = capacity
+        self.samples = {}
+        self.unavailable = {}
+        self.stop_requested = threading.Event()
+
+    def sample(self):
+        for node in self.cluster.nodelist():
+            if not node.is_running() or self.unavailable.get(node.name) == node.pid:
+                continue
+            timestamp = time.time()
+            try:
+                values = jmx_nodetool(node).read([(m.mbean, m.attribute, m.path) for m in self.metrics])
+            except subprocess.CalledProcessError:
+                self.unavailable[node.name] = node.pid
+                continue
+            except Exception as e:
+                sample = {'error': str(e)}
+            else:
+                sample = {m.name: _sample_value(m, value) for m, value in zip(self.metrics, values)}
+            sample['time'] = timestamp
+            self.samples.setdefault(node.name, deque(maxlen=self.capacity)).append(sample)
+
+    def run(self):
+        while not self.stop_requested.is_set():
+            started = time.time()
+            self.sample()
+            self.stop_requested.wait(max(0, self.interval - (time.time() - started)))
+
+    def stop(self, timeout=60):
+        self.stop_requested.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def dump(self, filename):
+        """
+        Writes the samples to filename, as a JSON object mapping node names
+        to lists of samples, oldest first.
+        """
+        with open(filename, 'w') as f:
+            json.dump({name: list(samples) for name, samples in self.samples.items()}, f, indent=1, sort_keys=True)
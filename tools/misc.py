@@ -5,7 +5,7 @@ from collections import Mapping
 
 from ccmlib.node import Node
 
-from dtest import debug
+from dtest import CLUSTER_IP_PREFIX, address_block_port, debug
 
 
 # work for cluster started by populate
@@ -14,12 +14,12 @@ def new_node(cluster, bootstrap=True, token=None, remote_debug_port='0', data_ce
     node = Node('node%s' % i,
                 cluster,
                 bootstrap,
-                ('127.0.0.%s' % i, 9160),
-                ('127.0.0.%s' % i, 7000),
-                str(7000 + i * 100),
+                ('%s%s' % (CLUSTER_IP_PREFIX, i), 9160),
+                ('%s%s' % (CLUSTER_IP_PREFIX, i), 7000),
+                address_block_port(7000 + i * 100),
                 remote_debug_port,
                 token,
-                binary_interface=('127.0.0.%s' % i, 9042))
+                binary_interface=('%s%s' % (CLUSTER_IP_PREFIX, i), 9042))
     cluster.add(node, not bootstrap, data_center=data_center)
     return node
 
@@ -0,0 +1,92 @@
+"""
+Cheap checks of whether a node's native transport is serving requests, for
+waiting on a node before paying for a full driver Cluster and Session.
+"""
+import socket
+import ssl
+import struct
+import time
+
+# opcodes of the native protocol, see doc/native_protocol_v*.spec
+STARTUP, OPTIONS, SUPPORTED = 0x01, 0x05, 0x06
+
+
+class NativeTransportError(Exception):
+    pass
+
+
+def _header_format(protocol_version):
+    # the stream id became a short in v3
+    return '>BBhBi' if protocol_version >= 3 else '>BBbBi'
+
+
+def _string_map(values):
+    body = struct.pack('>H', len(values))
+    for key, value in values.items():
+        body += struct.pack('>H', len(key)) + key + struct.pack('>H', len(value)) + value
+    return body
+
+
+def _recv_exactly(sock, size):
+    data = ''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise NativeTransportError('Connection closed by the node')
+        data += chunk
+    return data
+
+
+def _request(sock, protocol_version, opcode, body=''):
+    """
+    Send a request and return the opcode of the response, skipping its body.
+    """
+    sock.sendall(struct.pack(_header_format(protocol_version), protocol_version, 0, 0, opcode, len(body)) + body)
+    # a node that doesn't speak protocol_version answers in its own version
+    version = _recv_exactly(sock, 1)
+    header_format = _header_format(ord(version) & 0x7f)
+    _, _, _, response_opcode, length = struct.unpack(
+        header_format, version + _recv_exactly(sock, struct.calcsize(header_format) - 1))
+    _recv_exactly(sock, length)
+    return response_opcode
+
+
+def probe_native_transport(address, port, protocol_version, ssl_opts=None, timeout=2):
+    """
+    Connect to the native transport at address:port and do the OPTIONS and
+    STARTUP handshake a driver starts with.
+
+    Returns normally once the node answered, even if it answered with an
+    error such as an unsupported protocol version: that's for the driver to
+    report. Raises socket.error or NativeTransportError if the node isn't
+    serving requests yet.
+    """
+    sock = socket.create_connection((address, port), timeout=timeout)
+    try:
+        if ssl_opts:
+            sock = ssl.wrap_socket(sock, **ssl_opts)
+        if _request(sock, protocol_version, OPTIONS) == SUPPORTED:
+            _request(sock, protocol_version, STARTUP, _string_map({'CQL_VERSION': '3.0.0'}))
+    finally:
+        sock.close()
+
+
+def wait_for_native_transport(address, port, protocol_version, ssl_opts=None, timeout=30, max_interval=1):
+    """
+    Probe the native transport at address:port with exponential backoff
+    until it's ready or `timeout` seconds passed.
+
+    Returns True if the node became ready, False otherwise.
+    """
+    deadline = time.time() + timeout
+    interval = 0.05
+    while True:
+        try:
+            probe_native_transport(address, port, protocol_version, ssl_opts=ssl_opts,
+                                   timeout=max(0.1, min(2, deadline - time.time())))
+            return True
+        except (socket.error, NativeTransportError, struct.error):
+            if time.time() + interval > deadline:
+                return False
+            time.sleep(interval)
+            interval = min(interval * 2, max_interval)
@@ -0,0 +1,144 @@
+"""
+Stored performance baselines: stress results saved as JSON, keyed by the
+Cassandra SHA they were measured on, and the comparison of new results
+against them.
+
+The file keeps the results of every run, by SHA and workload, apart from
+the accepted baseline of each workload, which runs are compared against:
+
+    {"results": {"github:apache/0123abc...": {"write_heavy_lcs": {"op_rate": 12000.0, "p99": 35.1, ...}}},
+     "accepted": {"write_heavy_lcs": {"sha": "github:apache/0123abc...", "metrics": {...}}}}
+
+The first run of a workload is accepted as its baseline. Later runs only
+replace it when asked to (PERF_ACCEPT_BASELINE=yes) and within tolerance,
+so neither a regression nor small regressions adding up from SHA to SHA
+become the baseline. A run compares against the results of
+PERF_BASELINE_SHA instead if set.
+"""
+import fcntl
+import json
+import os
+import tempfile
+import time
+from collections import namedtuple
+
+from dtest import debug
+
+# higher is better for rates, lower is better for latencies
+THROUGHPUT_METRICS = ('op_rate', 'partition_rate')
+LATENCY_METRICS = ('mean', 'median', 'p95', 'p99')
+
+Regression = namedtuple('Regression', ['metric', 'baseline', 'value', 'change'])
+
+
+def summary_metrics(summary):
+    """
+    The metrics of a StressSummary worth keeping in a baseline.
+    """
+    assert summary is not None, 'stress printed no summary, see its output'
+    metrics = {'op_rate': summary.op_rate, 'partition_rate': summary.partition_rate,
+               'total_errors': summary.total_errors}
+    metrics.update(summary.latency._asdict())
+    return metrics
+
+
+def find_regressions(baseline, metrics, tolerance):
+    """
+    Compares metrics against a baseline, returning a Regression for every
+    throughput that dropped, or latency that rose, by more than tolerance,
+    a fraction of the baseline.
+    """
+    regressions = []
+    for metric in THROUGHPUT_METRICS + LATENCY_METRICS:
+        base, value = baseline.get(metric), metrics.get(metric)
+        if not base or value is None:
+            continue
+        change = (value - base) / float(base)
+        if (metric in THROUGHPUT_METRICS and change < -tolerance) or (metric in LATENCY_METRICS and change > tolerance):
+            regressions.append(Regression(metric, base, value, change))
+    return regressions
+
+
+class PerfBaselines(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return {'results': {}, 'accepted': {}}
+        with open(self.path) as f:
+            return json.load(f)
+
+    def _update(self, update):
+        """
+        Applies update to the loaded file and saves it. Workers updating at
+        the same time take turns, so none loses the changes of another.
+        """
+        with open(self.path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            stored = self.load()
+            update(stored)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(stored, f, indent=2, sort_keys=True)
+            # readers, which don't lock, see the old file or the new one
+            os.rename(tmp_path, self.path)
+
+    def record(self, sha, workload, metrics):
+        """
+        Saves metrics for workload as measured on sha, replacing earlier
+        results for the same pair.
+        """
+        def update(stored):
+            stored['results'].setdefault(sha, {})[workload] = dict(metrics, recorded_at=time.time())
+        self._update(update)
+
+    def accept(self, sha, workload, metrics):
+        """
+        Makes metrics, measured on sha, the baseline of workload.
+        """
+        def update(stored):
+            stored['accepted'][workload] = {'sha': sha, 'metrics': metrics, 'accepted_at': time.time()}
+        self._update(update)
+
+    def baseline(self, workload, baseline_sha=None):
+        """
+        Returns (baseline sha, metrics) to compare results of workload
+        against: the accepted ones, or those recorded for baseline_sha.
+        Returns (None, None) if there is nothing to compare with.
+        """
+        stored = self.load()
+        if baseline_sha is not None:
+            return baseline_sha, stored['results'].get(baseline_sha, {}).get(workload)
+        accepted = stored['accepted'].get(workload)
+        if accepted is None:
+            return None, None
+        return accepted['sha'], accepted['metrics']
+
+
+def assert_no_regression(baselines, sha, workload, summary, tolerance, baseline_sha=None, accept=False):
+    """
+    Records the StressSummary of workload, run on sha, then asserts that it
+    didn't regress by more than tolerance from its baseline. Passes, and
+    accepts the results as the baseline, if there is none yet. With accept,
+    results that pass replace the baseline.
+    """
+    metrics = summary_metrics(summary)
+    other, baseline = baselines.baseline(workload, baseline_sha)
+    baselines.record(sha, workload, metrics)
+    if baseline is None:
+        if baseline_sha is None:
+            debug('No baseline for {}, accepted {} on {}'.format(workload, metrics, sha))
+            baselines.accept(sha, workload, metrics)
+        else:
+            debug('No results of {} on {}, recorded {} for {}'.format(workload, baseline_sha, metrics, sha))
+        return
+    regressions = find_regressions(baseline, metrics, tolerance)
+    debug('{} on {}: {}, baseline on {}: {}'.format(workload, sha, metrics, other, baseline))
+    assert not regressions, '{} regressed from {} by more than {:.0%}: {}'.format(
+        workload, other, tolerance,
+        ', '.join('{} {} -> {} ({:+.1%})'.format(r.metric, r.baseline, r.value, r.change) for r in regressions))
+    if accept:
+        debug('Accepted {} on {} as the baseline of {}'.format(metrics, sha, workload))
+        baselines.accept(sha, workload, metrics)
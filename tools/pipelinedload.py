@@ -0,0 +1,164 @@
+"""
+Pipelined load for tests that write and verify data continuously while the
+cluster changes under them, e.g. during a rolling upgrade.
+
+Statements are issued with execute_async, up to `max_in_flight` at a time,
+rather than one synchronous execute after another, and their throughput
+and latencies are logged every `report_interval` seconds. Written rows are
+shipped to the process verifying them in batches, through a RowBatches,
+which also counts the rows written but not verified yet.
+"""
+import threading
+import time
+from collections import deque, namedtuple
+from multiprocessing import Queue, Value
+
+from dtest import debug
+
+LoadInterval = namedtuple('LoadInterval', ['ops', 'errors', 'rate', 'mean', 'p95', 'p99', 'max'])
+
+
+class RowBatches(object):
+    """
+    A multiprocessing queue of batches of rows, counting the rows put in it
+    until they are marked verified, so unlike a Queue's its size is known
+    on every platform.
+    """
+
+    def __init__(self):
+        self.queue = Queue()
+        self.rows = Value('l', 0)
+
+    def put(self, batch):
+        with self.rows.get_lock():
+            self.rows.value += len(batch)
+        self.queue.put(batch)
+
+    def get(self, timeout=None):
+        """
+        The next batch, raising Queue.Empty after `timeout` seconds.
+        """
+        return self.queue.get(timeout=timeout)
+
+    def verified(self, count=1):
+        with self.rows.get_lock():
+            self.rows.value -= count
+
+    def qsize(self):
+        return self.rows.value
+
+    def close(self):
+        self.queue.close()
+
+
+def _quantile(ordered, q):
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Pipeline(object):
+    """
+    Issues statements through a session with execute_async, at most
+    max_in_flight at a time. The first error, of a statement or a
+    callback, is raised by the next call to submit or drain.
+    """
+
+    def __init__(self, session, name, max_in_flight=50, report_interval=30):
+        self.session = session
+        self.name = name
+        self.max_in_flight = max_in_flight
+        self.report_interval = report_interval
+        self.slots = threading.Semaphore(max_in_flight)
+        self.error = None
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+        self.interval_start = time.time()
+
+    def submit(self, statement, parameters=None, callback=None):
+        """
+        Issues statement, calling callback with its rows once it succeeded.
+        Blocks while max_in_flight statements are.
+        """
+        self.slots.acquire()
+        self.check()
+        start = time.time()
+        try:
+            future = self.session.execute_async(statement, parameters)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_callbacks(self._succeeded, self._failed, callback_args=(start, callback), errback_args=(start,))
+
+    def _succeeded(self, rows, start, callback):
+        with self.lock:
+            self.latencies.append(time.time() - start)
+        try:
+            if callback is not None:
+                callback(rows)
+        except Exception as e:
+            self.error = self.error or e
+        finally:
+            self.slots.release()
+
+    def _failed(self, error, start):
+        with self.lock:
+            self.errors += 1
+        self.error = self.error or error
+        self.slots.release()
+
+    def check(self):
+        if self.error is not None:
+            raise self.error
+
+    def drain(self):
+        """
+        Waits for the statements in flight.
+        """
+        for _ in xrange(self.max_in_flight):
+            self.slots.acquire()
+        for _ in xrange(self.max_in_flight):
+            self.slots.release()
+        self.check()
+
+    def report(self, force=False):
+        """
+        Logs, and returns as a LoadInterval, the throughput and latencies
+        in ms since the last report, if report_interval passed since.
+        """
+        now = time.time()
+        if not force and now - self.interval_start < self.report_interval:
+            return None
+        with self.lock:
+            latencies, self.latencies = sorted(self.latencies), []
+            errors, self.errors = self.errors, 0
+        elapsed, self.interval_start = now - self.interval_start, now
+        if latencies:
+            interval = LoadInterval(len(latencies), errors, len(latencies) / elapsed,
+                                    1000 * sum(latencies) / len(latencies), 1000 * _quantile(latencies, 0.95),
+                                    1000 * _quantile(latencies, 0.99), 1000 * latencies[-1])
+        else:
+            interval = LoadInterval(0, errors, 0.0, None, None, None, None)
+        debug('{}: {} ops ({:.0f}/s), {} errors, latency mean {} p95 {} p99 {} max {} ms'.format(
+            self.name, interval.ops, interval.rate, interval.errors,
+            *('{:.1f}'.format(latency) if latency is not None else '-' for latency in interval[3:])))
+        return interval
+
+
+class Batcher(object):
+    """
+    Collects items, from the driver's callbacks, into batches of up to
+    batch_size, shipping them with `ship` when full or flushed.
+    """
+
+    def __init__(self, ship, batch_size=100):
+        self.ship = ship
+        self.batch_size = batch_size
+        self.items = deque()
+
+    def add(self, item):
+        self.items.append(item)
+
+    def flush(self, partial=True):
+        while len(self.items) >= self.batch_size or (partial and self.items):
+            batch = [self.items.popleft() for _ in xrange(min(self.batch_size, len(self.items)))]
+            self.ship(batch)
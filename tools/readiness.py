@@ -0,0 +1,196 @@
+"""
+Probes of whether a cluster has settled after a node was (re)started, e.g.
+by an upgrade: schema agreement, every running node seeing every other one
+UP and NORMAL, no hints or batches left to replay and idle thread pools,
+other than those serving requests, which the probes' own sessions and any
+client of the test keep busy.
+wait_for_ready polls them until they all pass, so tests wait only as long
+as needed instead of sleeping for a fixed time, and reports what didn't
+settle when they don't.
+
+Gossip and thread pool state are read through jmx_nodetool from nodes
+running the Jolokia agent since they started (JOLOKIA_AT_START=yes), and
+through nodetool, on all nodes at once, otherwise, polling less often as
+each nodetool command starts a JVM. Batches, and hints before 3.0, are
+node-local tables so are only checked for nodes given a session exclusive
+to them, unless JMX is used.
+
+Example usage:
+
+    wait_for_ready(cluster.nodelist(), sessions={node1.name: self.patient_exclusive_cql_connection(node1)})
+"""
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+
+from tools.jmxnodetool import jmx_nodetool
+from tools.jmxutils import javaagent_jolokia_port, make_mbean
+
+NodeState = namedtuple('NodeState', ['statuses', 'thread_pools', 'pending_batches', 'pending_hints'])
+
+# thread pools busy with client requests, which don't tell whether the cluster settled
+REQUEST_POOLS = ('Native-Transport-Requests', 'ReadStage', 'MutationStage', 'CounterMutationStage',
+                 'ViewMutationStage', 'RequestResponseStage', 'ReadRepairStage')
+
+NODETOOL_STATUS = re.compile(r'^([UD])([NLJM])\s+(\S+)', re.MULTILINE)
+NODETOOL_POOL = re.compile(r'^(\S+)\s+(\d+)\s+(\d+)\s+\d+\s+\d+\s+\d+', re.MULTILINE)
+
+
+class ClusterNotReady(Exception):
+
+    def __init__(self, problems, elapsed):
+        super(ClusterNotReady, self).__init__('Cluster not ready after {:.1f}s:\n  {}'.format(elapsed, '\n  '.join(problems)))
+        self.problems = problems
+        self.elapsed = elapsed
+
+
+def _nodetool_state(node):
+    statuses = {address: (status, state) for status, state, address in NODETOOL_STATUS.findall(node.nodetool('status')[0])}
+    pools = {name: (int(active), int(pending)) for name, active, pending in NODETOOL_POOL.findall(node.nodetool('tpstats')[0])}
+    return statuses, pools
+
+
+def _jmx_state(node):
+    nodetool = jmx_nodetool(node)
+    statuses = {s.address: (s.status, s.state) for s in nodetool.status()}
+    pools = {name: (pool.active, pool.pending) for name, pool in nodetool.tpstats().thread_pools.items()}
+    return statuses, pools
+
+
+def jmx_available(node):
+    """
+    Whether the node runs the Jolokia agent, so jmx_nodetool needn't attach it.
+    """
+    return javaagent_jolokia_port(node) is not None
+
+
+def _has_rows(session, query):
+    return bool(list(session.execute(query)))
+
+
+def _pending_hints(node, session, use_jmx):
+    if node.get_cassandra_version() >= '3.0':
+        hints = os.path.join(node.get_path(), 'hints')
+        return os.path.isdir(hints) and any(f.endswith('.hints') for f in os.listdir(hints))
+    if use_jmx:
+        return bool(jmx_nodetool(node).execute(make_mbean('db', 'HintedHandoffManager'), 'listEndpointsPendingHints'))
+    if session is not None:
+        return _has_rows(session, 'SELECT target_id FROM system.hints LIMIT 1')
+    return None
+
+
+def _pending_batches(node, session, use_jmx):
+    if use_jmx:
+        return jmx_nodetool(node).execute(make_mbean('db', 'BatchlogManager'), 'countAllBatches') > 0
+    if session is not None:
+        table = 'batches' if node.get_cassandra_version() >= '3.0' else 'batchlog'
+        return _has_rows(session, 'SELECT id FROM system.{} LIMIT 1'.format(table))
+    return None
+
+
+def node_state(node, session=None, use_jmx=None):
+    """
+    The NodeState of a running node: its view of every node's (status,
+    state), by address, the (active, pending) tasks of its thread pools, by
+    name, and whether it has batches or hints to replay, None if unknown.
+    Read through JMX if use_jmx, by default if jmx_available(node).
+    """
+    if use_jmx is None:
+        use_jmx = jmx_available(node)
+    statuses, pools = _jmx_state(node) if use_jmx else _nodetool_state(node)
+    return NodeState(statuses, pools, _pending_batches(node, session, use_jmx), _pending_hints(node, session, use_jmx))
+
+
+def schema_problems(node, session, nodes):
+    """
+    Checks, through a session exclusive to node, that all running nodes
+    agree on the schema.
+    """
+    try:
+        versions = {row.peer: row.schema_version for row in session.execute('SELECT peer, schema_version FROM system.peers')}
+        versions[node.address()] = session.execute("SELECT schema_version FROM system.local WHERE key='local'")[0].schema_version
+    except Exception as e:
+        return ['schema versions could not be read from {}: {}'.format(node.name, e)]
+    running = {other.address(): other.name for other in nodes if other.is_running()}
+    if len({versions.get(address) for address in running}) > 1:
+        return ['schema disagreement: {}'.format(
+            ', '.join('{}={}'.format(name, versions.get(address)) for address, name in sorted(running.items())))]
+    return []
+
+
+def node_problems(node, state, nodes, ignored_pools=REQUEST_POOLS):
+    """
+    What is unsettled about a node, given its NodeState.
+    """
+    problems = []
+    for other in nodes:
+        if other.is_running():
+            seen = state.statuses.get(other.address())
+            if seen != ('U', 'N'):
+                problems.append('{} sees {} as {}'.format(node.name, other.name, ''.join(seen) if seen else 'unknown'))
+    busy = ['{} ({} active, {} pending)'.format(name, active, pending)
+            for name, (active, pending) in sorted(state.thread_pools.items())
+            if (active or pending) and name not in ignored_pools]
+    if busy:
+        problems.append('{} has busy thread pools: {}'.format(node.name, ', '.join(busy)))
+    if state.pending_batches:
+        problems.append('{} has batches to replay'.format(node.name))
+    if state.pending_hints:
+        problems.append('{} has hints to deliver'.format(node.name))
+    return problems
+
+
+def cluster_problems(nodes, sessions=None, use_jmx=None, ignored_pools=REQUEST_POOLS):
+    """
+    Probes all running nodes at once, returning what is unsettled about the
+    cluster, nothing if it is ready. `sessions` maps node names to sessions
+    exclusive to the node, any of which is used to check schema agreement.
+    """
+    sessions = {name: session for name, session in (sessions or {}).items() if not session.is_shutdown}
+    running = [node for node in nodes if node.is_running()]
+    states = {}
+
+    def probe(node):
+        try:
+            states[node.name] = node_state(node, sessions.get(node.name), use_jmx)
+        except Exception as e:
+            states[node.name] = e
+
+    threads = [threading.Thread(target=probe, args=(node,)) for node in running]
+    for thread in threads:
+        thread.start()
+    with_session = [node for node in running if node.name in sessions]
+    problems = schema_problems(with_session[0], sessions[with_session[0].name], nodes) if with_session else []
+    for thread in threads:
+        thread.join()
+
+    for node in running:
+        state = states[node.name]
+        if isinstance(state, Exception):
+            problems.append('{} could not be probed: {}'.format(node.name, state))
+        else:
+            problems.extend(node_problems(node, state, nodes, ignored_pools))
+    return problems
+
+
+def wait_for_ready(nodes, sessions=None, timeout=60, interval=None, use_jmx=None, ignored_pools=REQUEST_POOLS):
+    """
+    Waits until cluster_problems finds none, returning how long that took.
+    Raises ClusterNotReady, listing the problems left, after `timeout`
+    seconds. Polls every `interval` seconds, by default 0.5 if every node
+    is probed through JMX and 3 if any is through nodetool.
+    """
+    if interval is None:
+        through_jmx = use_jmx if use_jmx is not None else all(jmx_available(node) for node in nodes if node.is_running())
+        interval = 0.5 if through_jmx else 3
+    start = time.time()
+    while True:
+        problems = cluster_problems(nodes, sessions, use_jmx, ignored_pools)
+        elapsed = time.time() - start
+        if not problems:
+            return elapsed
+        if elapsed >= timeout:
+            raise ClusterNotReady(problems, elapsed)
+        time.sleep(interval)
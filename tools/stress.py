@@ -0,0 +1,331 @@
+"""
+Structured cassandra-stress runs: a builder for the command line, and a
+parser turning stress's interval and summary output into typed results, so
+tests can assert throughput and latency envelopes rather than only that
+stress exited cleanly.
+
+Example usage:
+
+    command = StressCommand('write', n='100K', cl='ONE', no_warmup=True).option('rate', threads=50)
+    result = run_stress(node1, command)
+    self.assertGreater(result.summary.op_rate, 1000)
+    self.assertLess(result.summary.latency.p99, 100)
+"""
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from ccmlib.node import ToolError
+
+# the columns of the interval lines, named after the header stress prints
+INTERVAL_COLUMNS = OrderedDict([
+    ('total ops', 'total_ops'), ('op/s', 'op_rate'), ('pk/s', 'partition_rate'), ('row/s', 'row_rate'),
+    ('mean', 'mean'), ('med', 'median'), ('.95', 'p95'), ('.99', 'p99'), ('.999', 'p999'), ('max', 'max'),
+    ('time', 'time'), ('stderr', 'stderr'), ('errors', 'errors'), ('gc: #', 'gc_count'),
+    ('max ms', 'gc_max_ms'), ('sum ms', 'gc_sum_ms'), ('sdv ms', 'gc_sdv_ms'), ('mb', 'gc_mb')])
+
+StressInterval = namedtuple('StressInterval', ['type'] + INTERVAL_COLUMNS.values())
+Latency = namedtuple('Latency', ['mean', 'median', 'p95', 'p99', 'p999', 'max'])
+StressGc = namedtuple('StressGc', ['count', 'memory_mb', 'time'])
+StressSummary = namedtuple('StressSummary', ['op_rate', 'partition_rate', 'row_rate', 'latency', 'total_partitions',
+                                             'total_errors', 'gc', 'operation_time', 'by_operation'])
+StressResult = namedtuple('StressResult', ['summary', 'intervals', 'stdout', 'stderr'])
+ParallelStressResult = namedtuple('ParallelStressResult', ['summary', 'results'])
+
+# summary lines, e.g. "Latency 99th percentile   :   93.6 ms [WRITE: 93.6 ms]", on 2.1 to 4.0
+SUMMARY_LINE = re.compile(r'^\s*([A-Za-z][\w .()]*?)\s*:\s*([^\[]*?)\s*(?:\[(.*)\])?\s*$')
+SUMMARY_FIELDS = {
+    'op rate': 'op_rate',
+    'partition rate': 'partition_rate',
+    'row rate': 'row_rate',
+    'latency mean': 'mean',
+    'latency median': 'median',
+    'latency 95th percentile': 'p95',
+    'latency 99th percentile': 'p99',
+    'latency 99.9th percentile': 'p999',
+    'latency max': 'max',
+    'total partitions': 'total_partitions',
+    'total errors': 'total_errors',
+    'total gc count': 'gc_count',
+    'total gc memory': 'gc_memory',
+    'total gc mb': 'gc_memory',
+    'total gc time': 'gc_time',
+    'total gc time (s)': 'gc_time',
+    'total operation time': 'operation_time',
+}
+MEMORY_UNITS = {'b': 1.0 / 1024 ** 2, 'kib': 1.0 / 1024, 'mib': 1, 'gib': 1024, 'mb': 1}
+
+
+class StressCommand(object):
+    """
+    A cassandra-stress command line, built from the command, its settings
+    and its options. Keyword arguments are written key=value, with
+    underscores as dashes, and True values as bare flags.
+
+    >>> StressCommand('write', n='10K', no_warmup=True).option('rate', threads=8).option('schema', 'replication(factor=2)').args()
+    ['write', 'n=10K', 'no-warmup', '-rate', 'threads=8', '-schema', 'replication(factor=2)']
+    """
+
+    def __init__(self, command, *settings, **kwargs):
+        self.command = [command] + list(settings) + self._keywords(kwargs)
+        self.options = []
+
+    @staticmethod
+    def _keywords(kwargs):
+        args = []
+        for key, value in sorted(kwargs.items()):
+            if value is None or value is False:
+                continue
+            key = key.replace('_', '-')
+            args.append(key if value is True else '{}={}'.format(key, value))
+        return args
+
+    def option(self, name, *values, **kwargs):
+        """
+        Adds -name with the given values. Returns self, for chaining.
+        """
+        self.options.append(['-' + name] + list(values) + self._keywords(kwargs))
+        return self
+
+    def args(self):
+        return self.command + [arg for option in self.options for arg in option]
+
+    def __str__(self):
+        return ' '.join(self.args())
+
+
+def _number(text):
+    text = text.replace(',', '').strip()
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _seconds(text):
+    """
+    Stress's operation time, as HH:MM:SS.
+    """
+    try:
+        hours, minutes, seconds = [int(part) for part in text.strip().split(':')]
+    except ValueError:
+        return None
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def _memory_mb(text):
+    parts = text.split()
+    if not parts or _number(parts[0]) is None:
+        return None
+    unit = parts[1].lower() if len(parts) > 1 else 'mb'
+    return _number(parts[0]) * MEMORY_UNITS.get(unit, 1)
+
+
+def _by_operation(text):
+    """
+    The per-operation breakdown of a summary line, e.g. 'READ: 4,012 op/s,
+    WRITE: 4,003 op/s' or 'READ:4012, WRITE:4003'.
+    """
+    values = OrderedDict()
+    for item in re.split(r',\s+(?=[A-Za-z_]+\s*:)', text or ''):
+        if ':' in item:
+            operation, value = item.split(':', 1)
+            values[operation.strip()] = _number(value.split()[0]) if value.split() else None
+    return values
+
+
+def parse_interval(line, columns):
+    """
+    Parses an interval line of stress's output, e.g. 'total, 3345, 3345,
+    ...', given the column names of the header before it. Returns None for
+    anything else.
+    """
+    fields = [field.strip() for field in line.split(',')]
+    if len(fields) != len(columns) + 1 or not fields[0]:
+        return None
+    values = [_number(field) for field in fields[1:]]
+    if None in values:
+        return None
+    by_column = dict(zip(columns, values))
+    return StressInterval(fields[0], *[by_column.get(name) for name in INTERVAL_COLUMNS.values()])
+
+
+def parse_stress_output(stdout, stderr=None):
+    """
+    Parses the output of a stress run into a StressResult: its intervals,
+    as StressIntervals, and its summary, as a StressSummary, or None if
+    stress didn't get to print one. Rates are per second, latencies in
+    milliseconds, GC memory in MB and times in seconds.
+    """
+    intervals, columns, fields, by_operation = [], None, {}, {}
+    in_results = False
+    for line in stdout.splitlines():
+        if line.lower().startswith('type'):
+            names = [name.strip() for name in line.split(',')]
+            # 'type' may or may not be followed by a comma
+            names[0] = names[0][len('type'):].strip()
+            columns = [INTERVAL_COLUMNS.get(name) for name in names if name]
+            continue
+        if line.strip() == 'Results:':
+            in_results = True
+            continue
+        if in_results:
+            match = SUMMARY_LINE.match(line)
+            if not match or match.group(1).lower() not in SUMMARY_FIELDS:
+                continue
+            field = SUMMARY_FIELDS[match.group(1).lower()]
+            value = match.group(2)
+            if field == 'operation_time':
+                fields[field] = _seconds(value)
+            elif field == 'gc_memory':
+                fields[field] = _memory_mb(value)
+            else:
+                fields[field] = _number(value.split()[0]) if value.split() else None
+            if match.group(3):
+                by_operation[field] = _by_operation(match.group(3))
+        elif columns is not None:
+            interval = parse_interval(line, columns)
+            if interval is not None:
+                intervals.append(interval)
+
+    summary = None
+    if fields:
+        summary = StressSummary(op_rate=fields.get('op_rate'),
+                                partition_rate=fields.get('partition_rate'),
+                                row_rate=fields.get('row_rate'),
+                                latency=Latency(*[fields.get(name) for name in Latency._fields]),
+                                total_partitions=fields.get('total_partitions'),
+                                total_errors=fields.get('total_errors'),
+                                gc=StressGc(fields.get('gc_count'), fields.get('gc_memory'), fields.get('gc_time')),
+                                operation_time=fields.get('operation_time'),
+                                by_operation=by_operation)
+    return StressResult(summary, intervals, stdout, stderr)
+
+
+def run_stress(node, command, whitelist=False):
+    """
+    Runs stress against node, with a StressCommand or a list of arguments
+    as taken by node.stress, and returns the parsed StressResult. Raises
+    ccmlib.node.ToolError if stress fails, like node.stress.
+    """
+    stdout, stderr, _ = node.stress(_args(command), whitelist=whitelist)
+    return parse_stress_output(stdout, stderr)
+
+
+def _args(command):
+    return command.args() if isinstance(command, StressCommand) else list(command)
+
+
+def _interpolated_cdf(latency, x):
+    """
+    The fraction of operations faster than x, interpolated between the
+    quantiles stress reports.
+    """
+    points = [(0, 0.0), (latency.median, 0.5), (latency.p95, 0.95), (latency.p99, 0.99),
+              (latency.p999, 0.999), (latency.max, 1.0)]
+    for (x0, q0), (x1, q1) in zip(points, points[1:]):
+        if x <= x1:
+            return q1 if x1 == x0 else q0 + (q1 - q0) * (x - x0) / (x1 - x0)
+    return 1.0
+
+
+def _merged_quantile(latencies, weights, q):
+    """
+    The q quantile of the mixture of the clients' latency distributions,
+    weighted by their operation counts, found by bisection.
+    """
+    low, high = 0.0, max(latency.max for latency in latencies)
+    total = float(sum(weights))
+    for _ in range(50):
+        middle = (low + high) / 2
+        if sum(w * _interpolated_cdf(latency, middle) for latency, w in zip(latencies, weights)) / total < q:
+            low = middle
+        else:
+            high = middle
+    return high
+
+
+def merge_summaries(summaries):
+    """
+    Merges the StressSummaries of clients that ran concurrently into one for
+    the whole cluster: rates, totals and GC add up, the mean latency is
+    weighted by each client's partitions, and percentiles come from the
+    mixture of the clients' latency distributions, interpolated between the
+    percentiles each reported, as stress doesn't print its histograms.
+    """
+    summaries = [s for s in summaries if s is not None and s.latency.max is not None]
+    if not summaries:
+        return None
+    weights = [s.total_partitions or s.op_rate or 1 for s in summaries]
+    latencies = [s.latency for s in summaries]
+
+    def total(values):
+        values = [v for v in values if v is not None]
+        return sum(values) if values else None
+
+    by_operation = OrderedDict()
+    for field in ('op_rate', 'partition_rate', 'row_rate', 'total_partitions', 'total_errors'):
+        for s in summaries:
+            for operation, value in s.by_operation.get(field, {}).items():
+                merged = by_operation.setdefault(field, OrderedDict())
+                merged[operation] = merged.get(operation, 0) + (value or 0)
+
+    return StressSummary(
+        op_rate=total(s.op_rate for s in summaries),
+        partition_rate=total(s.partition_rate for s in summaries),
+        row_rate=total(s.row_rate for s in summaries),
+        latency=Latency(mean=sum(w * latency.mean for latency, w in zip(latencies, weights)) / float(sum(weights)),
+                        median=_merged_quantile(latencies, weights, 0.5),
+                        p95=_merged_quantile(latencies, weights, 0.95),
+                        p99=_merged_quantile(latencies, weights, 0.99),
+                        p999=_merged_quantile(latencies, weights, 0.999),
+                        max=max(latency.max for latency in latencies)),
+        total_partitions=total(s.total_partitions for s in summaries),
+        total_errors=total(s.total_errors for s in summaries),
+        gc=StressGc(*[total(values) for values in zip(*[s.gc for s in summaries])]),
+        operation_time=max(s.operation_time for s in summaries),
+        by_operation=by_operation)
+
+
+def run_parallel_stress(clients, stagger=0, whitelist=True):
+    """
+    Runs several stress clients at once, e.g. one per node or per DC, as a
+    single stress process can't saturate a multi-node cluster on the same
+    host. `clients` are (node, command) pairs, each node being the
+    coordinator of its client unless whitelist is False. Clients are
+    started `stagger` seconds apart so their warmups don't coincide.
+
+    Returns a ParallelStressResult with the clients' StressResults, in
+    order, and their merged StressSummary, see merge_summaries. Raises
+    ccmlib.node.ToolError, after all clients finished, if any failed.
+    """
+    outputs = [None] * len(clients)
+
+    def communicate(i, process):
+        outputs[i] = process.communicate() + (process.returncode,)
+
+    threads = []
+    for i, (node, command) in enumerate(clients):
+        if i and stagger:
+            time.sleep(stagger)
+        process = node.stress_process(_args(command), whitelist=whitelist)
+        thread = threading.Thread(target=communicate, args=(i, process))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    for (node, command), (stdout, stderr, rc) in zip(clients, outputs):
+        if rc != 0:
+            raise ToolError(['stress'] + _args(command), rc, stdout, stderr)
+    results = [parse_stress_output(stdout, stderr) for stdout, stderr, _ in outputs]
+    return ParallelStressResult(merge_summaries(r.summary for r in results), results)
+
+
+def one_client_per_node(nodes, command):
+    """
+    The clients for run_parallel_stress running command against each of
+    nodes.
+    """
+    return [(node, command) for node in nodes]
@@ -14,6 +14,8 @@ from tools.decorators import no_vnodes, since
 
 
 class TestTopology(Tester):
+    allow_cluster_templates = False  # tests configure tokens and join_ring for the nodes' first boot
+    hardcoded_addresses = True  # expected rings, moves and log messages name the nodes by address
 
     def do_not_join_ring_test(self):
         """
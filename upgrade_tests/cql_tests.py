@@ -35,6 +35,7 @@ from upgrade_manifest import build_upgrade_pairs
 
 
 class TestCQL(UpgradeTester):
+    batch_upgrades = True
 
     def static_cf_test(self):
         """ Test static CF syntax """
@@ -20,6 +20,7 @@ from upgrade_manifest import build_upgrade_pairs
 
 
 class BasePagingTester(UpgradeTester):
+    batch_upgrades = True
 
     def prepare(self, *args, **kwargs):
         start_on, upgrade_to = self.UPGRADE_PATH.starting_meta, self.UPGRADE_PATH.upgrade_meta
@@ -0,0 +1,255 @@
+"""
+Builds every Cassandra version the upgrade tests use ahead of a run, so
+the first test of each upgrade class doesn't wait for ccm to fetch and
+build its versions, one at a time.
+
+The versions are those of build_upgrade_pairs() and MULTI_UPGRADES. They
+are built concurrently, each with the JDK it runs on (JAVA<N>_HOME), into
+the directories ccm's repository cache would build them in, from ccm's
+git cache. With --mirror, a local git mirror of apache/cassandra becomes
+the origin of that cache, so neither this script nor ccm, when the tests
+later set the versions up, need network access. Released versions are
+built from their tag rather than downloaded. local: slugs are built from
+their own repository.
+
+The commit and a hash of the built jars of each version are recorded in
+ccm's repository directory, and versions whose commit and jars didn't
+change since are skipped. Call it from the directory you'd call
+`nosetests` from, with the same environment:
+
+    python -m upgrade_tests.prebuild_versions --mirror ~/src/cassandra.git --jobs 4
+
+The build dependencies must already be in the local maven repository for
+ant to build without network access.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+from collections import namedtuple
+from multiprocessing import Pool
+
+from ccmlib import repository
+from ccmlib.common import get_default_path
+from six import print_
+
+from upgrade_tests.upgrade_manifest import build_upgrade_pairs
+from upgrade_tests.upgrade_through_versions_test import MULTI_UPGRADES
+
+RELEASE = re.compile(r'^\d+\.\d+(\.\d+)?$')
+RECORD_FILE = 'dtest-prebuilt-versions.json'
+
+# source is the repository the cache mirrors, None for the cache's current origin
+BuildSpec = namedtuple('BuildSpec', ['version', 'ref', 'source', 'cache', 'directory', 'java_version'])
+
+
+def repository_dir():
+    path = os.path.join(get_default_path(), 'repository')
+    if not os.path.exists(path):
+        os.mkdir(path)
+    return path
+
+
+def upgrade_versions():
+    """
+    Every version the upgrade tests set up, mapped to the highest java
+    version it runs on. The local build, which isn't set up through ccm,
+    isn't one of them.
+    """
+    metas = [meta for pair in build_upgrade_pairs() for meta in (pair.starting_meta, pair.upgrade_meta)]
+    metas.extend(meta for upgrade in MULTI_UPGRADES if all(upgrade.version_metas) for meta in upgrade.version_metas)
+    versions = {}
+    for meta in metas:
+        if isinstance(meta.version, basestring):
+            versions[meta.version] = max(versions.get(meta.version, 0), meta.java_version)
+    return versions
+
+
+def build_spec(version, java_version, mirror=None):
+    """
+    How to build version the way ccm would set it up. Raises ValueError for
+    versions only ccm can set up, from the network.
+    """
+    apache_cache = os.path.join(repository_dir(), '_git_cache_apache')
+    if version.startswith('git:'):
+        return BuildSpec(version, version.split(':', 1)[1], mirror, apache_cache, repository.directory_name(version),
+                         java_version)
+    if version.startswith('github:'):
+        user, ref = repository.github_username_and_branch_name(version)
+        if user != 'apache':
+            raise ValueError('{} is not in the apache repository'.format(version))
+        return BuildSpec(version, ref, mirror, apache_cache, repository.directory_name(version), java_version)
+    if version.startswith('local:'):
+        path = version.split(':')[1]
+        # the cache ccm uses for local: slugs
+        cache = os.path.join(repository_dir(), '_git_cache_local_{}'.format(path))
+        return BuildSpec(version, version.split(':')[-1], path, cache, repository.directory_name(version), java_version)
+    if RELEASE.match(version):
+        # ccm uses the directory of a release as is, whether downloaded or built
+        return BuildSpec(version, 'cassandra-' + version, mirror, apache_cache, repository.directory_name(version),
+                         java_version)
+    raise ValueError('{} is not a version that can be built ahead'.format(version))
+
+
+def git(cwd, *args):
+    return subprocess.check_output(('git',) + args, cwd=cwd, stderr=subprocess.STDOUT).strip()
+
+
+def update_cache(source, cache):
+    """
+    Brings ccm's git cache up to date with source, making source its
+    origin. A None source updates the cache from its current origin.
+    """
+    if not os.path.exists(cache):
+        if source is None:
+            raise ValueError('There is no git cache in {} yet, a --mirror is needed to create it'.format(cache))
+        git(repository_dir(), 'clone', '--mirror', source, cache)
+        return
+    if source is not None:
+        git(cache, 'remote', 'set-url', 'origin', source)
+    git(cache, 'fetch', '-fup', 'origin', '+refs/*:refs/*')
+
+
+def resolve(spec):
+    """
+    The commit spec.ref is at in its cache.
+    """
+    return git(spec.cache, 'rev-parse', '--verify', '{}^{{commit}}'.format(spec.ref))
+
+
+def content_hash(directory):
+    """
+    A hash of the jars built in directory, None if there are none.
+    """
+    digest = hashlib.sha1()
+    jars = 0
+    for root, dirs, files in os.walk(os.path.join(directory, 'build')):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith('.jar'):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, directory))
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(chunk)
+                jars += 1
+    return digest.hexdigest() if jars else None
+
+
+def load_record(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_record(path, record):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(record, f, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+
+def is_up_to_date(spec, commit, recorded):
+    return (recorded is not None and os.path.isdir(spec.directory) and recorded.get('commit') == commit and
+            recorded.get('content_hash') == content_hash(spec.directory))
+
+
+def build(spec):
+    """
+    Checks spec.ref out of its cache into spec.directory, as ccm does, and
+    builds it. Runs in a process of its own, as it switches JAVA_HOME.
+    Returns (version, content hash, error).
+    """
+    try:
+        java_home = os.environ.get('JAVA{}_HOME'.format(spec.java_version))
+        if java_home:
+            os.environ['JAVA_HOME'] = java_home
+        if os.path.exists(spec.directory):
+            shutil.rmtree(spec.directory)
+        git(repository_dir(), 'clone', spec.cache, spec.directory)
+        if subprocess.call(['git', 'show-ref', '--verify', '--quiet', 'refs/heads/' + spec.ref], cwd=spec.cache) == 0:
+            git(spec.directory, 'checkout', '-B', spec.ref, '--track', 'origin/' + spec.ref)
+        else:
+            git(spec.directory, 'checkout', spec.ref)
+        repository.compile_version(spec.ref, spec.directory)
+        return spec.version, content_hash(spec.directory), None
+    except BaseException as e:
+        if os.path.exists(spec.directory):
+            shutil.rmtree(spec.directory, ignore_errors=True)
+        output = getattr(e, 'output', None)
+        return spec.version, None, '{!r}{}'.format(e, '\n' + output if output else '')
+
+
+def prebuild(versions, mirror=None, jobs=1, force=False):
+    """
+    Builds versions, a dict of versions to java versions, that aren't
+    already built at their current commit. Returns the errors, by version.
+    """
+    errors = {}
+    specs = []
+    for version, java_version in sorted(versions.items()):
+        try:
+            specs.append(build_spec(version, java_version, mirror))
+        except ValueError as e:
+            print_('Skipping {}, ccm will set it up: {}'.format(version, e))
+
+    for source, cache in sorted({(spec.source, spec.cache) for spec in specs}):
+        print_('Updating {}{}'.format(cache, ' from ' + source if source else ''))
+        try:
+            update_cache(source, cache)
+        except (ValueError, subprocess.CalledProcessError) as e:
+            for spec in [spec for spec in specs if spec.cache == cache]:
+                errors[spec.version] = 'could not update {}: {}'.format(cache, getattr(e, 'output', None) or e)
+                specs.remove(spec)
+
+    record_path = os.path.join(repository_dir(), RECORD_FILE)
+    record = load_record(record_path)
+    commits = {}
+    to_build = []
+    for spec in specs:
+        try:
+            commits[spec.version] = resolve(spec)
+        except subprocess.CalledProcessError as e:
+            errors[spec.version] = 'could not resolve {}: {}'.format(spec.ref, e.output)
+            continue
+        if not force and is_up_to_date(spec, commits[spec.version], record.get(spec.version)):
+            print_('{} is up to date at {}'.format(spec.version, commits[spec.version]))
+        else:
+            to_build.append(spec)
+
+    if to_build:
+        print_('Building {} with {} jobs'.format(', '.join(spec.version for spec in to_build), jobs))
+        pool = Pool(jobs)
+        try:
+            for version, digest, error in pool.imap_unordered(build, to_build):
+                if error is not None:
+                    print_('Failed to build {}: {}'.format(version, error))
+                    errors[version] = error
+                    record.pop(version, None)
+                else:
+                    print_('Built {} at {}'.format(version, commits[version]))
+                    record[version] = {'commit': commits[version], 'content_hash': digest}
+                # saved as builds complete, so an interrupted run keeps what was built
+                save_record(record_path, record)
+        finally:
+            pool.close()
+            pool.join()
+    return errors
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Builds the Cassandra versions used by the upgrade tests ahead of a run.')
+    parser.add_argument('--mirror', help='a local git mirror of apache/cassandra, to build the versions from')
+    parser.add_argument('--jobs', type=int, default=2, help='how many versions to build at once')
+    parser.add_argument('--force', action='store_true', help='rebuild versions that are up to date')
+    args = parser.parse_args()
+
+    mirror = os.path.abspath(os.path.expanduser(args.mirror)) if args.mirror else None
+    errors = prebuild(upgrade_versions(), mirror, args.jobs, args.force)
+    if errors:
+        print_('Failed: {}'.format(', '.join(sorted(errors))))
+        sys.exit(1)
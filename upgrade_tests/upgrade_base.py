@@ -2,12 +2,16 @@ import os
 import sys
 import time
 from abc import ABCMeta
-from unittest import skipIf
+from unittest import TestResult, skipIf
 
 from ccmlib.common import get_version_from_build, is_win
+from nose.config import Config
 from tools.jmxutils import remove_perf_disable_shared_mem
+from tools.readiness import ClusterNotReady, wait_for_ready
 
-from dtest import CASSANDRA_VERSION_FROM_BUILD, DEBUG, Tester, debug, create_ks
+from dtest import (CASSANDRA_VERSION_FROM_BUILD, CLUSTER_TEMPLATES, DEBUG, ENABLE_CLUSTER_TEMPLATES, UPGRADE_BATCH, Tester,
+                   create_ks, debug, warning)
+from upgrade_batch import UpgradeBatch
 
 
 def switch_jdks(major_version_int):
@@ -41,6 +45,10 @@ class UpgradeTester(Tester):
     # make this an abc so we can get all subclasses with __subclasses__()
     __metaclass__ = ABCMeta
     NODES, RF, __test__, CL, UPGRADE_PATH = 2, 1, False, None, None
+    # how long do_upgrade waits for the cluster to settle before yielding the sessions, at most the 2 * 5s it used to sleep
+    SETTLE_TIMEOUT = 10
+    # with UPGRADE_BATCH=yes, run the class's tests against one upgrade, see upgrade_batch
+    batch_upgrades = False
 
     # known non-critical bug during teardown:
     # https://issues.apache.org/jira/browse/CASSANDRA-12340
@@ -62,8 +70,51 @@ class UpgradeTester(Tester):
             r'RejectedExecutionException.*ThreadPoolExecutor has shut down',  # see  CASSANDRA-12364
         ]
         self.enable_for_jolokia = False
+        self.upgrade_batch = None
         super(UpgradeTester, self).__init__(*args, **kwargs)
 
+    def run(self, result=None):
+        if UPGRADE_BATCH and self.batch_upgrades and self._testMethodName != 'run_upgrade_batch':
+            outcome = self.batched_outcome()
+            if outcome is not None:
+                # the test already passed or skipped in the batch, no need for a cluster
+                kind, message = outcome
+                self.setUp = self.tearDown = lambda: None
+                setattr(self, self._testMethodName, (lambda: self.skip(message)) if kind == 'skip' else (lambda: None))
+        return super(UpgradeTester, self).run(result)
+
+    def batched_outcome(self):
+        """
+        The outcome of this test in the upgrade batch of its class, which the
+        class's first test to run runs. None if the test has to run on its
+        own.
+        """
+        cls = type(self)
+        if '_upgrade_batch_outcomes' not in cls.__dict__:
+            runner = cls('run_upgrade_batch')
+            result = TestResult()
+            runner.run(result)
+            if result.wasSuccessful():
+                cls._upgrade_batch_outcomes = getattr(runner, 'upgrade_batch_outcomes', {})
+            else:
+                # e.g. errors in the logs of the shared cluster, that no test in particular can be blamed for
+                warning('Upgrade batch of {} failed, running its tests on their own: {}'.format(
+                    cls.__name__, [str(error) for _, error in result.errors + result.failures]))
+                cls._upgrade_batch_outcomes = {}
+        return cls._upgrade_batch_outcomes.get(self._testMethodName)
+
+    def run_upgrade_batch(self):
+        """
+        Runs the tests of this class as an UpgradeBatch, on this instance's
+        cluster. Not a test itself.
+        """
+        self.cache_cql_sessions = False  # every batched test gets its own sessions
+        test_match = Config().testMatch
+        names = sorted(name for name in dir(type(self))
+                       if not name.startswith('_') and test_match.search(name) and callable(getattr(self, name))
+                       and not getattr(getattr(self, name), '__unittest_skip__', False))
+        self.upgrade_batch_outcomes = UpgradeBatch(self, names).run()
+
     def setUp(self):
         self.validate_class_config()
         debug("Upgrade test beginning, setting CASSANDRA_VERSION to {}, and jdk to {}. (Prior values will be restored after test)."
@@ -74,6 +125,9 @@ class UpgradeTester(Tester):
 
     def prepare(self, ordered=False, create_keyspace=True, use_cache=False,
                 nodes=None, rf=None, protocol_version=None, cl=None, **kwargs):
+        if self.upgrade_batch is not None:
+            return self.upgrade_batch.prepare(self, ordered=ordered, create_keyspace=create_keyspace, use_cache=use_cache,
+                                              nodes=nodes, rf=rf, protocol_version=protocol_version, cl=cl, **kwargs)
         nodes = self.NODES if nodes is None else nodes
         rf = self.RF if rf is None else rf
 
@@ -98,27 +152,57 @@ class UpgradeTester(Tester):
 
         cluster.set_configuration_options(values={'internode_compression': 'none'})
 
+        self.enable_for_jolokia = kwargs.pop('jolokia', False)
         cluster.populate(nodes)
         node1 = cluster.nodelist()[0]
         cluster.set_install_dir(version=self.UPGRADE_PATH.starting_version)
-        self.enable_for_jolokia = kwargs.pop('jolokia', False)
         if self.enable_for_jolokia:
             remove_perf_disable_shared_mem(node1)
 
+        state_key = self.prepared_state_key(nodes, rf, create_keyspace) if self.cache_prepared_state() else None
+        restored = state_key is not None and CLUSTER_TEMPLATES.restore(state_key, cluster)
         cluster.start(wait_for_binary_proto=True)
 
         node1 = cluster.nodelist()[0]
         time.sleep(0.2)
 
-        if cl:
-            session = self.patient_cql_connection(node1, protocol_version=protocol_version, consistency_level=cl, **kwargs)
-        else:
-            session = self.patient_cql_connection(node1, protocol_version=protocol_version, **kwargs)
-        if create_keyspace:
+        def connect():
+            if cl:
+                return self.patient_cql_connection(node1, protocol_version=protocol_version, consistency_level=cl, **kwargs)
+            return self.patient_cql_connection(node1, protocol_version=protocol_version, **kwargs)
+
+        session = connect()
+        if create_keyspace and not restored:
             create_ks(session, 'ks', rf)
+        if state_key is not None and not restored:
+            session.cluster.shutdown()
+            CLUSTER_TEMPLATES.stop(cluster)
+            CLUSTER_TEMPLATES.save(state_key, cluster)
+            cluster.start(wait_for_binary_proto=True)
+            session = connect()
+        if create_keyspace and state_key is not None:
+            session.set_keyspace('ks')
 
         return session
 
+    def cache_prepared_state(self):
+        """
+        Whether prepare reuses the on-disk state of a cluster an earlier test
+        prepared identically, stopped, rather than populating it and creating
+        its keyspace again. See dtest.ClusterTemplateCache.
+        """
+        return ENABLE_CLUSTER_TEMPLATES and self.allow_cluster_templates
+
+    def prepared_state_key(self, nodes, rf, create_keyspace):
+        """
+        Keys the prepared state by what prepare does beyond populating the
+        cluster. The starting version, partitioner and config options, which
+        include the cluster_options and the row cache of use_cache, are part
+        of every template key.
+        """
+        return CLUSTER_TEMPLATES.template_key(self.cluster, ('UpgradeTester.prepare', nodes, rf, create_keyspace,
+                                                             self.enable_for_jolokia), {})
+
     def do_upgrade(self, session, return_nodes=False, **kwargs):
         """
         Upgrades the first node in the cluster and returns a list of
@@ -127,6 +211,11 @@ class UpgradeTester(Tester):
         is True, a tuple of (is_upgraded, Session, Node) will be
         returned instead.
         """
+        if self.upgrade_batch is not None:
+            return self.upgrade_batch.do_upgrade(self, return_nodes, **kwargs)
+        return self._do_upgrade(session, return_nodes, **kwargs)
+
+    def _do_upgrade(self, session, return_nodes=False, **kwargs):
         session.cluster.shutdown()
         node1 = self.cluster.nodelist()[0]
         node2 = self.cluster.nodelist()[1]
@@ -152,15 +241,7 @@ class UpgradeTester(Tester):
         # this is a bandaid; after refactoring, upgrades should account for protocol version
         new_version_from_build = get_version_from_build(node1.get_install_dir())
 
-        # Check if a since annotation with a max_version was set on this test.
-        # The since decorator can only check the starting version of the upgrade,
-        # so here we check to new version of the upgrade as well.
-        if hasattr(self, 'max_version') and self.max_version is not None and new_version_from_build >= self.max_version:
-            self.skip("Skipping test, new version {} is equal to or higher than max version {}".format(new_version_from_build, self.max_version))
-
-        if (new_version_from_build >= '3' and self.protocol_version is not None and self.protocol_version < 3):
-            self.skip('Protocol version {} incompatible '
-                      'with Cassandra version {}'.format(self.protocol_version, new_version_from_build))
+        self.check_upgrade_applies(new_version_from_build)
         node1.set_log_level("DEBUG" if DEBUG else "INFO")
         node1.set_configuration_options(values={'internode_compression': 'none'})
 
@@ -193,15 +274,39 @@ class UpgradeTester(Tester):
         else:
             sessions_and_meta.append((False, session))
 
-        # Let the nodes settle briefly before yielding connections in turn (on the upgraded and non-upgraded alike)
+        # Let the nodes settle before yielding connections in turn (on the upgraded and non-upgraded alike)
         # CASSANDRA-11396 was the impetus for this change, wherein some apparent perf noise was preventing
         # CL.ALL from being reached. The newly upgraded node needs to settle because it has just barely started, and each
         # non-upgraded node needs a chance to settle as well, because the entire cluster (or isolated nodes) may have been doing resource intensive activities
         # immediately before.
+        self.wait_for_settled_cluster({node1.name: sessions_and_meta[0][1], node2.name: sessions_and_meta[1][1]})
         for s in sessions_and_meta:
-            time.sleep(5)
             yield s
 
+    def check_upgrade_applies(self, new_version_from_build):
+        # Check if a since annotation with a max_version was set on this test.
+        # The since decorator can only check the starting version of the upgrade,
+        # so here we check to new version of the upgrade as well.
+        if hasattr(self, 'max_version') and self.max_version is not None and new_version_from_build >= self.max_version:
+            self.skip("Skipping test, new version {} is equal to or higher than max version {}".format(new_version_from_build, self.max_version))
+
+        if (new_version_from_build >= '3' and self.protocol_version is not None and self.protocol_version < 3):
+            self.skip('Protocol version {} incompatible '
+                      'with Cassandra version {}'.format(self.protocol_version, new_version_from_build))
+
+    def wait_for_settled_cluster(self, sessions):
+        """
+        Waits, up to SETTLE_TIMEOUT seconds, for the cluster to be ready, see
+        tools.readiness. `sessions` maps node names to sessions exclusive to
+        them. Fails the test, with what didn't settle, if the cluster isn't
+        ready in time.
+        """
+        try:
+            elapsed = wait_for_ready(self.cluster.nodelist(), sessions, timeout=self.SETTLE_TIMEOUT)
+            debug('Cluster settled in {:.1f}s'.format(elapsed))
+        except ClusterNotReady as e:
+            self.fail('The cluster did not settle after the upgrade. {}'.format(e))
+
     def get_version(self):
         node1 = self.cluster.nodelist()[0]
         return node1.get_cassandra_version()
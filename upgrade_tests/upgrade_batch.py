@@ -0,0 +1,214 @@
+"""
+Upgrade batches: running the tests of an upgrade class against a single
+upgrade of a single cluster instead of preparing and upgrading a cluster per
+test.
+
+Each test runs in a thread of its own, up to its do_upgrade, on the shared
+cluster, in a keyspace of its own. Once every test reached do_upgrade the
+cluster is upgraded, once, and each test in turn resumes with sessions on
+the upgraded and the old node.
+
+Tests that don't fit, because they prepare a cluster configured otherwise
+than by default or no keyspace, upgrade twice, fail in the batch or take longer
+than UpgradeBatch.TEST_TIMEOUT to reach do_upgrade or finish, run on their own
+afterwards as usual, so failures are always reported by the test itself on
+a cluster of its own. Tests that passed or skipped in the batch pass or skip
+without a cluster.
+"""
+import sys
+import threading
+from unittest import SkipTest
+
+from ccmlib.common import get_version_from_build
+
+from dtest import create_ks, debug
+
+# prepare arguments that configure the cluster rather than the test's keyspace or sessions
+CLUSTER_ARGUMENTS = ('ordered', 'use_cache', 'nodes', 'start_rpc', 'jolokia')
+
+
+class NotBatchable(Exception):
+    pass
+
+
+class BatchedTest(threading.Thread):
+    """
+    Runs a test, pausing in do_upgrade until the batch upgraded the cluster.
+    """
+
+    def __init__(self, test):
+        super(BatchedTest, self).__init__(name='BatchedTest-' + test._testMethodName)
+        self.daemon = True
+        self.test = test
+        self.outcome = None
+        self.exc_info = None
+        self.keyspace = None
+        self.session_args = None
+        # set when the test paused in do_upgrade or finished
+        self.checkpoint = threading.Event()
+        self.resumed = threading.Event()
+        self.paused = False
+        self.aborted = False
+        # set when the batch gave up waiting for the test, which then runs on its own
+        self.abandoned = False
+
+    def run(self):
+        try:
+            getattr(self.test, self.test._testMethodName)()
+        except NotBatchable as e:
+            debug('{} not batched: {}'.format(self.test._testMethodName, e))
+        except SkipTest as e:
+            self.outcome = ('skip', str(e))
+        except Exception:
+            self.exc_info = sys.exc_info()
+            debug('{} failed in the upgrade batch, will run on its own: {!r}'.format(self.test._testMethodName,
+                                                                                     self.exc_info[1]))
+        else:
+            self.outcome = ('pass', None)
+        finally:
+            self.paused = False
+            self.checkpoint.set()
+
+    def pause(self):
+        self.paused = True
+        self.checkpoint.set()
+        self.resumed.wait()
+        if self.aborted:
+            raise NotBatchable('the batch upgrade failed')
+
+    def resume(self, timeout, aborted=False):
+        self.aborted = aborted
+        self.checkpoint.clear()
+        self.resumed.set()
+        self.wait(timeout)
+
+    def wait(self, timeout):
+        """
+        Waits up to `timeout` seconds for the test to pause or finish, and
+        abandons it if it doesn't. An abandoned test that reaches do_upgrade
+        later doesn't wait for the upgrade.
+        """
+        if not self.checkpoint.wait(timeout):
+            debug('{} took more than {}s in the upgrade batch, will run on its own'.format(
+                self.test._testMethodName, timeout))
+            self.abandoned = True
+            self.aborted = True
+            self.resumed.set()
+
+
+class UpgradeBatch(object):
+    """
+    Runs the tests `names` of `runner`'s class as a batch, see the module
+    docstring. `runner` is the test driving the batch: its cluster is the
+    shared one.
+    """
+    TEST_TIMEOUT = 600  # seconds a test may take to reach do_upgrade, or to finish once resumed
+
+    def __init__(self, runner, names):
+        self.runner = runner
+        self.names = names
+        # the cluster of a plain prepare(), whatever the order of the tests
+        self.cluster_arguments = dict.fromkeys(CLUSTER_ARGUMENTS)
+        self.cluster_arguments['nodes'] = runner.NODES
+        self.session = None
+        self.tests = []
+
+    def run(self):
+        """
+        Returns the outcomes of the tests that passed or skipped in the
+        batch, by name, as ('pass', None) or ('skip', message).
+        """
+        for name in self.names:
+            test = type(self.runner)(name)
+            test.__dict__.update((k, v) for k, v in self.runner.__dict__.items() if not k.startswith('_'))
+            test.upgrade_batch = self
+            thread = BatchedTest(test)
+            self.tests.append(thread)
+            thread.start()
+            thread.wait(self.TEST_TIMEOUT)
+
+        paused = [thread for thread in self.tests if thread.paused and not thread.abandoned]
+        if paused:
+            self.upgrade(paused)
+        return {thread.test._testMethodName: thread.outcome for thread in self.tests
+                if thread.outcome and not thread.abandoned}
+
+    def upgrade(self, paused):
+        """
+        Upgrades the cluster, letting it settle once for all the `paused`
+        tests, then resumes them in turn.
+        """
+        try:
+            # the runner's do_upgrade waits for the cluster to settle before it yields
+            for _ in self.runner.do_upgrade(self.session, return_nodes=True):
+                pass
+        except BaseException:
+            for thread in paused:
+                thread.resume(self.TEST_TIMEOUT, aborted=True)
+            raise
+        debug('Upgraded the cluster for {} batched tests'.format(len(paused)))
+        for thread in paused:
+            thread.resume(self.TEST_TIMEOUT)
+
+    def _thread(self, test):
+        return next(thread for thread in self.tests if thread.test is test)
+
+    def prepare(self, test, create_keyspace=True, rf=None, protocol_version=None, cl=None, **kwargs):
+        """
+        Stands in for UpgradeTester.prepare in batched tests: the cluster is
+        prepared by the first test and every test gets a keyspace of its own.
+        `cl` only applies to the returned session, as sessions after the
+        upgrade use the class's CL.
+        """
+        thread = self._thread(test)
+        if thread.keyspace is not None:
+            raise NotBatchable('prepare called twice')
+        if not create_keyspace:
+            raise NotBatchable('prepare without a keyspace')
+        cluster_arguments = {name: kwargs.pop(name, None) or None for name in CLUSTER_ARGUMENTS}
+        cluster_arguments['nodes'] = cluster_arguments['nodes'] or test.NODES
+        if cluster_arguments != self.cluster_arguments:
+            raise NotBatchable('prepare({}) needs a cluster of its own'.format(cluster_arguments))
+        if self.session is None:
+            self.session = self.runner.prepare(nodes=cluster_arguments['nodes'])
+
+        test.protocol_version = protocol_version
+        # not ks<n>, which tests create themselves
+        thread.keyspace = 'upgrade_batch_ks{}'.format(self.tests.index(thread))
+        thread.session_args = kwargs
+        session = self._connect(test, self.runner.cluster.nodelist()[0], exclusive=False, cl=cl)
+        create_ks(session, thread.keyspace, test.RF if rf is None else rf)
+        return session
+
+    def _connect(self, test, node, exclusive=True, cl=None):
+        thread = self._thread(test)
+        kwargs = dict(thread.session_args)
+        cl = test.CL if cl is None else cl
+        if cl:
+            kwargs['consistency_level'] = cl
+        connect = self.runner.patient_exclusive_cql_connection if exclusive else self.runner.patient_cql_connection
+        return connect(node, protocol_version=test.protocol_version, **kwargs)
+
+    def do_upgrade(self, test, return_nodes=False, **kwargs):
+        """
+        Stands in for UpgradeTester.do_upgrade in batched tests: waits for
+        the batch's upgrade, then yields like do_upgrade does. The cluster
+        already settled after the upgrade, see upgrade().
+        """
+        thread = self._thread(test)
+        if thread.keyspace is None or thread.session_args is None:
+            raise NotBatchable('do_upgrade without prepare, or called twice')
+        thread.session_args.update(kwargs)
+        thread.pause()
+
+        node1, node2 = self.runner.cluster.nodelist()[:2]
+        test.check_upgrade_applies(get_version_from_build(node1.get_install_dir()))
+        sessions = []
+        for is_upgraded, node in ((True, node1), (False, node2)):
+            session = self._connect(test, node)
+            session.set_keyspace(thread.keyspace)
+            sessions.append((is_upgraded, session, node) if return_nodes else (is_upgraded, session))
+        thread.session_args = None
+
+        for s in sessions:
+            yield s
@@ -7,6 +7,9 @@ from dtest import (CASSANDRA_GITREF, CASSANDRA_VERSION_FROM_BUILD,
 # They also contain VersionMeta's for each version the path is testing
 UpgradePath = namedtuple('UpgradePath', ('name', 'starting_version', 'upgrade_version', 'starting_meta', 'upgrade_meta'))
 
+# UpgradeGroup's contain the UpgradePath's which start from the same cluster state: same starting version, and so protocol
+UpgradeGroup = namedtuple('UpgradeGroup', ('name', 'starting_meta', 'protocol_version', 'paths'))
+
 
 def _get_version_family():
     """
@@ -191,3 +194,25 @@ def build_upgrade_pairs():
             )
 
     return valid_upgrade_pairs
+
+
+def plan_upgrade_groups(upgrade_pairs):
+    """
+    Groups UpgradePath's, e.g. from build_upgrade_pairs(), by starting VersionMeta. The protocol version
+    they are tested with is the highest of their starting version.
+
+    The upgrade classes of a group prepare the same cluster state before upgrading, so they can prepare it
+    once, save it as a cluster template and each upgrade a copy of it. Classes of different groups share
+    nothing, so run_dtests.py can run groups on different workers.
+
+    Returns a list of UpgradeGroup's, in the order their first path appears.
+    """
+    groups = []
+    for path in upgrade_pairs:
+        group = next((g for g in groups if g.starting_meta == path.starting_meta), None)
+        if group is None:
+            group = UpgradeGroup(name='From_{}'.format(path.starting_meta.name), starting_meta=path.starting_meta,
+                                 protocol_version=path.starting_meta.max_proto_v, paths=[])
+            groups.append(group)
+        group.paths.append(path)
+    return groups
@@ -3,9 +3,11 @@ import os
 import pprint
 import random
 import signal
+import threading
 import time
 import uuid
-from collections import defaultdict, namedtuple
+from collections import defaultdict, deque, namedtuple
+from functools import partial
 from multiprocessing import Process, Queue
 from Queue import Empty, Full
 from unittest import skipUnless
@@ -16,21 +18,23 @@ from cassandra.query import SimpleStatement
 from nose.plugins.attrib import attr
 from six import print_
 
-from dtest import RUN_STATIC_UPGRADE_MATRIX, Tester, debug
+from dtest import (CLUSTER_TEMPLATES, ENABLE_CLUSTER_TEMPLATES,
+                   RUN_STATIC_UPGRADE_MATRIX, Tester, debug)
 from tools.misc import generate_ssl_stores, new_node
+from tools.pipelinedload import Batcher, Pipeline, RowBatches
 from upgrade_base import switch_jdks
 from upgrade_manifest import (build_upgrade_pairs, current_2_0_x,
                               current_2_1_x, current_2_2_x, current_3_0_x,
-                              indev_2_2_x, indev_3_x)
+                              indev_2_2_x, indev_3_x, plan_upgrade_groups)
 
 
 def data_writer(tester, to_verify_queue, verification_done_queue, rewrite_probability=0):
     """
-    Process for writing/rewriting data continuously.
+    Process for writing/rewriting data continuously, tester.LOAD_IN_FLIGHT writes at a time.
 
-    Pushes to a queue to be consumed by data_checker.
+    Pushes batches of written rows to a RowBatches to be consumed by data_checker.
 
-    Pulls from a queue of already-verified rows written by data_checker that it can overwrite.
+    Pulls from a queue of batches of already-verified rows written by data_checker that it can overwrite.
 
     Intended to be run using multiprocessing.
     """
@@ -40,45 +44,58 @@ def data_writer(tester, to_verify_queue, verification_done_queue, rewrite_probab
     prepared = session.prepare("UPDATE cf SET v=? WHERE k=?")
     prepared.consistency_level = ConsistencyLevel.QUORUM
 
+    pipeline = Pipeline(session, 'data_writer', tester.LOAD_IN_FLIGHT, tester.LOAD_REPORT_INTERVAL)
+    written = Batcher(to_verify_queue.put, tester.LOAD_BATCH_SIZE)
+    rewritable = deque()
+    stopping = threading.Event()
+
     def handle_sigterm(signum, frame):
-        # need to close queue gracefully if possible, or the data_checker process
-        # can't seem to empty the queue and test failures result.
-        to_verify_queue.close()
-        exit(0)
+        # stop writing, but ship the writes in flight to the data_checker first, or
+        # the rows written (but not verified) never get verified and test failures result.
+        stopping.set()
 
     signal.signal(signal.SIGTERM, handle_sigterm)
 
-    while True:
-        try:
+    try:
+        while not stopping.is_set():
             key = None
 
             if (rewrite_probability > 0) and (random.randint(0, 100) <= rewrite_probability):
-                try:
-                    key = verification_done_queue.get_nowait()
-                except Empty:
-                    # we wanted a re-write but the re-writable queue was empty. oh well.
-                    pass
+                if not rewritable:
+                    try:
+                        rewritable.extend(verification_done_queue.get_nowait())
+                    except Empty:
+                        # we wanted a re-write but the re-writable queue was empty. oh well.
+                        pass
+                if rewritable:
+                    key = rewritable.popleft()
 
             key = key or uuid.uuid4()
 
             val = uuid.uuid4()
 
-            session.execute(prepared, (val, key))
+            pipeline.submit(prepared, (val, key), lambda rows, key=key, val=val: written.add((key, val)))
 
-            to_verify_queue.put_nowait((key, val,))
-        except Exception:
-            debug("Error in data writer process!")
-            to_verify_queue.close()
-            raise
+            written.flush(partial=False)
+            pipeline.report()
+
+        pipeline.drain()
+        written.flush()
+        pipeline.report(force=True)
+    except Exception:
+        debug("Error in data writer process!")
+        raise
+    finally:
+        to_verify_queue.close()
 
 
 def data_checker(tester, to_verify_queue, verification_done_queue):
     """
-    Process for checking data continuously.
+    Process for checking data continuously, tester.LOAD_IN_FLIGHT reads at a time.
 
-    Pulls from a queue written to by data_writer to know what to verify.
+    Pulls batches from a RowBatches written to by data_writer to know what to verify.
 
-    Pushes to a queue to tell data_writer what's been verified and could be a candidate for re-writing.
+    Pushes batches to a queue to tell data_writer what's been verified and could be a candidate for re-writing.
 
     Intended to be run using multiprocessing.
     """
@@ -88,6 +105,24 @@ def data_checker(tester, to_verify_queue, verification_done_queue):
     prepared = session.prepare("SELECT v FROM cf WHERE k=?")
     prepared.consistency_level = ConsistencyLevel.QUORUM
 
+    def put_rewritable(keys):
+        try:
+            verification_done_queue.put_nowait(keys)
+        except Full:
+            # the rewritable queue is full, not a big deal. drop these.
+            # we keep the rewritable queue held to a modest max size
+            # and allow dropping some rewritables because we don't want to
+            # rewrite rows in the same sequence as originally written
+            pass
+
+    pipeline = Pipeline(session, 'data_checker', tester.LOAD_IN_FLIGHT, tester.LOAD_REPORT_INTERVAL)
+    verified = Batcher(put_rewritable, tester.LOAD_BATCH_SIZE)
+
+    def check(key, expected_val, rows):
+        to_verify_queue.verified()
+        tester.assertEqual(expected_val, rows[0][0], "Data did not match expected value!")
+        verified.add(key)
+
     def handle_sigterm(signum, frame):
         # need to close queue gracefully if possible, or the data_checker process
         # can't seem to empty the queue and test failures result.
@@ -100,27 +135,20 @@ def data_checker(tester, to_verify_queue, verification_done_queue):
         try:
             # here we could block, but if the writer process terminates early with an empty queue
             # we would end up blocking indefinitely
-            (key, expected_val) = to_verify_queue.get_nowait()
+            batch = to_verify_queue.get(timeout=1)
 
-            actual_val = session.execute(prepared, (key,))[0][0]
+            for key, expected_val in batch:
+                pipeline.submit(prepared, (key,), partial(check, key, expected_val))
         except Empty:
-            time.sleep(0.1)  # let's not eat CPU if the queue is empty
-            continue
+            pipeline.check()
+            verified.flush()
         except Exception:
             debug("Error in data verifier process!")
             verification_done_queue.close()
             raise
         else:
-            try:
-                verification_done_queue.put_nowait(key)
-            except Full:
-                # the rewritable queue is full, not a big deal. drop this one.
-                # we keep the rewritable queue held to a modest max size
-                # and allow dropping some rewritables because we don't want to
-                # rewrite rows in the same sequence as originally written
-                pass
-
-        tester.assertEqual(expected_val, actual_val, "Data did not match expected value!")
+            verified.flush(partial=False)
+        pipeline.report()
 
 
 def counter_incrementer(tester, to_verify_queue, verification_done_queue, rewrite_probability=0):
@@ -229,6 +257,7 @@ class UpgradeTester(Tester):
     test_version_metas = None  # set on init to know which versions to use
     subprocs = None  # holds any subprocesses, for status checking and cleanup
     extra_config = None  # holds a non-mutable structure that can be cast as dict()
+    starting_state_shared_by = 1  # number of classes upgrading from the same starting state, see plan_upgrade_groups
     __test__ = False  # this is a base class only
     ignore_log_patterns = (
         # This one occurs if we do a non-rolling upgrade, the node
@@ -241,6 +270,11 @@ class UpgradeTester(Tester):
         # Normal occurance. See CASSANDRA-12026. Likely won't be needed after C* 4.0.
         r'Unknown column cdc during deserialization',
     )
+    # the continuous load of rolling upgrades: statements in flight per process,
+    # rows per batch shipped for verification and seconds between throughput reports
+    LOAD_IN_FLIGHT = 50
+    LOAD_BATCH_SIZE = 100
+    LOAD_REPORT_INTERVAL = 30
 
     def __init__(self, *args, **kwargs):
         self.subprocs = []
@@ -305,10 +339,17 @@ class UpgradeTester(Tester):
             generate_ssl_stores(self.test_path)
             self.cluster.enable_internode_ssl(self.test_path)
 
+        # the stores generated for internode ssl are the test's own, so its starting state is never shared
+        cache_state = populate and create_schema and not internode_ssl and self.cache_starting_state(rolling)
         if populate:
             # Start with 3 node cluster
             debug('Creating cluster (%s)' % self.test_version_metas[0].version)
             cluster.populate(3)
+        state_key = self.starting_state_key(rolling) if cache_state else None
+        restored = state_key is not None and CLUSTER_TEMPLATES.restore(state_key, cluster)
+        if restored:
+            debug('Restored cluster and schema (%s) prepared by an earlier test' % self.test_version_metas[0].version)
+        if populate:
             [node.start(use_jna=True, wait_for_binary_proto=True) for node in cluster.nodelist()]
         else:
             debug("Skipping cluster creation (should already be built)")
@@ -318,12 +359,17 @@ class UpgradeTester(Tester):
             node_name = 'node' + str(i)
             setattr(self, node_name, node)
 
-        if create_schema:
+        if create_schema and not restored:
             if rolling:
                 self._create_schema_for_rolling()
             else:
                 self._create_schema()
-        else:
+            if state_key is not None:
+                # save the starting state for the other upgrades from the same version, see plan_upgrade_groups
+                CLUSTER_TEMPLATES.stop(cluster)
+                CLUSTER_TEMPLATES.save(state_key, cluster)
+                [node.start(use_jna=True, wait_for_binary_proto=True) for node in cluster.nodelist()]
+        elif not create_schema:
             debug("Skipping schema creation (should already be built)")
         time.sleep(5)  # sigh...
 
@@ -350,10 +396,12 @@ class UpgradeTester(Tester):
 
                 self.cluster.set_install_dir(version=version_meta.version)
 
-            # Stop write processes
+            # Stop write processes, letting them ship their last writes for verification
             write_proc.terminate()
+            write_proc.join(60)
             # wait for the verification queue's to empty (and check all rows) before continuing
-            self._wait_until_queue_condition('writes pending verification', verification_queue, operator.le, 0, max_wait_s=1200)
+            self._wait_until_queue_condition('writes pending verification', verification_queue, operator.le, 0, max_wait_s=1200,
+                                             subprocs=[verify_proc])
             self._check_on_subprocs([verify_proc])  # make sure the verification processes are running still
 
             self._terminate_subprocs()
@@ -380,6 +428,27 @@ class UpgradeTester(Tester):
 
         cluster.stop()
 
+    def cache_starting_state(self, rolling):
+        """
+        Whether upgrade_scenario reuses the on-disk state of a cluster an earlier test populated and
+        created the schema in, stopped, rather than doing it again. See dtest.ClusterTemplateCache.
+
+        Saving the state costs a stop and start of the cluster, so it is only done when more than one
+        test starts from it: parallel_upgrade_test and bootstrap_test of a class share a state, and so
+        do the classes of an UpgradeGroup.
+        """
+        tests = 1 if rolling or not isinstance(self, BootstrapMixin) else 2
+        return (ENABLE_CLUSTER_TEMPLATES and self.allow_cluster_templates and
+                self.starting_state_shared_by * tests > 1)
+
+    def starting_state_key(self, rolling):
+        """
+        Keys the starting state by what upgrade_scenario does beyond populating the cluster. The starting
+        version and extra_config are part of every template key.
+        """
+        return CLUSTER_TEMPLATES.template_key(self.cluster, ('UpgradeTester.upgrade_scenario', 3, rolling,
+                                                             self.protocol_version), {})
+
     def tearDown(self):
         # just to be super sure we get cleaned up
         self._terminate_subprocs()
@@ -510,12 +579,15 @@ class UpgradeTester(Tester):
                 self.assertEqual(x, k)
                 self.assertEqual(str(x), v)
 
-    def _wait_until_queue_condition(self, label, queue, opfunc, required_len, max_wait_s=600):
+    def _wait_until_queue_condition(self, label, queue, opfunc, required_len, max_wait_s=600, subprocs=()):
         """
         Waits up to max_wait_s for queue size to return True when evaluated against a condition function from the operator module.
 
         Label is just a string identifier for easier debugging.
 
+        Stops waiting, with the error of _check_on_subprocs, if any of subprocs terminates, as the queue
+        would then never reach its size.
+
         On Mac OS X may not be able to check queue size, in which case it will not block.
 
         If time runs out, raises RuntimeError.
@@ -532,6 +604,8 @@ class UpgradeTester(Tester):
                 debug("{} queue size ({}) is '{}' to {}. Continuing.".format(label, qsize, opfunc.__name__, required_len))
                 break
 
+            self._check_on_subprocs(subprocs)
+
             if divmod(round(time.time()), 30)[1] == 0:
                 debug("{} queue size is at {}, target is to reach '{}' {}".format(label, qsize, opfunc.__name__, required_len))
 
@@ -542,17 +616,17 @@ class UpgradeTester(Tester):
 
     def _start_continuous_write_and_verify(self, wait_for_rowcount=0, max_wait_s=600):
         """
-        Starts a writer process, a verifier process, a queue to track writes,
-        and a queue to track successful verifications (which are rewrite candidates).
+        Starts a writer process, a verifier process, a RowBatches to track writes,
+        and a queue to track batches of successful verifications (which are rewrite candidates).
 
         wait_for_rowcount provides a number of rows to write before unblocking and continuing.
 
         Returns the writer process, verifier process, and the to_verify_queue.
         """
-        # queue of writes to be verified
-        to_verify_queue = Queue()
-        # queue of verified writes, which are update candidates
-        verification_done_queue = Queue(maxsize=500)
+        # batches of writes to be verified
+        to_verify_queue = RowBatches()
+        # queue of batches of verified writes, which are update candidates
+        verification_done_queue = Queue(maxsize=max(1, 500 // self.LOAD_BATCH_SIZE))
 
         writer = Process(target=data_writer, args=(self, to_verify_queue, verification_done_queue, 25))
         # daemon subprocesses are killed automagically when the parent process exits
@@ -561,7 +635,8 @@ class UpgradeTester(Tester):
         writer.start()
 
         if wait_for_rowcount > 0:
-            self._wait_until_queue_condition('rows written (but not verified)', to_verify_queue, operator.ge, wait_for_rowcount, max_wait_s=max_wait_s)
+            self._wait_until_queue_condition('rows written (but not verified)', to_verify_queue, operator.ge, wait_for_rowcount, max_wait_s=max_wait_s,
+                                             subprocs=[writer])
 
         verifier = Process(target=data_checker, args=(self, to_verify_queue, verification_done_queue))
         # daemon subprocesses are killed automagically when the parent process exits
@@ -578,10 +653,10 @@ class UpgradeTester(Tester):
 
         Returns the writer process, verifier process, and the to_verify_queue.
         """
-        # queue of writes to be verified
-        to_verify_queue = Queue()
-        # queue of verified writes, which are update candidates
-        verification_done_queue = Queue(maxsize=500)
+        # batches of writes to be verified
+        to_verify_queue = RowBatches()
+        # queue of batches of verified writes, which are update candidates
+        verification_done_queue = Queue(maxsize=max(1, 500 // self.LOAD_BATCH_SIZE))
 
         incrementer = Process(target=data_writer, args=(self, to_verify_queue, verification_done_queue, 25))
         # daemon subprocesses are killed automagically when the parent process exits
@@ -590,7 +665,8 @@ class UpgradeTester(Tester):
         incrementer.start()
 
         if wait_for_rowcount > 0:
-            self._wait_until_queue_condition('counters incremented (but not verified)', to_verify_queue, operator.ge, wait_for_rowcount, max_wait_s=max_wait_s)
+            self._wait_until_queue_condition('counters incremented (but not verified)', to_verify_queue, operator.ge, wait_for_rowcount, max_wait_s=max_wait_s,
+                                             subprocs=[incrementer])
 
         count_verifier = Process(target=data_checker, args=(self, to_verify_queue, verification_done_queue))
         # daemon subprocesses are killed automagically when the parent process exits
@@ -742,7 +818,7 @@ class BootstrapMixin(object):
 
 
 def create_upgrade_class(clsname, version_metas, protocol_version,
-                         bootstrap_test=False, extra_config=None):
+                         bootstrap_test=False, extra_config=None, starting_state_shared_by=1):
     """
     Dynamically creates a test subclass for testing the given versions.
 
@@ -752,6 +828,8 @@ def create_upgrade_class(clsname, version_metas, protocol_version,
     'version_list' is a list of versions ccm will recognize, to be upgraded in order.
     'extra_config' is tuple of config options that can (eventually) be cast as a dict,
     e.g. (('partitioner', org.apache.cassandra.dht.Murmur3Partitioner''))
+    'starting_state_shared_by' is the number of classes starting from the same cluster state, the
+    class included, which decides whether that state is worth saving for them.
     """
     if extra_config is None:
         extra_config = (('partitioner', 'org.apache.cassandra.dht.Murmur3Partitioner'),)
@@ -775,7 +853,8 @@ def create_upgrade_class(clsname, version_metas, protocol_version,
         type(
             clsname,
             parent_classes,
-            {'test_version_metas': version_metas, '__test__': True, 'protocol_version': protocol_version, 'extra_config': extra_config}
+            {'test_version_metas': version_metas, '__test__': True, 'protocol_version': protocol_version, 'extra_config': extra_config,
+             'starting_state_shared_by': starting_state_shared_by}
         ))
 
     if clsname in globals():
@@ -841,10 +920,12 @@ for upgrade in MULTI_UPGRADES:
         create_upgrade_class(upgrade.name, [m for m in metas], protocol_version=upgrade.protocol_version, extra_config=upgrade.extra_config)
 
 
-for pair in build_upgrade_pairs():
-    create_upgrade_class(
-        'Test' + pair.name,
-        [pair.starting_meta, pair.upgrade_meta],
-        protocol_version=pair.starting_meta.max_proto_v,
-        bootstrap_test=True
-    )
+for group in plan_upgrade_groups(build_upgrade_pairs()):
+    for pair in group.paths:
+        create_upgrade_class(
+            'Test' + pair.name,
+            [pair.starting_meta, pair.upgrade_meta],
+            protocol_version=group.protocol_version,
+            bootstrap_test=True,
+            starting_state_shared_by=len(group.paths)
+        )